@@ -1,4 +1,5 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
 from src.restaurant_rag import RestaurantRAG
 from src.hotel_rag import HotelRAG
@@ -9,57 +10,195 @@ from src.system_prompt import get_system_prompt_by_context
 from src.web_search import WebSearch
 from src.chat_rag import ChatRAG
 from src.scheduler import RagScheduler
+from src.semantic_cache import SemanticCache, warmup as warmup_semantic_cache
+from src.embeddings_manager import EMBEDDING_DIMENSIONS
 import uvicorn
+import asyncio
+import functools
 import logging
 import traceback
+from typing import Awaitable, Callable, List, NamedTuple, Optional, Tuple
 import os
-import mysql.connector
 import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
-# Configure logging
+# Configure logging (force overrides the configuration done by imported modules)
 logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    force=True
 )
 
-# Database connection configuration
-DB_CONFIG = {
-    'host': '103.116.9.57',
-    'port': 3306,
-    'user': 'boship',
-    'password': 'Admin@1234',
-    'database': 'boship'  # Default database name, replace if needed
-}
+# Load environment variables
+load_dotenv()
+
+# Fixed text of Bé Bơ's answers
+BEBO_PREFIX = "❤️\n\n"
+BEBO_SUFFIX = "\n\nDạ để được nhận nhiều Ưu Đãi và Khuyến Mãi A/C vui lòng nhắn vào đây giúp Bé Bơ ạ https://zalo.me/4018474138015540620 Hoặc gọi: 1900585878 - 0939785878. Giúp em nha!"
+WELCOME_TEXT = "Xin chào anh/chị! Em là Bé Bơ đây ạ! ❤️\n\nEm là nhân viên tư vấn của ShipperRachGia.vn, em có thể giúp anh/chị tìm hiểu về:\n- Nhà hàng và món ăn ngon tại Rạch Giá\n- Khách sạn và dịch vụ lưu trú\n- Dịch vụ giao hàng và vận chuyển\n\nAnh/chị có thể hỏi em bất cứ điều gì về các dịch vụ của ShipperRachGia.vn!" + BEBO_SUFFIX
+# Answer streamed in place of the rest of an answer when OpenAI fails partway
+ANSWER_ERROR_TEXT = "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này."
+DEFAULT_FALLBACK_TEXT = BEBO_PREFIX + "Em chưa có thông tin cụ thể về dịch vụ này. Anh/chị có thể chia sẻ thêm về điều anh/chị đang tìm kiếm được không ạ? Em rất muốn được giúp anh/chị tốt hơn!\n\nTrong lúc đó, anh/chị có thể tham khảo thêm thông tin tại website https://shipperrachgia.vn/ nha!" + BEBO_SUFFIX
+
+# RAG systems are created on first use so import stays cheap and unused services cost nothing.
+# The ones every request needs are created in the app lifespan.
+@functools.cache
+def get_restaurant_rag() -> RestaurantRAG:
+    return RestaurantRAG()
+
+@functools.cache
+def get_hotel_rag() -> HotelRAG:
+    return HotelRAG()
+
+@functools.cache
+def get_delivery_rag() -> DeliveryRAG:
+    return DeliveryRAG()
+
+@functools.cache
+def get_orders_rag() -> OrdersRAG:
+    return OrdersRAG()
+
+@functools.cache
+def get_context_detector() -> ContextDetector:
+    return ContextDetector()
+
+@functools.cache
+def get_web_search() -> WebSearch:
+    return WebSearch()
+
+@functools.cache
+def get_chat_rag() -> ChatRAG:
+    return ChatRAG()
+
+class _UncachedContext(Exception):
+    """Carries a fallback context detection result that must not be cached"""
+    def __init__(self, result):
+        super().__init__(result.get("error"))
+        self.result = result
+
+@functools.lru_cache(maxsize=4096)
+def _cached_detect(question: str) -> dict:
+    result = get_context_detector().detect_context(question)
+    if "error" in result:
+        raise _UncachedContext(result)
+    return result
 
-# Function to get database connection
-def get_db_connection():
+def _detect(question: str) -> dict:
+    """Detect the context of a normalized question, reusing results for repeated questions"""
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        logging.info("Database connection established successfully")
-        return conn
-    except mysql.connector.Error as err:
-        logging.error(f"Database connection error: {err}")
-        raise
-
-# Initialize the RAG systems
-restaurant_rag = RestaurantRAG()
-hotel_rag = HotelRAG()
-delivery_rag = DeliveryRAG()
-orders_rag = OrdersRAG()
-context_detector = ContextDetector()
-web_search = WebSearch()
-chat_rag = ChatRAG()
-
-# Initialize the scheduler but don't start it to avoid Qdrant timeouts
-scheduler = RagScheduler(refresh_interval_minutes=10)
-# scheduler.start()  # Disabled to prevent Qdrant timeouts
+        return _cached_detect(question)
+    except _UncachedContext as e:
+        return e.result
+
+# Semantic caches for near-duplicate questions, one per response type. Unrelated questions
+# often score 0.8-0.9 on ada-002 embeddings, so only very close matches count as hits.
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.95))
+# The unified cache spans every service, so it needs a closer match
+UNIFIED_CACHE_THRESHOLD = float(os.getenv("UNIFIED_CACHE_THRESHOLD", 0.97))
+restaurant_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD)
+hotel_cache = SemanticCache(threshold=SEMANTIC_CACHE_THRESHOLD)
+unified_cache = SemanticCache(threshold=UNIFIED_CACHE_THRESHOLD)
+
+# Order fields shown as children of an order in the unified response, with their labels
+ORDER_CHILD_FIELDS = (("total", "Total: {} VND"), ("address", "Address: {}"))
+
+# Service name of the unified response for the contexts detected from keywords
+KEYWORD_SERVICES = {"restaurant": "restaurant", "accommodation": "hotel"}
+
+def _matches_service(cached_response, context_result: dict) -> bool:
+    """Check that a cached unified response belongs to the service the question is about, when known"""
+    return context_result is None or KEYWORD_SERVICES[context_result["primary_context"]] == cached_response.service_name
+
+# The periodic Qdrant refresh is off by default to avoid Qdrant timeouts. Every worker
+# process would run its own scheduler, so enable it (RAG_SCHEDULER_ENABLED=1) on one process only.
+SCHEDULER_ENABLED = os.getenv("RAG_SCHEDULER_ENABLED", "0") == "1"
+scheduler = None
+
+# Shared thread pool for the blocking RAG, LLM and Qdrant calls so they don't stall the event loop
+EXECUTOR = ThreadPoolExecutor(max_workers=int(os.getenv("RAG_THREADPOOL_SIZE", 32)))
+
+async def _run(fn, *args, **kwargs):
+    """Run a blocking function on the shared thread pool and await its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+# Fire-and-forget tasks, referenced until they finish so they aren't garbage collected
+_background_tasks = set()
+
+def _background_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Background task failed: {task.exception()}")
+
+def _run_in_background(fn, *args, **kwargs):
+    """Run a blocking function on the shared thread pool without waiting for its result"""
+    task = asyncio.create_task(_run(fn, *args, **kwargs))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+
+# One lock per accessor, so concurrent first requests create a RAG system only once
+_rag_locks = {}
+
+async def _get_rag(accessor):
+    """Get a lazily created RAG system, creating it on the shared thread pool so its setup doesn't block the event loop"""
+    if accessor.cache_info().currsize:
+        return accessor()
+    async with _rag_locks.setdefault(accessor, asyncio.Lock()):
+        # Another request may have created it while this one waited
+        if accessor.cache_info().currsize:
+            return accessor()
+        return await _run(accessor)
+
+async def _iterate(iterator):
+    """Consume a blocking iterator on the shared thread pool, yielding its items as they arrive"""
+    done = object()
+    while True:
+        item = await _run(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+def init_rag_systems():
+    """Create the RAG systems used by every request and warm them up so the first request doesn't pay for it"""
+    get_restaurant_rag()
+    get_context_detector()
+    get_chat_rag()
+    
+    logging.info("Warming up RAG systems...")
+    warmup_semantic_cache(EMBEDDING_DIMENSIONS)
+    get_restaurant_rag().search_restaurants("warmup", top_k=1)
+    logging.info("RAG systems ready")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global scheduler
+    # Anything else using the loop's default executor shares the same bounded pool
+    asyncio.get_running_loop().set_default_executor(EXECUTOR)
+    await _run(init_rag_systems)
+    if SCHEDULER_ENABLED:
+        scheduler = RagScheduler(refresh_interval_minutes=10)
+        await _run(scheduler.start)
+    yield
+    # Let pending chat history writes finish
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+    # Stop the scheduler when the API stops
+    if scheduler is not None:
+        logging.info("Shutting down scheduler...")
+        scheduler.stop()
+        scheduler = None
+    EXECUTOR.shutdown(wait=False)
 
 # Create FastAPI app
 app = FastAPI(
     title="Unified RAG API",
     description="API for querying multiple services using context detection and RAG",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 class Query(BaseModel):
@@ -92,6 +231,90 @@ class UnifiedResponse(BaseModel):
     top_parents: list[UnifiedParent]
     top_childs: list[UnifiedChild]
 
+WELCOME_RESPONSE = UnifiedResponse(answer=WELCOME_TEXT, service_name="welcome", top_parents=[], top_childs=[])
+WELCOME_JSON = orjson.dumps(WELCOME_RESPONSE.model_dump())
+
+def _json_response(response: BaseModel) -> ORJSONResponse:
+    """Serialize a response model with orjson, skipping FastAPI's re-validation against response_model"""
+    return ORJSONResponse(response.model_dump())
+
+async def answer_hotel_query_concurrently(question: str, question_vector) -> dict:
+    """
+    Answer a hotel query with location extraction and both Qdrant searches running concurrently
+    
+    Args:
+        question: The question about hotels
+        question_vector: Embedding of the question
+        
+    Returns:
+        The same dictionary as HotelRAG.answer_hotel_query
+    """
+    hotel_rag = await _get_rag(get_hotel_rag)
+    location, (top_hotels, top_rooms) = await asyncio.gather(
+        _run(hotel_rag.extract_location_info, question),
+        _run(hotel_rag.batch_search, question, 3, 5, question_vector)
+    )
+    return await _run(hotel_rag.generate_hotel_answer, question, location, top_hotels, top_rooms)
+
+async def _answer_restaurants(question: str, question_vector) -> Tuple[str, List[dict], List[dict], bool]:
+    # Search once and answer from the same results, showing the top 3 menu items
+    top_restaurants, relevant_items = await _run(get_restaurant_rag().batch_search, question, 3, 5, question_vector)
+    result = await _run(get_restaurant_rag().generate_restaurant_answer, question, top_restaurants, relevant_items)
+    return result["answer"], result["top_restaurants"], result["top_menu_items"][:3], "error" in result
+
+async def _answer_hotels(question: str, question_vector) -> Tuple[str, List[dict], List[dict], bool]:
+    result = await answer_hotel_query_concurrently(question, question_vector)
+    return result["answer"], result["top_hotels"], result["top_rooms"], "error" in result
+
+async def _answer_deliveries(question: str, question_vector) -> Tuple[str, List[dict], List[dict], bool]:
+    delivery_rag = await _get_rag(get_delivery_rag)
+    result = await _run(delivery_rag.answer_delivery_query, question, question_vector)
+    return result["answer"], result["top_delivery_data"], result["top_delivery_details"], "error" in result
+
+class ServiceHandler(NamedTuple):
+    """A service answered by a RAG system, and where its search results keep the unified fields"""
+    service_name: str
+    # (question, question vector) -> (raw answer, parent results, child results, whether answering failed)
+    answer: Callable[..., Awaitable[Tuple[str, List[dict], List[dict]]]]
+    # Key of the record nested in a child result, None when the result is the record itself
+    child_key: Optional[str]
+    child_id: str
+    child_name: str
+    parent_id: str
+
+SERVICE_HANDLERS = {
+    "restaurant": ServiceHandler("restaurant", _answer_restaurants, "item", "id", "name", "restaurant_id"),
+    "accommodation": ServiceHandler("hotel", _answer_hotels, "room", "id", "name", "hotel_id"),
+    "delivery": ServiceHandler("delivery", _answer_deliveries, None, "delivery_id", "delivery_type", "delivery_id"),
+}
+
+def _unified_items(handler: ServiceHandler, parents: List[dict], children: List[dict]) -> Tuple[List[UnifiedParent], List[UnifiedChild]]:
+    """
+    Convert a service's search results to the unified parents and children
+    
+    Args:
+        handler: The service the results come from
+        parents: Parent results (restaurants, hotels, ...)
+        children: Child results (menu items, rooms, ...)
+        
+    Returns:
+        Tuple of (top parents, top children)
+    """
+    top_parents = [
+        UnifiedParent.model_construct(id=str(parent.get('id', 'unknown')), name=parent.get('name', 'Unknown'))
+        for parent in parents
+    ]
+    records = [child.get(handler.child_key, {}) for child in children] if handler.child_key else children
+    top_childs = [
+        UnifiedChild.model_construct(
+            id=str(record.get(handler.child_id, 'unknown')),
+            name=record.get(handler.child_name, 'Unknown'),
+            parentId=str(child.get(handler.parent_id, 'unknown'))
+        )
+        for child, record in zip(children, records)
+    ]
+    return top_parents, top_childs
+
 @app.post("/api/restaurant-query", response_model=RestaurantResponse)
 async def restaurant_query(query: Query):
     """
@@ -104,67 +327,55 @@ async def restaurant_query(query: Query):
         Response with answer, top matching restaurants and menu items
     """
     try:
-        logging.info(f"Received query: {query.question}")
+        logging.info("Received query: %s", query.question)
         
-        # Get answer from RAG system
-        logging.debug("Calling answer_restaurant_query")
-        answer = restaurant_rag.answer_restaurant_query(query.question)
-        logging.debug(f"Got answer: {answer[:50]}...")
+        # Return the cached response for near-duplicate questions
+        question_vector = await _run(get_restaurant_rag().embed, query.question)
+        cached_response = restaurant_cache.get(question_vector)
+        if cached_response is not None:
+            logging.info("Semantic cache hit for restaurant query")
+            return _json_response(cached_response)
+        
+        # Search once and answer from the same results, showing the top 2 restaurants and 3 menu items
+        logging.debug("Calling batch_search and generate_restaurant_answer")
+        relevant_restaurants, relevant_items = await _run(get_restaurant_rag().batch_search, query.question, 3, 5, question_vector)
+        result = await _run(get_restaurant_rag().generate_restaurant_answer, query.question, relevant_restaurants, relevant_items)
+        answer = result["answer"]
+        top_restaurants, top_items = result["top_restaurants"][:2], result["top_menu_items"][:3]
+        logging.debug("Got answer: %s...", answer[:50])
         
         # Store the interaction in chat history
-        chat_rag.store_chat_interaction(
+        _run_in_background(
+            get_chat_rag().store_chat_interaction,
             user_id=query.user_id,
             question=query.question,
             answer=answer,
             context_type="restaurant",
-            session_id=query.session_id
+            session_id=query.session_id,
+            question_embedding=question_vector.tolist()
         )
         
-        # Get top matching restaurants
-        logging.debug("Calling search_restaurants")
-        top_restaurants = restaurant_rag.search_restaurants(query.question, top_k=2)
-        logging.debug(f"Got {len(top_restaurants)} restaurants")
-        
-        restaurant_results = []
-        for i, restaurant in enumerate(top_restaurants):
-            logging.debug(f"Processing restaurant {i}: {restaurant}")
-            try:
-                # Handle Qdrant response format
-                name = restaurant.get('name', 'Unknown')
-                address = restaurant.get('address', 'No address')
-                restaurant_results.append(f"{name} ({address})")
-                logging.debug(f"Added restaurant: {name}")
-            except KeyError as ke:
-                logging.error(f"KeyError in restaurant data: {ke}, restaurant data: {restaurant}")
-                raise
-        
-        # Get top matching menu items
-        logging.debug("Calling search_menu_items")
-        top_items = restaurant_rag.search_menu_items(query.question, top_k=3)
-        logging.debug(f"Got {len(top_items)} menu items")
-        
-        item_results = []
-        for i, item in enumerate(top_items):
-            logging.debug(f"Processing menu item {i}: {item}")
-            try:
-                # Handle Qdrant response format
-                item_data = item.get('item', {})
-                item_name = item_data.get('name', 'Unknown')
-                item_price = item_data.get('price', 0)
-                restaurant_name = item.get('restaurant_name', 'Unknown restaurant')
-                
-                item_results.append(f"{item_name} - {item_price} VND at {restaurant_name}")
-                logging.debug(f"Added menu item: {item_name}")
-            except KeyError as ke:
-                logging.error(f"KeyError in menu item data: {ke}, item data: {item}")
-                raise
+        restaurant_results = [
+            f"{restaurant.get('name', 'Unknown')} ({restaurant.get('address', 'No address')})"
+            for restaurant in top_restaurants
+        ]
+        
+        item_results = [
+            f"{item.get('item', {}).get('name', 'Unknown')} - {item.get('item', {}).get('price', 0)} VND at {item.get('restaurant_name', 'Unknown restaurant')}"
+            for item in top_items
+        ]
         
+        logging.debug("Got %s restaurants and %s menu items", len(restaurant_results), len(item_results))
         logging.info("Successfully processed query, returning response")
-        return RestaurantResponse(
+        response = RestaurantResponse.model_construct(
             answer=answer,
             top_restaurants=restaurant_results,
             top_menu_items=item_results
         )
+        # An apology for a failed OpenAI request must not be served to later questions
+        if "error" not in result:
+            restaurant_cache.put(query.question, question_vector, response)
+        return _json_response(response)
     except Exception as e:
         logging.error(f"Error processing query: {str(e)}")
         logging.error(traceback.format_exc())
@@ -190,68 +401,58 @@ async def hotel_query(query: Query):
         Response with answer, top matching hotels and rooms
     """
     try:
-        logging.info(f"Received hotel query: {query.question}")
+        logging.info("Received hotel query: %s", query.question)
+        
+        # Return the cached response for near-duplicate questions
+        question_vector = await _run(get_restaurant_rag().embed, query.question)
+        cached_response = hotel_cache.get(question_vector)
+        if cached_response is not None:
+            logging.info("Semantic cache hit for hotel query")
+            return _json_response(cached_response)
         
         # Get answer from Hotel RAG system
         logging.debug("Calling answer_hotel_query")
-        result = hotel_rag.answer_hotel_query(query.question)
+        result = await answer_hotel_query_concurrently(query.question, question_vector)
         answer = result["answer"]
-        logging.debug(f"Got answer: {answer[:50]}...")
+        logging.debug("Got answer: %s...", answer[:50])
         
         # Get top matching hotels from the result
         top_hotels = result["top_hotels"]
-        logging.debug(f"Got {len(top_hotels)} hotels")
         
         # Process hotel results to match restaurant format
-        hotel_results = []
-        for i, hotel in enumerate(top_hotels):
-            logging.debug(f"Processing hotel {i}: {hotel}")
-            try:
-                # Format hotel data consistently
-                name = hotel.get('name', 'Unknown')
-                address = hotel.get('address', 'No address')
-                hotel_results.append(f"{name} ({address})")
-                logging.debug(f"Added hotel: {name}")
-            except KeyError as ke:
-                logging.error(f"KeyError in hotel data: {ke}, hotel data: {hotel}")
-                raise
+        hotel_results = [
+            f"{hotel.get('name', 'Unknown')} ({hotel.get('address', 'No address')})"
+            for hotel in top_hotels
+        ]
         
         # Get top matching rooms from the result
         top_rooms = result["top_rooms"]
-        logging.debug(f"Got {len(top_rooms)} rooms")
         
         # Process room results to match menu item format
-        room_results = []
-        for i, room_info in enumerate(top_rooms):
-            logging.debug(f"Processing room {i}: {room_info}")
-            try:
-                # Format room data consistently
-                room = room_info.get('room', {})
-                room_name = room.get('name', 'Unknown')
-                room_price = room.get('price', 0)
-                hotel_name = room_info.get('hotel_name', 'Unknown hotel')
-                
-                room_results.append(f"{room_name} - {room_price} VND at {hotel_name}")
-                logging.debug(f"Added room: {room_name}")
-            except KeyError as ke:
-                logging.error(f"KeyError in room data: {ke}, room data: {room_info}")
-                raise
+        room_results = [
+            f"{room_info.get('room', {}).get('name', 'Unknown')} - {room_info.get('room', {}).get('price', 0)} VND at {room_info.get('hotel_name', 'Unknown hotel')}"
+            for room_info in top_rooms
+        ]
         
+        logging.debug("Got %s hotels and %s rooms", len(hotel_results), len(room_results))
         logging.info("Successfully processed hotel query, returning response")
-        return HotelResponse(
+        response = HotelResponse.model_construct(
             answer=answer,
             top_hotels=hotel_results,
             top_rooms=room_results
         )
+        # An apology for a failed OpenAI request must not be served to later questions
+        if "error" not in result:
+            hotel_cache.put(query.question, question_vector, response)
+        return _json_response(response)
     except Exception as e:
         logging.error(f"Error processing hotel query: {e}")
         logging.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.post("/api/chatbot-query", response_model=UnifiedResponse)
-async def unified_query(query: Query):
+async def answer_unified_query(query: Query) -> UnifiedResponse:
     """
-    Unified endpoint to query all services based on context detection
+    Answer a question with the service matching its detected context
     
     Args:
         query: The user's question
@@ -260,222 +461,284 @@ async def unified_query(query: Query):
         Response with answer, service name, and top matching items in a unified format
     """
     try:
-        logging.info(f"Received unified query: {query.question}")
+        logging.info("Received unified query: %s", query.question)
         
         if not query.question.strip():
             logging.info("Received empty question, sending welcome message")
-            return UnifiedResponse(
-                answer="Xin chào anh/chị! Em là Bé Bơ đây ạ! ❤️\n\nEm là nhân viên tư vấn của ShipperRachGia.vn, em có thể giúp anh/chị tìm hiểu về:\n- Nhà hàng và món ăn ngon tại Rạch Giá\n- Khách sạn và dịch vụ lưu trú\n- Dịch vụ giao hàng và vận chuyển\n\nAnh/chị có thể hỏi em bất cứ điều gì về các dịch vụ của ShipperRachGia.vn!\n\nDạ để được nhận nhiều Ưu Đãi và Khuyến Mãi A/C vui lòng nhắn vào đây giúp Bé Bơ ạ https://zalo.me/4018474138015540620 Hoặc gọi: 1900585878 - 0939785878. Giúp em nha!",
-                service_name="welcome",
-                top_parents=[],
-                top_childs=[]
-            )
+            return WELCOME_RESPONSE
+        
+        # Return the cached response for near-duplicate questions about the same service
+        context_result = get_context_detector().detect_context_fast(query.question)
+        question_vector = await _run(get_restaurant_rag().embed, query.question)
+        cached_response = unified_cache.get(question_vector)
+        if cached_response is not None and _matches_service(cached_response, context_result):
+            logging.info("Semantic cache hit for unified query")
+            return cached_response
         
-        # Step 1: Detect the context of the query
-        context_result = context_detector.detect_context(query.question)
+        # Step 1: Detect the context of the query, from keywords when unambiguous
+        if context_result is None:
+            context_result = await _run(_detect, query.question.strip().lower())
         primary_context = context_result["primary_context"]
         confidence = context_result["confidence"]
         
-        logging.info(f"Detected context: {primary_context} with confidence {confidence:.2f}")
+        logging.info("Detected context: %s with confidence %.2f", primary_context, confidence)
         
         # Step 2: Route to appropriate service based on context
-        if primary_context == "restaurant":
-            service_name = "restaurant"
-            # Get answer from Restaurant RAG system
-            raw_answer = restaurant_rag.answer_restaurant_query(query.question)
-            # Format as Vietnamese response from Bé Bơ
-            answer = f"❤️\n\n{raw_answer}\n\nDạ để được nhận nhiều Ưu Đãi và Khuyến Mãi A/C vui lòng nhắn vào đây giúp Bé Bơ ạ https://zalo.me/4018474138015540620 Hoặc gọi: 1900585878 - 0939785878. Giúp em nha!"
-            
-            # Get top matching restaurants
-            top_restaurants = restaurant_rag.search_restaurants(query.question, top_k=3)
-            
-            # Get top matching menu items
-            top_items = restaurant_rag.search_menu_items(query.question, top_k=3)
-            
-            # Format as unified response
-            top_parents = []
-            for restaurant in top_restaurants:
-                restaurant_id = restaurant.get('id', 'unknown')
-                name = restaurant.get('name', 'Unknown')
-                top_parents.append(UnifiedParent(id=str(restaurant_id), name=name))
-            
-            top_childs = []
-            for item in top_items:
-                item_data = item.get('item', {})
-                item_id = item_data.get('id', 'unknown')
-                item_name = item_data.get('name', 'Unknown')
-                restaurant_id = item.get('restaurant_id', 'unknown')
-                top_childs.append(UnifiedChild(id=str(item_id), name=item_name, parentId=str(restaurant_id)))
-            
-        elif primary_context == "accommodation":
-            service_name = "hotel"
-            # Get answer from Hotel RAG system
-            logging.debug("Calling answer_hotel_query")
-            result = hotel_rag.answer_hotel_query(query.question)
-            raw_answer = result["answer"]
+        handler = SERVICE_HANDLERS.get(primary_context)
+        if handler is not None:
+            service_name = handler.service_name
+            raw_answer, parents, children, failed = await handler.answer(query.question, question_vector)
             # Format as Vietnamese response from Bé Bơ
-            answer = f"❤️\n\n{raw_answer}\n\nDạ để được nhận nhiều Ưu Đãi và Khuyến Mãi A/C vui lòng nhắn vào đây giúp Bé Bơ ạ https://zalo.me/4018474138015540620 Hoặc gọi: 1900585878 - 0939785878. Giúp em nha!"
-            
-            # Store the interaction in chat history
-            chat_rag.store_chat_interaction(
-                user_id=query.user_id,
-                question=query.question,
-                answer=answer,
-                context_type="hotel",
-                session_id=query.session_id
-            )
-            
-            # Get top matching hotels
-            top_hotels = result["top_hotels"]
-            
-            # Get top matching rooms
-            top_rooms = result["top_rooms"]
-            
-            # Format as unified response
-            top_parents = []
-            for hotel in top_hotels:
-                hotel_id = hotel.get('id', 'unknown')
-                name = hotel.get('name', 'Unknown')
-                top_parents.append(UnifiedParent(id=str(hotel_id), name=name))
-            
-            top_childs = []
-            for room_info in top_rooms:
-                room = room_info.get('room', {})
-                room_id = room.get('id', 'unknown')
-                room_name = room.get('name', 'Unknown')
-                hotel_id = room_info.get('hotel_id', 'unknown')
-                top_childs.append(UnifiedChild(id=str(room_id), name=room_name, parentId=str(hotel_id)))
-                
-        elif primary_context == "delivery":
-            service_name = "delivery"
-            # Get answer from Delivery RAG system
-            result = delivery_rag.answer_delivery_query(query.question)
-            raw_answer = result["answer"]
-            # Format as Vietnamese response from Bé Bơ
-            answer = f"❤️\n\n{raw_answer}\n\nDạ để được nhận nhiều Ưu Đãi và Khuyến Mãi A/C vui lòng nhắn vào đây giúp Bé Bơ ạ https://zalo.me/4018474138015540620 Hoặc gọi: 1900585878 - 0939785878. Giúp em nha!"
-            
-            # Store the interaction in chat history
-            chat_rag.store_chat_interaction(
-                user_id=query.user_id,
-                question=query.question,
-                answer=answer,
-                context_type="delivery",
-                session_id=query.session_id
-            )
-            
-            # Get top matching delivery data
-            top_delivery_data = result["top_delivery_data"]
-            
-            # Get top matching delivery details
-            top_delivery_details = result["top_delivery_details"]
-            
-            # Format as unified response
-            top_parents = []
-            for delivery in top_delivery_data:
-                delivery_id = delivery.get('id', 'unknown')
-                name = delivery.get('name', 'Unknown')
-                top_parents.append(UnifiedParent(id=str(delivery_id), name=name))
-            
-            top_childs = []
-            for detail in top_delivery_details:
-                detail_id = detail.get('delivery_id', 'unknown')
-                detail_name = detail.get('delivery_type', 'Unknown')
-                delivery_id = detail.get('delivery_id', 'unknown')
-                top_childs.append(UnifiedChild(id=str(detail_id), name=detail_name, parentId=str(delivery_id)))
+            answer = BEBO_PREFIX + raw_answer + BEBO_SUFFIX
+            top_parents, top_childs = _unified_items(handler, parents, children)
             
         elif primary_context == "order":
             service_name = "order"
-            result = orders_rag.answer_order_query(query.question)
+            orders_rag = await _get_rag(get_orders_rag)
+            result = await _run(orders_rag.answer_order_query, query.question)
             raw_answer = result["answer"]
-            answer = f"❤️\n\n{raw_answer}\n\nDạ để được nhận nhiều Ưu Đãi và Khuyến Mãi A/C vui lòng nhắn vào đây giúp Bé Bơ ạ https://zalo.me/4018474138015540620 Hoặc gọi: 1900585878 - 0939785878. Giúp em nha!"
-            
-            chat_rag.store_chat_interaction(
-                user_id=query.user_id,
-                question=query.question,
-                answer=answer,
-                context_type="order",
-                session_id=query.session_id
-            )
+            failed = "error" in result
+            answer = BEBO_PREFIX + raw_answer + BEBO_SUFFIX
             
             orders = result.get("orders", [])
             
-            top_parents = []
-            for order in orders[:5]:  # Limit to 5 orders
-                order_id = order.get('id', 'unknown')
-                order_type = order.get('type_order_id', 'Unknown')
-                name = f"{order_type} Order #{order_id}"
-                top_parents.append(UnifiedParent(id=str(order_id), name=name))
+            top_orders = orders[:5]  # Limit to 5 orders
+            top_parents = [
+                UnifiedParent.model_construct(
+                    id=str(order.get('id', 'unknown')),
+                    name=f"{order.get('type_order_id', 'Unknown')} Order #{order.get('id', 'unknown')}"
+                )
+                for order in top_orders
+            ]
             
-            top_childs = []
-            for order in orders[:5]:  # Limit to 5 orders
-                order_id = order.get('id', 'unknown')
-                # Add order details as children
-                if 'total' in order:
-                    child_id = f"{order_id}_total"
-                    child_name = f"Total: {order.get('total')} VND"
-                    top_childs.append(UnifiedChild(id=str(child_id), name=child_name, parentId=str(order_id)))
-                
-                if 'address' in order:
-                    child_id = f"{order_id}_address"
-                    child_name = f"Address: {order.get('address')}"
-                    top_childs.append(UnifiedChild(id=str(child_id), name=child_name, parentId=str(order_id)))
+            # Add order details as children
+            top_childs = [
+                UnifiedChild.model_construct(
+                    id=f"{order.get('id', 'unknown')}_{field}",
+                    name=label.format(order.get(field)),
+                    parentId=str(order.get('id', 'unknown'))
+                )
+                for order in top_orders
+                for field, label in ORDER_CHILD_FIELDS
+                if field in order
+            ]
             
         else:
             # For contexts we don't have specific handlers for yet
             service_name = primary_context
             
-            logging.info(f"No specific handler for context {primary_context}, trying web search")
-            search_result = web_search.search_web(query.question)
+            logging.info("No specific handler for context %s, checking chat history", primary_context)
+            failed = False
+            # An answer to a very similar earlier question is much cheaper than a web search.
+            # Earlier fallback replies are skipped so they don't block the web search.
+            similar_questions = await _run(
+                get_chat_rag().search_similar_questions,
+                query.question,
+                limit=1,
+                question_embedding=question_vector.tolist()
+            )
             
-            if search_result["success"]:
-                # If web search was successful, use the formatted answer
-                answer = search_result["answer"]
-                logging.info("Web search successful, using search results")
+            if (similar_questions and similar_questions[0]["similarity_score"] > 0.85
+                    and similar_questions[0]["answer"] != DEFAULT_FALLBACK_TEXT):
+                # Use the answer from a similar question if it's very similar
+                answer = similar_questions[0]["answer"]
+                logging.info("Using answer from similar question with score %s", similar_questions[0]['similarity_score'])
             else:
-                # Before giving up, check if we have similar questions in chat history
-                similar_questions = chat_rag.search_similar_questions(query.question, limit=1)
+                web_search = await _get_rag(get_web_search)
+                search_result = await _run(web_search.search_web, query.question)
                 
-                if similar_questions and similar_questions[0]["similarity_score"] > 0.85:
-                    # Use the answer from a similar question if it's very similar
-                    answer = similar_questions[0]["answer"]
-                    logging.info(f"Using answer from similar question with score {similar_questions[0]['similarity_score']}")
+                if search_result["success"]:
+                    # If web search was successful, use the formatted answer
+                    answer = search_result["answer"]
+                    logging.info("Web search successful, using search results")
                 else:
-                    # If web search failed and no similar questions, use the default fallback response
-                    answer = f"❤️\n\nEm chưa có thông tin cụ thể về dịch vụ này. Anh/chị có thể chia sẻ thêm về điều anh/chị đang tìm kiếm được không ạ? Em rất muốn được giúp anh/chị tốt hơn!\n\nTrong lúc đó, anh/chị có thể tham khảo thêm thông tin tại website https://shipperrachgia.vn/ nha!\n\nDạ để được nhận nhiều Ưu Đãi và Khuyến Mãi A/C vui lòng nhắn vào đây giúp Bé Bơ ạ https://zalo.me/4018474138015540620 Hoặc gọi: 1900585878 - 0939785878. Giúp em nha!"
+                    # If no similar questions and web search failed, use the default fallback response
+                    answer = DEFAULT_FALLBACK_TEXT
+                    failed = True
                     logging.warning(f"Web search failed: {search_result['answer']}")
             
-            # Store the interaction in chat history
-            chat_rag.store_chat_interaction(
-                user_id=query.user_id,
-                question=query.question,
-                answer=answer,
-                context_type=service_name,
-                session_id=query.session_id
-            )
-            
             top_parents = []
             top_childs = []
         
-        logging.info(f"Successfully processed unified query for {service_name}, returning response")
-        return UnifiedResponse(
+        # Store the interaction in chat history
+        _run_in_background(
+            get_chat_rag().store_chat_interaction,
+            user_id=query.user_id,
+            question=query.question,
+            answer=answer,
+            context_type=service_name,
+            session_id=query.session_id,
+            question_embedding=question_vector.tolist()
+        )
+        
+        logging.info("Successfully processed unified query for %s, returning response", service_name)
+        response = UnifiedResponse.model_construct(
             answer=answer,
             service_name=service_name,
             top_parents=top_parents,
             top_childs=top_childs
         )
+        # An apology for a failed request must not be served to later questions
+        if not failed:
+            unified_cache.put(query.question, question_vector, response)
+        return response
         
     except Exception as e:
         logging.error(f"Error processing unified query: {str(e)}")
         logging.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Error processing unified query: {str(e)}")
 
+@app.post("/api/chatbot-query", response_model=UnifiedResponse)
+async def unified_query(query: Query):
+    """
+    Unified endpoint to query all services based on context detection
+    
+    Args:
+        query: The user's question
+        
+    Returns:
+        Response with answer, service name, and top matching items in a unified format
+    """
+    if not query.question.strip():
+        logging.info("Received empty question, sending welcome message")
+        return Response(content=WELCOME_JSON, media_type="application/json")
+    return _json_response(await answer_unified_query(query))
+
+
+def _ndjson(obj) -> bytes:
+    """Encode one line of a newline-delimited JSON stream"""
+    return orjson.dumps(obj) + b"\n"
+
+async def _stream_unified(query: Query):
+    """
+    Produce the unified response as NDJSON lines. For restaurant, hotel and delivery questions the
+    top parents/childs are sent as soon as the searches resolve, followed by the answer
+    in pieces as the LLM generates it. Other services send the whole response in one line.
+    
+    Args:
+        query: The user's question
+        
+    Yields:
+        Encoded NDJSON lines
+    """
+    try:
+        if not query.question.strip():
+            yield WELCOME_JSON + b"\n"
+            return
+        
+        context_result = get_context_detector().detect_context_fast(query.question)
+        question_vector = await _run(get_restaurant_rag().embed, query.question)
+        cached_response = unified_cache.get(question_vector)
+        if cached_response is not None and _matches_service(cached_response, context_result):
+            logging.info("Semantic cache hit for streamed unified query")
+            yield _ndjson(cached_response.model_dump())
+            return
+        
+        if context_result is None:
+            context_result = await _run(_detect, query.question.strip().lower())
+        primary_context = context_result["primary_context"]
+        
+        if primary_context == "restaurant":
+            top_restaurants, top_items = await _run(get_restaurant_rag().batch_search, query.question, 3, 5, question_vector)
+            parents, children = top_restaurants, top_items[:3]
+            answer_stream = get_restaurant_rag().stream_restaurant_answer(query.question, top_restaurants, top_items)
+        elif primary_context == "accommodation":
+            hotel_rag = await _get_rag(get_hotel_rag)
+            location, (parents, children) = await asyncio.gather(
+                _run(hotel_rag.extract_location_info, query.question),
+                _run(hotel_rag.batch_search, query.question, 3, 5, question_vector)
+            )
+            answer_stream = hotel_rag.stream_hotel_answer(query.question, location, parents, children)
+        elif primary_context == "delivery":
+            delivery_rag = await _get_rag(get_delivery_rag)
+            location, parents, children = await asyncio.gather(
+                _run(delivery_rag.extract_location_info, query.question),
+                _run(delivery_rag.search_delivery_data, query.question, 3, question_vector),
+                _run(delivery_rag.search_delivery_details, query.question, 5, question_vector)
+            )
+            answer_stream = delivery_rag.stream_delivery_answer(query.question, location, parents, children)
+        else:
+            yield _ndjson((await answer_unified_query(query)).model_dump())
+            return
+        
+        service_name = SERVICE_HANDLERS[primary_context].service_name
+        top_parents, top_childs = _unified_items(SERVICE_HANDLERS[primary_context], parents, children)
+        yield _ndjson({
+            "service_name": service_name,
+            "top_parents": [parent.model_dump() for parent in top_parents],
+            "top_childs": [child.model_dump() for child in top_childs]
+        })
+        
+        # Format as Vietnamese response from Bé Bơ while the answer streams in
+        pieces = [BEBO_PREFIX]
+        yield _ndjson({"answer_delta": BEBO_PREFIX})
+        failed = False
+        try:
+            async for delta in _iterate(answer_stream):
+                pieces.append(delta)
+                yield _ndjson({"answer_delta": delta})
+        except Exception as e:
+            # The answer so far is kept, the apology takes the place of the rest
+            logging.error(f"Error streaming response from OpenAI: {e}")
+            failed = True
+            pieces.append(ANSWER_ERROR_TEXT)
+            yield _ndjson({"answer_delta": ANSWER_ERROR_TEXT})
+        pieces.append(BEBO_SUFFIX)
+        yield _ndjson({"answer_delta": BEBO_SUFFIX})
+        answer = "".join(pieces)
+        
+        _run_in_background(
+            get_chat_rag().store_chat_interaction,
+            user_id=query.user_id,
+            question=query.question,
+            answer=answer,
+            context_type=service_name,
+            session_id=query.session_id,
+            question_embedding=question_vector.tolist()
+        )
+        
+        # A broken or failed stream leaves an incomplete answer, which must not be cached
+        if not failed:
+            unified_cache.put(query.question, question_vector, UnifiedResponse.model_construct(
+                answer=answer,
+                service_name=service_name,
+                top_parents=top_parents,
+                top_childs=top_childs
+            ))
+        
+    except Exception as e:
+        # The status line is already sent, so report the failure in the stream
+        logging.error(f"Error processing streamed unified query: {str(e)}")
+        logging.error(traceback.format_exc())
+        yield _ndjson({"error": f"Error processing unified query: {str(e)}"})
+
+@app.post("/api/chatbot-query/stream")
+async def unified_query_stream(query: Query):
+    """
+    Streaming variant of /api/chatbot-query returning newline-delimited JSON
+    
+    Args:
+        query: The user's question
+        
+    Returns:
+        Stream of {"service_name", "top_parents", "top_childs"} followed by {"answer_delta"} lines
+    """
+    logging.info("Received streamed unified query: %s", query.question)
+    return StreamingResponse(_stream_unified(query), media_type="application/x-ndjson")
 
-# Add shutdown event to stop the scheduler when the API stops
-@app.on_event("shutdown")
-def shutdown_event():
-    logging.info("Shutting down scheduler...")
-    scheduler.stop()
-    logging.info("Scheduler stopped")
 
 if __name__ == "__main__":
-    uvicorn.run("api:app", host="0.0.0.0", port=8000, reload=True)
+    # Each worker is a separate process with its own RAG systems, semantic caches,
+    # thread pool and MySQL pool. In production prefer gunicorn with uvicorn workers
+    # (see render_startup.sh).
+    workers = int(os.getenv("WEB_CONCURRENCY", max(1, os.cpu_count() or 1)))
+    reload = os.getenv("RELOAD", "0") == "1"
+    uvicorn.run(
+        "api:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT", 8000)),
+        workers=1 if reload else workers,
+        reload=reload,
+        loop="uvloop",
+        http="httptools"
+    )
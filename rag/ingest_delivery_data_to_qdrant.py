@@ -6,13 +6,16 @@ This creates embeddings for delivery-related data and stores them in Qdrant for
 
 import os
 import logging
-import json
 import mysql.connector
+from mysql.connector.pooling import MySQLConnectionPool
+from collections import defaultdict
 import numpy as np
 from dotenv import load_dotenv
-from src.embeddings_manager import EmbeddingsManager
-from qdrant_client import QdrantClient
-from qdrant_client.http import models
+from src.embeddings_manager import EMBEDDING_DIMENSIONS, EmbeddingsManager
+from src.embedding_cache import get_or_compute
+from src.qdrant_connection import HNSW_CONFIG, QUANTIZATION_CONFIG, UPLOAD_BATCH_SIZE, compact_payload, deferred_indexing, get_qdrant_client, point_id
+from src.ingest_pipeline import batched, map_batches, run_pipeline
+from src.ingest_state import get_watermark, set_watermark
 from qdrant_client.http.models import Distance, VectorParams
 
 # Configure logging
@@ -30,117 +33,173 @@ DB_CONFIG = {
     'port': int(os.getenv('MYSQL_DB_PORT', 3306)),
     'user': os.getenv('MYSQL_DB_USERNAME'),
     'password': os.getenv('MYSQL_DB_PASSWORD'),
-    'database': os.getenv('MYSQL_DB_NAME', 'boship')  # Default database name
+    'database': os.getenv('MYSQL_DB_NAME', 'boship'),  # Default database name
+    # Decode rows in the connector's C extension rather than in pure Python
+    'use_pure': False
 }
+DB_POOL_SIZE = int(os.getenv('MYSQL_INGEST_POOL_SIZE', 4))
+
+# Only ingest deliveries updated since the last successful run
+INCREMENTAL_INGEST = os.getenv('INCREMENTAL_INGEST', 'false').lower() == 'true'
 
 # Qdrant configuration
-QDRANT_API_KEY = os.getenv('QDRANT_API_KEY')
-QDRANT_URL = "https://16f1329c-7600-4be6-8dc1-376daff8d555.us-west-1-0.aws.cloud.qdrant.io"
-QDRANT_PORT = 6333
-EMBEDDING_SIZE = 1536  # OpenAI Ada embedding size
+EMBEDDING_SIZE = EMBEDDING_DIMENSIONS
 DELIVERY_COLLECTION = "delivery_collection"
+ID_CHUNK_SIZE = 1000  # Ids per IN (...) lookup
+
+_db_pool = None
 
 def get_db_connection():
     """
-    Establish a connection to the MySQL database
+    Get a connection to the MySQL database from the ingest connection pool
     """
+    global _db_pool
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        logging.info("Database connection established successfully")
-        return conn
+        if _db_pool is None:
+            _db_pool = MySQLConnectionPool(pool_name="delivery_ingest", pool_size=DB_POOL_SIZE, **DB_CONFIG)
+            logging.info("Database connection pool created successfully")
+            if not mysql.connector.HAVE_CEXT:
+                logging.warning("MySQL C extension not available, rows are decoded in pure Python")
+        return _db_pool.get_connection()
     except mysql.connector.Error as err:
         logging.error(f"Database connection error: {err}")
         raise
 
-def fetch_delivery_data(cursor):
+def delivery_point_id(delivery):
+    """
+    Get the Qdrant point id of a delivery from its primary key, so re-ingesting a delivery overwrites its point
+    """
+    return point_id("delivery", delivery['id'] if 'id' in delivery else delivery['delivery_id'])
+
+def fetch_rows_by_ids(cursor, table, column, ids):
+    """
+    Fetch the rows of a table whose column matches any of the given ids
+    
+    Args:
+        cursor: Dictionary cursor
+        table: Table to read
+        column: Column holding the id
+        ids: Ids to look up
+        
+    Returns:
+        Dict mapping each id to the list of its rows
+    """
+    rows_by_id = defaultdict(list)
+    ids = list(ids)
+    # Query in chunks so the statement stays well below max_allowed_packet
+    for i in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[i:i + ID_CHUNK_SIZE]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cursor.execute(f"SELECT * FROM {table} WHERE {column} IN ({placeholders})", chunk)
+        # Bucket rows as they arrive instead of materializing the whole result first
+        for row in cursor:
+            rows_by_id[row[column]].append(row)
+    return rows_by_id
+
+def attach_related_data(cursor, deliveries):
+    """
+    Attach the service model, running status, order points, settings and payment history to deliveries
+    
+    Args:
+        cursor: Dictionary cursor for the lookups
+        deliveries: Delivery records
+        
+    Returns:
+        The deliveries that have an ID field, with their related data
     """
-    Fetch delivery data from MySQL database
+    # Use the primary key field from the actual schema
+    # Based on the error, it seems 'id' might not be the primary key field
+    # Let's try to find the actual primary key or use a fallback
+    keyed_deliveries = []
+    for delivery in deliveries:
+        if 'id' in delivery:
+            keyed_deliveries.append((delivery['id'], delivery))
+        elif 'delivery_id' in delivery:
+            keyed_deliveries.append((delivery['delivery_id'], delivery))
+        else:
+            # If we can't find a proper ID, skip this record
+            logging.warning(f"Could not find ID field in delivery record: {list(delivery.keys())}")
+    
+    # Fetch the related data for all deliveries at once instead of once per delivery
+    ids = {delivery_id for delivery_id, _ in keyed_deliveries}
+    taxi_model_ids = {delivery['taxi_model_id'] for _, delivery in keyed_deliveries if delivery.get('taxi_model_id')}
+    service_models = fetch_rows_by_ids(cursor, "service_taxi_model", "id", taxi_model_ids)
+    running_status = fetch_rows_by_ids(cursor, "delivery_running", "delivery_id", ids)
+    order_points = fetch_rows_by_ids(cursor, "order_point_delivery", "delivery_id", ids)
+    settings = fetch_rows_by_ids(cursor, "delivery_setting", "delivery_id", ids)
+    payment_history = fetch_rows_by_ids(cursor, "paybook_history_delivery", "delivery_id", ids)
+    
+    for delivery_id, delivery in keyed_deliveries:
+        models_for_delivery = service_models.get(delivery.get('taxi_model_id'))
+        delivery['service_model'] = models_for_delivery[0] if models_for_delivery else {}
+        delivery['running_status'] = running_status.get(delivery_id, [])
+        delivery['order_points'] = order_points.get(delivery_id, [])
+        delivery['settings'] = settings.get(delivery_id, [])
+        delivery['payment_history'] = payment_history.get(delivery_id, [])
+    
+    return [delivery for _, delivery in keyed_deliveries]
+
+def fetch_delivery_data(cursor, lookup_cursor, since=None):
+    """
+    Stream delivery data from MySQL database
+    
+    Deliveries are read from an unbuffered cursor and get their related data a chunk
+    at a time, so only one chunk of rows is held in memory at once.
+    
+    Args:
+        cursor: Unbuffered dictionary cursor for the delivery table
+        lookup_cursor: Dictionary cursor on another connection for the related tables
+        since: Only fetch deliveries updated at or after this time, all deliveries if None
+        
+    Yields:
+        Delivery records with related data
     """
     try:
         # Fetch delivery records
         logging.info("Fetching delivery data from database...")
-        cursor.execute("""
-            SELECT * 
-            FROM delivery
-        """)
-        deliveries = cursor.fetchall()
-        logging.info(f"Fetched {len(deliveries)} delivery records")
-        
-        if not deliveries:
-            logging.error("No delivery records found")
-            return []
-        
-        # Print the first delivery record to see its structure
-        if deliveries:
-            logging.info(f"Sample delivery record keys: {list(deliveries[0].keys())}")
-        
-        # For each delivery, fetch related data
-        for delivery in deliveries:
-            # Use the primary key field from the actual schema
-            # Based on the error, it seems 'id' might not be the primary key field
-            # Let's try to find the actual primary key or use a fallback
-            if 'id' in delivery:
-                delivery_id = delivery['id']
-            elif 'delivery_id' in delivery:
-                delivery_id = delivery['delivery_id']
-            else:
-                # If we can't find a proper ID, skip this record
-                logging.warning(f"Could not find ID field in delivery record: {list(delivery.keys())}")
-                continue
-            
-            # Fetch service_taxi_model for this delivery
-            if delivery.get('taxi_model_id'):
-                cursor.execute("""
-                    SELECT * FROM service_taxi_model
-                    WHERE id = %s
-                """, (delivery.get('taxi_model_id'),))
-                delivery['service_model'] = cursor.fetchone() or {}
-            else:
-                delivery['service_model'] = {}
-            
-            # Fetch delivery_running for this delivery
-            cursor.execute("""
-                SELECT * FROM delivery_running
-                WHERE delivery_id = %s
-            """, (delivery_id,))
-            delivery['running_status'] = cursor.fetchall()
-            
-            # Fetch order_point_delivery for this delivery
+        if since is None:
             cursor.execute("""
-                SELECT * FROM order_point_delivery
-                WHERE delivery_id = %s
-            """, (delivery_id,))
-            delivery['order_points'] = cursor.fetchall()
-            
-            # Fetch delivery_setting for this delivery
-            cursor.execute("""
-                SELECT * FROM delivery_setting
-                WHERE delivery_id = %s
-            """, (delivery_id,))
-            delivery['settings'] = cursor.fetchall()
-            
-            # Fetch paybook_history_delivery for this delivery
+                SELECT * 
+                FROM delivery
+            """)
+        else:
+            logging.info(f"Fetching deliveries updated since {since}")
             cursor.execute("""
-                SELECT * FROM paybook_history_delivery
-                WHERE delivery_id = %s
-            """, (delivery_id,))
-            delivery['payment_history'] = cursor.fetchall()
-        
-        return deliveries
+                SELECT * 
+                FROM delivery
+                WHERE updated_at >= %s
+            """, (since,))
+        
+        count = 0
+        chunk = []
+        for delivery in cursor:
+            if count == 0:
+                # Print the first delivery record to see its structure
+                logging.info(f"Sample delivery record keys: {list(delivery.keys())}")
+            count += 1
+            chunk.append(delivery)
+            if len(chunk) >= ID_CHUNK_SIZE:
+                yield from attach_related_data(lookup_cursor, chunk)
+                chunk = []
+        if chunk:
+            yield from attach_related_data(lookup_cursor, chunk)
+        
+        if count:
+            logging.info(f"Fetched {count} delivery records")
+        elif since is None:
+            logging.error("No delivery records found")
         
     except mysql.connector.Error as err:
+        # Raise rather than end the stream early, so a partial ingest isn't reported as complete
         logging.error(f"Error fetching delivery data: {err}")
-        return []
-    finally:
-        # Don't close the cursor here, it will be closed in the main function
-        pass
+        raise
 
 def prepare_delivery_data_for_embedding(deliveries):
     """
     Prepare delivery data for embedding by creating text representations
     
     Args:
-        deliveries: List of delivery records with related data
+        deliveries: Iterable of delivery records with related data
         
     Returns:
         List of text representations and original delivery data
@@ -156,50 +215,50 @@ def prepare_delivery_data_for_embedding(deliveries):
         delivery_id = delivery.get('id', 'Unknown')
         
         # Construct text representation
-        text = f"Delivery ID: {delivery_id}\n"
+        parts = [f"Delivery ID: {delivery_id}\n"]
         
         # Add other relevant fields if available
         if 'type_id' in delivery:
-            text += f"Type ID: {delivery.get('type_id', 'Not specified')}\n"
+            parts.append(f"Type ID: {delivery.get('type_id', 'Not specified')}\n")
         
         if 'user_id' in delivery:
-            text += f"User ID: {delivery.get('user_id', 'Not specified')}\n"
+            parts.append(f"User ID: {delivery.get('user_id', 'Not specified')}\n")
         
         if 'order' in delivery:
-            text += f"Order: {delivery.get('order', 'Not specified')}\n"
+            parts.append(f"Order: {delivery.get('order', 'Not specified')}\n")
         
         if 'vehicle_description' in delivery:
-            text += f"Vehicle: {delivery.get('vehicle_description', 'Not specified')}\n"
+            parts.append(f"Vehicle: {delivery.get('vehicle_description', 'Not specified')}\n")
         
         # Add running status if available
         if 'running_status' in delivery and delivery['running_status']:
             status = delivery['running_status'][0]  # Take the first status record
-            text += f"Status: {status.get('status', 'Unknown')}\n"
+            parts.append(f"Status: {status.get('status', 'Unknown')}\n")
             if 'date_in' in status and status['date_in']:
-                text += f"Date In: {status['date_in']}\n"
+                parts.append(f"Date In: {status['date_in']}\n")
             if 'date_out' in status and status['date_out']:
-                text += f"Date Out: {status['date_out']}\n"
+                parts.append(f"Date Out: {status['date_out']}\n")
         
         # Add service model info if available
         if 'service_model' in delivery and delivery['service_model']:
             model = delivery['service_model']
-            text += f"Service Model: {model.get('name', 'Unknown')}\n"
+            parts.append(f"Service Model: {model.get('name', 'Unknown')}\n")
             if 'image' in model and model['image']:
-                text += f"Model Image: {model['image']}\n"
+                parts.append(f"Model Image: {model['image']}\n")
         
         # Add order points if available
         if 'order_points' in delivery and delivery['order_points']:
-            text += "Order Points:\n"
+            parts.append("Order Points:\n")
             for idx, point in enumerate(delivery['order_points'], 1):
-                text += f"  Point {idx}: {point.get('location_name', 'Unknown location')}\n"
+                parts.append(f"  Point {idx}: {point.get('location_name', 'Unknown location')}\n")
         
         # Add settings if available
         if 'settings' in delivery and delivery['settings']:
-            text += "Delivery Settings:\n"
+            parts.append("Delivery Settings:\n")
             for setting in delivery['settings']:
-                text += f"  {setting.get('setting_key', 'Unknown setting')}: {setting.get('setting_value', 'Not specified')}\n"
+                parts.append(f"  {setting.get('setting_key', 'Unknown setting')}: {setting.get('setting_value', 'Not specified')}\n")
         
-        return text
+        return "".join(parts)
     
     for delivery in deliveries:
         text = prepare_delivery_text(delivery)
@@ -217,16 +276,14 @@ def prepare_delivery_data_for_embedding(deliveries):
             'updated_at': str(delivery.get('updated_at')) if delivery.get('updated_at') else None
         }
         
-        # Add service models
-        service_models = []
-        for model in delivery.get('service_models', []):
-            service_models.append({
-                'id': model.get('id'),
-                'name': model.get('name'),
-                'price': model.get('price'),
-                'description': model.get('description')
-            })
-        clean_delivery['service_models'] = service_models
+        # Add the service model (fetch_delivery_data attaches a single one per delivery)
+        service_model = delivery.get('service_model') or {}
+        clean_delivery['service_models'] = [{
+            'id': service_model.get('id'),
+            'name': service_model.get('name'),
+            'price': service_model.get('price'),
+            'description': service_model.get('description')
+        }] if service_model else []
         
         # Add order points
         order_points = []
@@ -260,18 +317,8 @@ def initialize_qdrant_client():
         Qdrant client instance
     """
     try:
-        if QDRANT_API_KEY:
-            # Use cloud Qdrant with API key
-            client = QdrantClient(
-                api_key=QDRANT_API_KEY,
-                url=QDRANT_URL,
-                port=QDRANT_PORT
-            )
-            logging.info("Connected to Qdrant cloud service")
-        else:
-            # Use local Qdrant
-            client = QdrantClient(":memory:")  # In-memory storage for testing
-            logging.info("Using in-memory Qdrant instance")
+        # Reuse the process-wide client, which talks gRPC to Qdrant cloud
+        client = get_qdrant_client()
         
         # Check if collection exists, if not create it
         collections = client.get_collections().collections
@@ -281,7 +328,9 @@ def initialize_qdrant_client():
             logging.info(f"Creating collection: {DELIVERY_COLLECTION}")
             client.create_collection(
                 collection_name=DELIVERY_COLLECTION,
-                vectors_config=VectorParams(size=EMBEDDING_SIZE, distance=Distance.COSINE)
+                vectors_config=VectorParams(size=EMBEDDING_SIZE, distance=Distance.COSINE),
+                hnsw_config=HNSW_CONFIG,
+                quantization_config=QUANTIZATION_CONFIG
             )
         else:
             logging.info(f"Collection {DELIVERY_COLLECTION} already exists")
@@ -293,7 +342,9 @@ def initialize_qdrant_client():
                 client.delete_collection(collection_name=DELIVERY_COLLECTION)
                 client.create_collection(
                     collection_name=DELIVERY_COLLECTION,
-                    vectors_config=VectorParams(size=EMBEDDING_SIZE, distance=Distance.COSINE)
+                    vectors_config=VectorParams(size=EMBEDDING_SIZE, distance=Distance.COSINE),
+                    hnsw_config=HNSW_CONFIG,
+                    quantization_config=QUANTIZATION_CONFIG
                 )
         
         return client
@@ -323,46 +374,59 @@ def ingest_delivery_data_to_qdrant():
         embeddings_manager = EmbeddingsManager(openai_api_key)
         qdrant_client = initialize_qdrant_client()
         
-        # Fetch delivery data from MySQL
-        logging.info("Fetching delivery data from MySQL...")
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        deliveries = fetch_delivery_data(cursor)
+        recreate = os.getenv('RECREATE_COLLECTIONS', 'false').lower() == 'true'
+        since = get_watermark(DELIVERY_COLLECTION) if INCREMENTAL_INGEST and not recreate else None
+        latest_update = None
+        
+        def delivery_batches(deliveries):
+            nonlocal latest_update
+            for batch, (texts, processed_deliveries) in map_batches(prepare_delivery_data_for_embedding, batched(deliveries)):
+                ids = [delivery_point_id(delivery) for delivery in batch]
+                for delivery in batch:
+                    updated_at = delivery.get('updated_at')
+                    if updated_at and (latest_update is None or updated_at > latest_update):
+                        latest_update = updated_at
+                yield texts, (ids, processed_deliveries)
+        
+        def embed(texts):
+            return get_or_compute(texts, embeddings_manager.embed_in_batches)
+        
+        def upload(embeddings, batch):
+            ids, processed_deliveries = batch
+            qdrant_client.upload_collection(
+                collection_name=DELIVERY_COLLECTION,
+                vectors=np.asarray(embeddings, dtype=np.float32),
+                payload=[compact_payload(delivery) for delivery in processed_deliveries],
+                ids=ids,
+                batch_size=UPLOAD_BATCH_SIZE
+            )
         
-        if not deliveries:
+        # Stream delivery data from MySQL, using a second connection for the related
+        # tables while the delivery rows are being read, and embed and upload each batch
+        # while the next ones are fetched
+        logging.info("Ingesting delivery data from MySQL into Qdrant...")
+        conn = get_db_connection()
+        lookup_conn = get_db_connection()
+        try:
+            cursor = conn.cursor(dictionary=True, buffered=False)
+            lookup_cursor = lookup_conn.cursor(dictionary=True)
+            
+            with deferred_indexing(qdrant_client, DELIVERY_COLLECTION):
+                count = run_pipeline(delivery_batches(fetch_delivery_data(cursor, lookup_cursor, since)), embed, upload)
+        finally:
+            conn.close()
+            lookup_conn.close()
+        
+        if not count:
+            if since is not None:
+                logging.info(f"No deliveries updated since {since}")
+                return True
             logging.error("No delivery data found or error fetching data")
             return False
         
-        # Prepare data for embedding
-        logging.info("Preparing delivery data for embedding...")
-        texts, processed_deliveries = prepare_delivery_data_for_embedding(deliveries)
-        
-        # Create embeddings
-        logging.info(f"Creating embeddings for {len(texts)} delivery records...")
-        embeddings = embeddings_manager.create_embeddings(texts)
-        
-        # Ingest data into Qdrant
-        logging.info("Ingesting delivery data into Qdrant...")
-        
-        # Prepare points for batch upload
-        points = []
-        for i, (embedding, delivery) in enumerate(zip(embeddings, processed_deliveries)):
-            points.append(models.PointStruct(
-                id=i,
-                vector=embedding.tolist(),
-                payload=delivery
-            ))
-        
-        # Upload in batches of 100
-        batch_size = 100
-        for i in range(0, len(points), batch_size):
-            batch = points[i:i + batch_size]
-            qdrant_client.upsert(
-                collection_name=DELIVERY_COLLECTION,
-                points=batch
-            )
-            logging.info(f"Uploaded batch {i//batch_size + 1}/{(len(points) + batch_size - 1)//batch_size}")
-        
+        logging.info(f"Uploaded {count} deliveries")
+        if latest_update is not None:
+            set_watermark(DELIVERY_COLLECTION, str(latest_update))
         logging.info("Delivery data ingestion completed successfully!")
         return True
             
@@ -1,12 +1,17 @@
 import os
 import logging
 import json
+from decimal import Decimal
 import mysql.connector
+from mysql.connector.pooling import MySQLConnectionPool
 import numpy as np
 from dotenv import load_dotenv
 from src.embeddings_manager import EmbeddingsManager
+from src.embedding_cache import get_or_compute
 from src.qdrant_manager import QdrantManager
-from qdrant_client.http import models
+from src.qdrant_connection import UPLOAD_BATCH_SIZE, compact_payload, deferred_indexing, point_id
+from src.ingest_pipeline import batched, map_batches, run_pipeline
+from src.ingest_state import get_watermark, set_watermark
 
 # Configure logging
 logging.basicConfig(
@@ -23,73 +28,93 @@ DB_CONFIG = {
     'port': int(os.getenv('MYSQL_DB_PORT', 3306)),
     'user': os.getenv('MYSQL_DB_USERNAME'),
     'password': os.getenv('MYSQL_DB_PASSWORD'),
-    'database': os.getenv('MYSQL_DB_NAME', 'boship')  # Default database name
+    'database': os.getenv('MYSQL_DB_NAME', 'boship'),  # Default database name
+    # Decode rows in the connector's C extension rather than in pure Python
+    'use_pure': False
 }
+DB_POOL_SIZE = int(os.getenv('MYSQL_INGEST_POOL_SIZE', 4))
+
+# Only ingest hotels updated since the last successful run
+INCREMENTAL_INGEST = os.getenv('INCREMENTAL_INGEST', 'false').lower() == 'true'
+
+_db_pool = None
 
 def get_db_connection():
     """
-    Establish a connection to the MySQL database
+    Get a connection to the MySQL database from the ingest connection pool
     """
+    global _db_pool
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        logging.info("Database connection established successfully")
-        return conn
+        if _db_pool is None:
+            _db_pool = MySQLConnectionPool(pool_name="hotel_ingest", pool_size=DB_POOL_SIZE, **DB_CONFIG)
+            logging.info("Database connection pool created successfully")
+            if not mysql.connector.HAVE_CEXT:
+                logging.warning("MySQL C extension not available, rows are decoded in pure Python")
+        return _db_pool.get_connection()
     except mysql.connector.Error as err:
         logging.error(f"Database connection error: {err}")
         raise
 
-def fetch_hotel_data():
+def fetch_hotel_data(since=None):
     """
-    Fetch hotel data and related information from MySQL database
+    Stream hotel data and related information from MySQL database
+    
+    Each hotel row comes with its rooms and amenities aggregated into JSON arrays by
+    MySQL, so the whole fetch is one query read from an unbuffered cursor.
+    
+    Args:
+        since: Only fetch hotels updated at or after this time, all hotels if None
+        
+    Yields:
+        Hotel records with related data
     """
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor(dictionary=True, buffered=False)
     
     try:
         # Fetch hotels
         logging.info("Fetching hotels from database...")
-        cursor.execute("""
-            SELECT h.*, ht.name as type_name 
+        query = """
+            SELECT h.*, ht.name as type_name,
+                (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+                    'id', hr.id, 'name', hr.name, 'price', hr.price,
+                    'discount_price', hr.discount_price, 'discount_rate', hr.discount_rate,
+                    'qty_people', hr.qty_people, 'acreage', hr.acreage,
+                    'view', hr.view, 'description', hr.description))
+                 FROM hotel_room hr
+                 WHERE hr.hotel_id = h.id AND hr.is_active = 1) as rooms_json,
+                (SELECT JSON_ARRAYAGG(JSON_OBJECT(
+                    'hotel_id', ham.hotel_id, 'amenities_id', ham.amenities_id,
+                    'name', ha.name, 'group_name', hag.name))
+                 FROM hotel_amenities_many ham
+                 JOIN hotel_amenities ha ON ham.amenities_id = ha.id
+                 LEFT JOIN hotel_amenities_group hag ON ha.group_id = hag.id
+                 WHERE ham.hotel_id = h.id) as amenities_json
             FROM hotel h
             LEFT JOIN hotel_type ht ON h.type_id = ht.id
             WHERE h.is_active = 1
-        """)
-        hotels = cursor.fetchall()
-        logging.info(f"Fetched {len(hotels)} hotels")
+        """
+        if since is None:
+            cursor.execute(query)
+        else:
+            logging.info(f"Fetching hotels updated since {since}")
+            cursor.execute(query + " AND h.updated_at >= %s", (since,))
+        count = 0
+        for hotel in cursor:
+            count += 1
+            # Keep DECIMAL prices as Decimal, as when the rows were read directly
+            rooms_json = hotel.pop('rooms_json')
+            amenities_json = hotel.pop('amenities_json')
+            hotel['rooms'] = json.loads(rooms_json, parse_float=Decimal) if rooms_json else []
+            hotel['amenities'] = json.loads(amenities_json, parse_float=Decimal) if amenities_json else []
+            yield hotel
         
-        # Process each hotel to get rooms and amenities
-        for hotel in hotels:
-            hotel_id = hotel['id']
-            
-            # Fetch rooms for this hotel
-            cursor.execute("""
-                SELECT * FROM hotel_room 
-                WHERE hotel_id = %s AND is_active = 1
-            """, (hotel_id,))
-            hotel['rooms'] = cursor.fetchall()
-            
-            # Fetch amenities for this hotel
-            cursor.execute("""
-                SELECT ham.hotel_id, ham.amenities_id, ha.name, hag.name as group_name
-                FROM hotel_amenities_many ham
-                JOIN hotel_amenities ha ON ham.amenities_id = ha.id
-                LEFT JOIN hotel_amenities_group hag ON ha.group_id = hag.id
-                WHERE ham.hotel_id = %s
-            """, (hotel_id,))
-            hotel['amenities'] = cursor.fetchall()
-            
-            # Fetch images for this hotel
-            cursor.execute("""
-                SELECT * FROM hotel_image
-                WHERE hotel_id = %s
-            """, (hotel_id,))
-            hotel['images'] = cursor.fetchall()
-            
-        return hotels
+        logging.info(f"Fetched {count} hotels")
         
     except mysql.connector.Error as err:
+        # Raise rather than end the stream early, so a partial ingest isn't reported as complete
         logging.error(f"Error fetching hotel data: {err}")
-        return []
+        raise
     finally:
         cursor.close()
         conn.close()
@@ -102,46 +127,122 @@ def create_text_representations(hotels):
     
     for hotel in hotels:
         # Basic hotel info
-        hotel_text = f"Hotel ID: {hotel.get('id')}\n"
-        hotel_text += f"Name: {hotel.get('name', 'Unknown')}\n"
-        hotel_text += f"Type: {hotel.get('type_name', 'Unknown')}\n"
-        hotel_text += f"Address: {hotel.get('address', 'Unknown')}\n"
-        hotel_text += f"Location: Latitude {hotel.get('latitude', 'Unknown')}, Longitude {hotel.get('longitude', 'Unknown')}\n"
-        hotel_text += f"Rating: {hotel.get('star', 0)} stars, {hotel.get('rating_point', 0)} points from {hotel.get('rating_count', 0)} reviews\n"
+        parts = [f"Hotel ID: {hotel.get('id')}\n"]
+        parts.append(f"Name: {hotel.get('name', 'Unknown')}\n")
+        parts.append(f"Type: {hotel.get('type_name', 'Unknown')}\n")
+        parts.append(f"Address: {hotel.get('address', 'Unknown')}\n")
+        parts.append(f"Location: Latitude {hotel.get('latitude', 'Unknown')}, Longitude {hotel.get('longitude', 'Unknown')}\n")
+        parts.append(f"Rating: {hotel.get('star', 0)} stars, {hotel.get('rating_point', 0)} points from {hotel.get('rating_count', 0)} reviews\n")
         
         if hotel.get('description'):
-            hotel_text += f"Description: {hotel.get('description')}\n"
+            parts.append(f"Description: {hotel.get('description')}\n")
         
         if hotel.get('general_policy'):
-            hotel_text += f"General Policy: {hotel.get('general_policy')}\n"
+            parts.append(f"General Policy: {hotel.get('general_policy')}\n")
         
         # Amenities
         if hotel.get('amenities'):
-            hotel_text += "Amenities:\n"
+            parts.append("Amenities:\n")
             for amenity in hotel.get('amenities', []):
-                hotel_text += f"- {amenity.get('name', 'Unknown')}\n"
+                parts.append(f"- {amenity.get('name', 'Unknown')}\n")
         
         # Rooms
         if hotel.get('rooms'):
-            hotel_text += "Rooms:\n"
+            parts.append("Rooms:\n")
             for room in hotel.get('rooms', []):
-                hotel_text += f"- {room.get('name', 'Unknown')} Room\n"
-                hotel_text += f"  Capacity: {room.get('qty_people', 0)} people, Size: {room.get('acreage', 0)} sqm\n"
-                hotel_text += f"  Price: {room.get('price', 0)} VND"
+                parts.append(f"- {room.get('name', 'Unknown')} Room\n")
+                parts.append(f"  Capacity: {room.get('qty_people', 0)} people, Size: {room.get('acreage', 0)} sqm\n")
+                parts.append(f"  Price: {room.get('price', 0)} VND")
                 if room.get('discount_price'):
-                    hotel_text += f", Discounted: {room.get('discount_price')} VND ({room.get('discount_rate', 0)}% off)\n"
+                    parts.append(f", Discounted: {room.get('discount_price')} VND ({room.get('discount_rate', 0)}% off)\n")
                 else:
-                    hotel_text += "\n"
+                    parts.append("\n")
                 
                 if room.get('view'):
-                    hotel_text += f"  View: {room.get('view')}\n"
+                    parts.append(f"  View: {room.get('view')}\n")
                 if room.get('description'):
-                    hotel_text += f"  Description: {room.get('description')}\n"
+                    parts.append(f"  Description: {room.get('description')}\n")
         
-        hotel_texts.append(hotel_text)
+        hotel_texts.append("".join(parts))
     
     return hotel_texts
 
+class HotelQdrantManager(QdrantManager):
+    """
+    QdrantManager for the hotel collection.
+    """
+    def __init__(self):
+        super().__init__()
+        self.collection_name = "hotel_collection"  # Use a different collection for hotels
+        self._create_collection_if_not_exists()
+    
+    def ingest_hotel_data(self, hotels_data, embeddings):
+        """
+        Ingest hotel data and embeddings into Qdrant.
+        
+        Args:
+            hotels_data: Hotels to ingest, each with an id
+            embeddings: Embeddings of the hotels
+        """
+        try:
+            logging.info(f"Ingesting {len(hotels_data)} hotels into Qdrant")
+            
+            ids = []
+            payloads = []
+            for hotel in hotels_data:
+                hotel_id = hotel['id']
+                
+                # Extract rooms for payload
+                rooms = []
+                for room in hotel.get('rooms', []):
+                    rooms.append({
+                        'id': room.get('id'),
+                        'name': room.get('name', ''),
+                        'price': room.get('price', 0),
+                        'discount_price': room.get('discount_price', 0),
+                        'capacity': room.get('qty_people', 0),
+                        'size': room.get('acreage', 0),
+                        'view': room.get('view', '')
+                    })
+                
+                # Extract amenities for payload
+                amenities = []
+                for amenity in hotel.get('amenities', []):
+                    amenities.append({
+                        'id': amenity.get('id'),
+                        'name': amenity.get('name', '')
+                    })
+                
+                # Derive the point ID from the hotel ID so a re-ingest overwrites the same point
+                ids.append(point_id("hotel", hotel_id))
+                payloads.append({
+                    'id': hotel_id,
+                    'name': hotel.get('name', ''),
+                    'type': hotel.get('type_name', ''),
+                    'address': hotel.get('address', ''),
+                    'star': hotel.get('star', 0),
+                    'rating_point': hotel.get('rating_point', 0),
+                    'rating_count': hotel.get('rating_count', 0),
+                    'latitude': hotel.get('latitude'),
+                    'longitude': hotel.get('longitude'),
+                    'description': hotel.get('description', ''),
+                    'rooms': rooms,
+                    'amenities': amenities
+                })
+            
+            self.client.upload_collection(
+                collection_name=self.collection_name,
+                vectors=np.asarray(embeddings, dtype=np.float32),
+                payload=[compact_payload(payload) for payload in payloads],
+                ids=ids,
+                batch_size=UPLOAD_BATCH_SIZE
+            )
+            logging.info(f"Uploaded batch of {len(ids)} hotels")
+            return True
+        except Exception as e:
+            logging.error(f"Error ingesting hotel data into Qdrant: {e}")
+            return False
+
 def ingest_hotel_data_to_qdrant():
     """
     Main function to ingest hotel data from MySQL to Qdrant
@@ -164,118 +265,54 @@ def ingest_hotel_data_to_qdrant():
         logging.info("Initializing components...")
         embeddings_manager = EmbeddingsManager(openai_api_key)
         
-        # Create a custom QdrantManager for hotels
-        class HotelQdrantManager(QdrantManager):
-            def __init__(self):
-                super().__init__()
-                self.collection_name = "hotel_collection"  # Use a different collection for hotels
-                self._create_collection_if_not_exists()
-            
-            def ingest_hotel_data(self, hotels_data, embeddings):
-                """
-                Ingest hotel data and embeddings into Qdrant.
-                """
-                try:
-                    logging.info(f"Ingesting {len(hotels_data)} hotels into Qdrant")
-                    
-                    # Prepare points for batch upload
-                    points = []
-                    for i, (hotel, embedding) in enumerate(zip(hotels_data, embeddings)):
-                        # Create a unique ID for each hotel
-                        hotel_id = hotel.get('id', str(i))
-                        
-                        # Extract rooms for payload
-                        rooms = []
-                        for room in hotel.get('rooms', []):
-                            rooms.append({
-                                'id': room.get('id'),
-                                'name': room.get('name', ''),
-                                'price': room.get('price', 0),
-                                'discount_price': room.get('discount_price', 0),
-                                'capacity': room.get('qty_people', 0),
-                                'size': room.get('acreage', 0),
-                                'view': room.get('view', '')
-                            })
-                        
-                        # Extract amenities for payload
-                        amenities = []
-                        for amenity in hotel.get('amenities', []):
-                            amenities.append({
-                                'id': amenity.get('id'),
-                                'name': amenity.get('name', '')
-                            })
-                        
-                        # Create point with valid ID (ensure it's an integer)
-                        try:
-                            point_id = int(hotel_id)
-                        except (ValueError, TypeError):
-                            point_id = i
-                            
-                        point = models.PointStruct(
-                            id=point_id,
-                            vector=embedding.tolist(),
-                            payload={
-                                'id': hotel_id,
-                                'name': hotel.get('name', ''),
-                                'type': hotel.get('type_name', ''),
-                                'address': hotel.get('address', ''),
-                                'star': hotel.get('star', 0),
-                                'rating_point': hotel.get('rating_point', 0),
-                                'rating_count': hotel.get('rating_count', 0),
-                                'latitude': hotel.get('latitude'),
-                                'longitude': hotel.get('longitude'),
-                                'description': hotel.get('description', ''),
-                                'rooms': rooms,
-                                'amenities': amenities
-                            }
-                        )
-                        points.append(point)
-                        
-                        # Upload in batches of 100 to avoid memory issues
-                        if len(points) >= 100 or i == len(hotels_data) - 1:
-                            self.client.upsert(
-                                collection_name=self.collection_name,
-                                points=points
-                            )
-                            logging.info(f"Uploaded batch of {len(points)} hotels")
-                            points = []
-                    
-                    logging.info("Hotel data ingestion completed successfully")
-                    return True
-                except Exception as e:
-                    logging.error(f"Error ingesting hotel data into Qdrant: {e}")
-                    return False
-        
         # Initialize the hotel Qdrant manager
         hotel_qdrant_manager = HotelQdrantManager()
         
-        # Fetch hotel data from MySQL
-        logging.info("Fetching hotel data from MySQL...")
-        hotels_data = fetch_hotel_data()
+        since = get_watermark(hotel_qdrant_manager.collection_name) if INCREMENTAL_INGEST else None
+        latest_update = None
         
-        if not hotels_data:
-            logging.error("No hotel data loaded! Check database connection and queries.")
-            return False
+        def hotels_with_id(hotels):
+            # A hotel without an id has no point of its own to overwrite, so it is skipped
+            for hotel in hotels:
+                if hotel.get('id') is None:
+                    logging.warning(f"Skipping hotel without an id: {hotel.get('name', '')}")
+                    continue
+                yield hotel
         
-        # Create text representations for hotels
-        logging.info("Creating text representations...")
-        hotel_texts = create_text_representations(hotels_data)
+        def hotel_batches(hotels):
+            nonlocal latest_update
+            for batch, texts in map_batches(create_text_representations, batched(hotels_with_id(hotels))):
+                for hotel in batch:
+                    updated_at = hotel.get('updated_at')
+                    if updated_at and (latest_update is None or updated_at > latest_update):
+                        latest_update = updated_at
+                yield texts, batch
         
-        # Generate embeddings
-        logging.info("Generating embeddings...")
-        hotel_embeddings = embeddings_manager.create_embeddings(hotel_texts)
-        logging.info(f"Generated {len(hotel_embeddings)} embeddings")
+        def embed(texts):
+            return get_or_compute(texts, embeddings_manager.embed_in_batches)
         
-        # Ingest data into Qdrant
-        logging.info("Ingesting hotel data into Qdrant...")
-        success = hotel_qdrant_manager.ingest_hotel_data(hotels_data, hotel_embeddings)
+        def upload(embeddings, hotels):
+            if not hotel_qdrant_manager.ingest_hotel_data(hotels, embeddings):
+                raise RuntimeError("Error uploading a batch of hotels")
         
-        if success:
-            logging.info("Hotel data ingestion completed successfully!")
-            return True
-        else:
-            logging.error("Hotel data ingestion failed!")
+        # Stream hotel data from MySQL, and embed and upload each batch while the next
+        # ones are fetched
+        logging.info("Ingesting hotel data from MySQL into Qdrant...")
+        with deferred_indexing(hotel_qdrant_manager.client, hotel_qdrant_manager.collection_name):
+            count = run_pipeline(hotel_batches(fetch_hotel_data(since)), embed, upload)
+        
+        if not count:
+            if since is not None:
+                logging.info(f"No hotels updated since {since}")
+                return True
+            logging.error("No hotel data loaded! Check database connection and queries.")
             return False
+        
+        logging.info(f"Uploaded {count} hotels")
+        if latest_update is not None:
+            set_watermark(hotel_qdrant_manager.collection_name, str(latest_update))
+        logging.info("Hotel data ingestion completed successfully!")
+        return True
             
     except Exception as e:
         logging.error(f"Error during hotel data ingestion: {e}")
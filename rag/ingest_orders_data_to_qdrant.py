@@ -1,21 +1,143 @@
 import os
-import json
+import orjson
 import logging
 import time
+import functools
 from dotenv import load_dotenv
 import numpy as np
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Iterator
 import pandas as pd
 import mysql.connector
-from datetime import datetime
+from mysql.connector.constants import FieldType
+from concurrent.futures import ThreadPoolExecutor
 
 from src.embeddings_manager import EmbeddingsManager
+from src.embedding_cache import get_or_compute
 from src.qdrant_manager import QdrantManager
+from src.qdrant_connection import deferred_indexing, point_id
+from src.ingest_pipeline import TEXT_PROCESSES, batched, map_batches, run_pipeline
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Texts per embeddings request
+EMBEDDING_BATCH_SIZE = int(os.getenv('EMBEDDING_BATCH_SIZE', 512))
+
+# Points per upsert request, and number of requests in flight at once
+UPSERT_BATCH_SIZE = int(os.getenv('QDRANT_UPSERT_BATCH', 64))
+UPSERT_CONCURRENCY = int(os.getenv('QDRANT_UPSERT_CONCURRENCY', 8))
+
+# Orders read from MySQL and processed at a time
+FETCH_BATCH_SIZE = int(os.getenv('ORDERS_FETCH_BATCH', 10000))
+
+# Order date columns converted to ISO 8601 strings by MySQL rather than per row in Python
+ISO_DATE_COLUMNS = ('created_at', 'updated_at')
+ISO_DATE_SELECT = ", ".join(
+    # %T is hh:mm:ss, the query can't contain %s as it is used for the query parameters
+    f"DATE_FORMAT(o.{column}, '%Y-%m-%dT%T') as {column}" for column in ISO_DATE_COLUMNS
+)
+
+# Names of the order service types (type_order_id) and statuses (orderstatus_id)
+SERVICE_TYPES = {1: 'Restaurant', 2: 'Hotel', 3: 'Taxi'}
+ORDER_STATUSES = {1: 'Pending', 2: 'Confirmed', 3: 'Completed', 4: 'Cancelled'}
+
+# Marks the fields an order record doesn't have, which differ from fields set to None or NaN
+MISSING = object()
+
+def build_order_texts(orders: pd.DataFrame) -> pd.Series:
+    """
+    Create the text representations of many orders at once, built column by column.
+    
+    Each text has the same content as building it per order with f-strings, which keeps
+    the texts of earlier runs, and with them their cached embeddings, valid. The frame
+    must have object columns holding the values as they are, with MISSING for the fields
+    an order doesn't have, as built by create_order_texts.
+    
+    Args:
+        orders: Raw order data, one row per order
+    
+    Returns:
+        Series of text representations, aligned with the rows
+    """
+    empty = pd.Series("", index=orders.index)
+    
+    def has(name: str) -> pd.Series:
+        if name not in orders:
+            return pd.Series(False, index=orders.index)
+        return orders[name].map(lambda value: value is not MISSING)
+    
+    def column(name: str, default: str = "Unknown") -> pd.Series:
+        if name not in orders:
+            return pd.Series(default, index=orders.index)
+        # str of each value, as in an f-string: 5 stays "5", None becomes "None" and NaN "nan"
+        return orders[name].map(lambda value: default if value is MISSING else str(value))
+    
+    def present(name: str) -> pd.Series:
+        # Fields that are missing or falsy (None, "" and 0) are skipped, NaN is truthy
+        if name not in orders:
+            return pd.Series(False, index=orders.index)
+        return orders[name].map(lambda value: value is not MISSING and bool(value))
+    
+    def line(label: str, name: str) -> pd.Series:
+        return (label + ": " + column(name) + "\n").where(present(name), empty)
+    
+    order_text = "Order ID: " + column('id') + "\n"
+    
+    # Add user information
+    order_text += "User ID: " + column('user_id') + "\n"
+    order_text += line("User Name", 'user_name')
+    order_text += line("User Phone", 'user_phone')
+    order_text += line("User Email", 'user_email')
+    
+    # Add service type and status information, the names when the order has them
+    service_type = "Service Type: " + column('service_type') + "\n"
+    order_text += service_type.where(has('service_type'), "Order Type ID: " + column('type_order_id') + "\n")
+    status = "Status: " + column('status') + "\n"
+    order_text += status.where(has('status'), "Status ID: " + column('orderstatus_id') + "\n")
+    
+    # Add payment information
+    order_text += "Payment Method: " + column('payment_method_code') + "\n"
+    
+    # Add location information if available
+    has_location = present('latitude') & present('longitude')
+    location = "Location: " + column('latitude') + ", " + column('longitude') + "\n"
+    order_text += location.where(has_location, empty)
+    
+    # Add address, pricing and date information if available
+    order_text += line("Address", 'address')
+    order_text += line("Total", 'total')
+    order_text += line("Created At", 'created_at')
+    order_text += line("Updated At", 'updated_at')
+    
+    # Add any additional fields that might be useful for searching, one column at a time
+    important_fields = ['promo_restaurant_code', 'distance', 'delivery_charge',
+                        'total_discount', 'note', 'phone', 'flash_detail_buy',
+                        'reason_cancel', 'point_delivery_id', 'area']
+    
+    for field in important_fields:
+        order_text += line(field.replace('_', ' ').title(), field)
+    
+    return order_text
+
+def create_order_texts(orders: List[Dict[str, Any]]) -> List[str]:
+    """
+    Create the text representations of a batch of orders.
+    
+    Defined at module level so batches can be handed to worker processes. The frame
+    keeps the values as they are (object dtype) rather than inferring column types, and
+    fields missing from some orders (JSON records differ) are MISSING rather than NaN.
+    
+    Args:
+        orders: Raw order data
+        
+    Returns:
+        Text representations, in the order of the orders
+    """
+    columns = list(dict.fromkeys(name for order in orders for name in order))
+    rows = [[order.get(name, MISSING) for name in columns] for order in orders]
+    return build_order_texts(pd.DataFrame(rows, columns=columns, dtype=object)).tolist()
+
 class OrdersQdrantManager(QdrantManager):
     """
     Specialized QdrantManager for orders data that uses a different collection name.
@@ -41,109 +163,58 @@ class OrdersDataIngester:
         
         logger.info("Orders Data Ingester initialized")
     
-    def prepare_order_data(self, order: Dict[str, Any]) -> Dict[str, Any]:
+    def _embed_texts(self, texts: List[str]) -> np.ndarray:
         """
-        Prepare order data for ingestion by creating a text representation
-        and extracting relevant fields.
+        Create embeddings for order texts.
+        
+        Identical texts are sent to the API once: get_or_compute embeds each uncached
+        text once and embed_in_batches drops repeated texts before batching.
         
         Args:
-            order: Raw order data
+            texts: Text representations of orders
             
         Returns:
-            Processed order data ready for embedding
+            (N, D) float32 matrix of embeddings, one row per text
         """
-        # Create a text representation of the order for embedding
-        order_text = f"Order ID: {order.get('id', 'Unknown')}\n"
-        
-        # Add user information
-        order_text += f"User ID: {order.get('user_id', 'Unknown')}\n"
-        if 'user_name' in order and order['user_name']:
-            order_text += f"User Name: {order.get('user_name')}\n"
-        if 'user_phone' in order and order['user_phone']:
-            order_text += f"User Phone: {order.get('user_phone')}\n"
-        if 'user_email' in order and order['user_email']:
-            order_text += f"User Email: {order.get('user_email')}\n"
-        
-        # Add service type information
-        if 'service_type' in order:
-            order_text += f"Service Type: {order.get('service_type')}\n"
-        else:
-            order_text += f"Order Type ID: {order.get('type_order_id', 'Unknown')}\n"
-        
-        # Add status information
-        if 'status' in order:
-            order_text += f"Status: {order.get('status')}\n"
-        else:
-            order_text += f"Status ID: {order.get('orderstatus_id', 'Unknown')}\n"
-        
-        # Add payment information
-        order_text += f"Payment Method: {order.get('payment_method_code', 'Unknown')}\n"
-        
-        # Add location information if available
-        if 'latitude' in order and 'longitude' in order and order['latitude'] and order['longitude']:
-            order_text += f"Location: {order.get('latitude')}, {order.get('longitude')}\n"
-        
-        # Add address if available
-        if 'address' in order and order['address']:
-            order_text += f"Address: {order.get('address')}\n"
-        
-        # Add pricing information
-        if 'total' in order and order['total']:
-            order_text += f"Total: {order.get('total')}\n"
-        
-        # Add date information
-        if 'created_at' in order and order['created_at']:
-            order_text += f"Created At: {order.get('created_at')}\n"
-        if 'updated_at' in order and order['updated_at']:
-            order_text += f"Updated At: {order.get('updated_at')}\n"
-        
-        # Add any additional fields that might be useful for searching
-        important_fields = ['promo_restaurant_code', 'distance', 'delivery_charge', 
-                           'total_discount', 'note', 'phone', 'flash_detail_buy', 
-                           'reason_cancel', 'point_delivery_id', 'area']
-        
-        for field in important_fields:
-            if field in order and order[field]:
-                order_text += f"{field.replace('_', ' ').title()}: {order[field]}\n"
-        
-        # Return the processed order with text representation
-        return {
-            "id": order.get('id'),
-            "text_representation": order_text,
-            **order  # Include all original fields
-        }
+        # Create embeddings with many texts per request, split to stay within API limits,
+        # for the texts not embedded on an earlier run
+        return get_or_compute(
+            texts, functools.partial(self.embeddings_manager.embed_in_batches, batch_size=EMBEDDING_BATCH_SIZE)
+        )
     
-    def create_embeddings_for_orders(self, orders: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    def _upsert_batch(self, batch_number: int, batch_points: List[Dict[str, Any]], total_batches: int) -> bool:
         """
-        Create embeddings for a list of orders.
+        Upsert one batch of points, retrying with exponential backoff.
         
         Args:
-            orders: List of processed order data
+            batch_number: Position of the batch, for logging
+            batch_points: Points to upsert
+            total_batches: Number of batches in the ingest, for logging
             
         Returns:
-            List of orders with embeddings
+            True if the batch was uploaded, False otherwise
         """
-        logger.info(f"Creating embeddings for {len(orders)} orders")
-        
-        # Extract text representations for embedding
-        texts = [order["text_representation"] for order in orders]
-        
-        # Create embeddings in batches to avoid API limits
-        batch_size = 100
-        all_embeddings = []
+        logger.info(f"Uploading batch {batch_number}/{total_batches}")
+        batch_points = [{**point, "vector": point["vector"].tolist()} for point in batch_points]
         
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i+batch_size]
-            logger.info(f"Processing batch {i//batch_size + 1}/{(len(texts)-1)//batch_size + 1}")
-            
-            batch_embeddings = self.embeddings_manager.create_embeddings(batch_texts)
-            all_embeddings.extend(batch_embeddings)
-        
-        # Add embeddings to order data
-        for i, order in enumerate(orders):
-            order["embedding"] = all_embeddings[i].tolist()
-        
-        return orders
+        # Add retry logic for uploading points
+        max_retries = 3
+        for retry_count in range(1, max_retries + 1):
+            try:
+                self.qdrant_manager.client.upsert(
+                    collection_name=self.qdrant_manager.collection_name,
+                    points=batch_points
+                )
+                logger.info(f"Successfully uploaded batch {batch_number}")
+                return True
+            except Exception as e:
+                wait_time = 2 ** retry_count
+                logger.warning(f"Error uploading batch {batch_number}: {e}. Retry {retry_count}/{max_retries} in {wait_time} seconds...")
+                time.sleep(wait_time)
+        
+        logger.error(f"Failed to upload batch {batch_number} after {max_retries} attempts")
+        # Continue with the other batches instead of failing completely
+        return False
     
     def ingest_orders_to_qdrant(self, orders_with_embeddings: List[Dict[str, Any]]) -> None:
         """
@@ -157,53 +228,27 @@ class OrdersDataIngester:
         # Prepare points for Qdrant
         points = []
         for order in orders_with_embeddings:
-            # Create a copy of the order without the embedding and text_representation
-            payload = {k: v for k, v in order.items() if k not in ["embedding", "text_representation"]}
+            # The order without the embedding becomes the payload, without copying it
+            embedding = order.pop("embedding")
             
-            # Add the point - ensure ID is an integer
-            try:
-                # Convert ID to integer
-                point_id = int(order["id"])
-            except (ValueError, TypeError):
-                # If conversion fails, use a hash of the ID as fallback
-                import hashlib
-                point_id = int(hashlib.md5(str(order["id"]).encode()).hexdigest(), 16) % (10 ** 10)
-                logger.warning(f"Converted non-integer ID '{order['id']}' to integer hash {point_id}")
-                
+            # Add the point - integer IDs are used as they are, others are mapped to a stable UUID
             points.append({
-                "id": point_id,
-                "vector": order["embedding"],
-                "payload": payload
+                "id": point_id("order", order.get("id")),
+                "vector": embedding,
+                "payload": order
             })
         
-        # Upload points to Qdrant in smaller batches to avoid timeouts
-        batch_size = 20  # Reduced batch size for more reliable uploads
-        for i in range(0, len(points), batch_size):
-            batch_points = points[i:i+batch_size]
-            logger.info(f"Uploading batch {i//batch_size + 1}/{(len(points)-1)//batch_size + 1}")
-            
-            # Add retry logic for uploading points
-            max_retries = 3
-            retry_count = 0
-            success = False
-            
-            while retry_count < max_retries and not success:
-                try:
-                    self.qdrant_manager.client.upsert(
-                        collection_name=self.qdrant_manager.collection_name,
-                        points=batch_points
-                    )
-                    success = True
-                    logger.info(f"Successfully uploaded batch {i//batch_size + 1}")
-                except Exception as e:
-                    retry_count += 1
-                    wait_time = 2 ** retry_count
-                    logger.warning(f"Error uploading batch {i//batch_size + 1}: {e}. Retry {retry_count}/{max_retries} in {wait_time} seconds...")
-                    time.sleep(wait_time)
-            
-            if not success:
-                logger.error(f"Failed to upload batch {i//batch_size + 1} after {max_retries} attempts")
-                # Continue with next batch instead of failing completely
+        # Upload points to Qdrant in batches, several batches at a time
+        batch_size = UPSERT_BATCH_SIZE
+        batches = [points[i:i+batch_size] for i in range(0, len(points), batch_size)]
+        with ThreadPoolExecutor(max_workers=UPSERT_CONCURRENCY) as executor:
+            futures = [
+                executor.submit(self._upsert_batch, batch_number, batch_points, len(batches))
+                for batch_number, batch_points in enumerate(batches, 1)
+            ]
+            failed = sum(not future.result() for future in futures)
+        if failed:
+            logger.error(f"{failed} of {len(batches)} batches could not be uploaded")
         
         logger.info(f"Successfully ingested {len(orders_with_embeddings)} orders into Qdrant")
     
@@ -246,8 +291,8 @@ class OrdersDataIngester:
         
         try:
             # Read JSON file
-            with open(json_path, 'r', encoding='utf-8') as f:
-                orders = json.load(f)
+            with open(json_path, 'rb') as f:
+                orders = orjson.loads(f.read())
                 
             logger.info(f"Loaded {len(orders)} orders from JSON")
             return orders
@@ -255,12 +300,22 @@ class OrdersDataIngester:
             logger.error(f"Error loading orders from JSON: {e}")
             return []
     
-    def fetch_orders_from_mysql(self) -> List[Dict[str, Any]]:
+    def fetch_orders_from_mysql(self, batch_size: int = FETCH_BATCH_SIZE, after_id: int = 0) -> Iterator[List[Dict[str, Any]]]:
         """
-        Fetch orders data directly from MySQL database.
+        Fetch orders data directly from MySQL database, streamed in batches.
         
-        Returns:
-            List of order data
+        Orders are read a page at a time in primary key order (keyset pagination), so only
+        one batch is held in memory and each page is a short indexed query.
+        
+        Args:
+            batch_size: Number of orders per batch
+            after_id: Only fetch orders with a greater id, to resume an interrupted ingest
+            
+        Yields:
+            Batches of order data
+            
+        Raises:
+            mysql.connector.Error: When connecting or a page fails, so a partial ingest isn't reported as complete
         """
         logger.info("Fetching orders from MySQL database")
         
@@ -273,80 +328,109 @@ class OrdersDataIngester:
             'database': os.getenv('MYSQL_DB_NAME', 'boship')
         }
         
+        # Connect to the database
+        conn = mysql.connector.connect(**db_config)
+        cursor = None
         try:
-            # Connect to the database
-            conn = mysql.connector.connect(**db_config)
             cursor = conn.cursor(dictionary=True)
             
-            # Fetch all orders with user information
-            cursor.execute("""
-                SELECT o.*, u.name as user_name, u.phone as user_phone, u.email as user_email
+            # Fetch orders with user information. The ISO date columns come after o.*,
+            # so they replace the raw datetimes of the same name in the dictionary rows.
+            query = f"""
+                SELECT o.*, u.name as user_name, u.phone as user_phone, u.email as user_email,
+                    {ISO_DATE_SELECT}
                 FROM orders o
                 LEFT JOIN users u ON o.user_id = u.id
-                ORDER BY o.created_at DESC
-            """)
-            orders = cursor.fetchall()
+                WHERE o.id > %s
+                ORDER BY o.id
+                LIMIT %s
+            """
             
-            # Process each order to get additional information if needed
-            for order in orders:
-                # Add service type information based on type_order_id
-                # 1: Restaurant, 2: Hotel, 3: Taxi, etc.
-                type_id = order.get('type_order_id')
-                if type_id == 1:
-                    order['service_type'] = 'Restaurant'
-                elif type_id == 2:
-                    order['service_type'] = 'Hotel'
-                elif type_id == 3:
-                    order['service_type'] = 'Taxi'
-                else:
-                    order['service_type'] = f'Service type {type_id}'
+            fetched = 0
+            date_columns = None
+            last_id = after_id
+            while True:
+                cursor.execute(query, (last_id, batch_size))
+                orders = cursor.fetchall()
+                if not orders:
+                    break
                 
-                # Add status information
-                status_id = order.get('orderstatus_id')
-                if status_id == 1:
-                    order['status'] = 'Pending'
-                elif status_id == 2:
-                    order['status'] = 'Confirmed'
-                elif status_id == 3:
-                    order['status'] = 'Completed'
-                elif status_id == 4:
-                    order['status'] = 'Cancelled'
-                else:
-                    order['status'] = f'Status {status_id}'
-            
-            # Convert datetime objects to strings for JSON serialization
-            for order in orders:
-                for key, value in order.items():
-                    if isinstance(value, datetime):
-                        order[key] = value.isoformat()
-            
-            logger.info(f"Fetched {len(orders)} orders from MySQL database")
+                if date_columns is None:
+                    # Any other date columns of the orders table are converted in Python
+                    date_columns = [
+                        column[0] for column in cursor.description
+                        if FieldType.get_info(column[1]) in ('DATE', 'DATETIME', 'TIMESTAMP')
+                        and column[0] not in ISO_DATE_COLUMNS
+                    ]
+                
+                last_id = orders[-1]['id']
+                self._add_order_details(orders, date_columns)
+                fetched += len(orders)
+                logger.info(f"Fetched {fetched} orders from MySQL database, up to id {last_id}")
+                yield orders
+                
+                if len(orders) < batch_size:
+                    break
             
+            logger.info(f"Fetched {fetched} orders from MySQL database")
+        finally:
             # Close database connection
-            cursor.close()
+            if cursor is not None:
+                cursor.close()
             conn.close()
+    
+    def _add_order_details(self, orders: List[Dict[str, Any]], date_columns: List[str]) -> None:
+        """
+        Add service type and status names to fetched orders, and convert their remaining dates to strings.
+        
+        Args:
+            orders: Orders fetched from MySQL
+            date_columns: Columns holding dates not already converted in SQL
+        """
+        # Process each order to get additional information if needed
+        for order in orders:
+            # Add service type information based on type_order_id
+            type_id = order.get('type_order_id')
+            order['service_type'] = SERVICE_TYPES.get(type_id) or f'Service type {type_id}'
             
-            return orders
-        except Exception as e:
-            logger.error(f"Error fetching orders from MySQL: {e}")
-            return []
+            # Add status information
+            status_id = order.get('orderstatus_id')
+            order['status'] = ORDER_STATUSES.get(status_id) or f'Status {status_id}'
             
+            # Convert datetime objects to strings for JSON serialization
+            for column in date_columns:
+                if order.get(column) is not None:
+                    order[column] = order[column].isoformat()
     
-    def process_and_ingest_orders(self, orders: List[Dict[str, Any]]) -> None:
+    def process_and_ingest_orders(self, order_batches: Iterable[List[Dict[str, Any]]]) -> int:
         """
         Process and ingest orders into Qdrant.
         
+        The orders are split into pipeline batches, and embedding one batch overlaps
+        with upserting the batches before it.
+        
         Args:
-            orders: List of raw order data
+            order_batches: Batches of raw order data
+            
+        Returns:
+            Number of orders ingested
         """
-        # Prepare order data
-        processed_orders = [self.prepare_order_data(order) for order in orders]
-        
-        # Create embeddings
-        orders_with_embeddings = self.create_embeddings_for_orders(processed_orders)
-        
-        # Ingest into Qdrant
-        self.ingest_orders_to_qdrant(orders_with_embeddings)
+        def pipeline_batches():
+            orders_stream = (order for orders in order_batches for order in orders)
+            # Text representations are built in worker processes when INGEST_TEXT_PROCESSES > 1
+            for orders, texts in map_batches(create_order_texts, batched(orders_stream), TEXT_PROCESSES):
+                # The raw orders are passed on as they are and become the payloads
+                yield texts, orders
+        
+        def upload(embeddings, orders):
+            for order, embedding in zip(orders, embeddings):
+                order["embedding"] = embedding
+            self.ingest_orders_to_qdrant(orders)
+        
+        # Index and quantize the collection once after the load instead of while it runs.
+        # Vectors are uploaded as float32 and quantized by Qdrant.
+        with deferred_indexing(self.qdrant_manager.client, self.qdrant_manager.collection_name):
+            return run_pipeline(pipeline_batches(), self._embed_texts, upload)
 
 def main():
     """
@@ -355,11 +439,17 @@ def main():
     # Initialize ingester
     ingester = OrdersDataIngester()
     
-    # Try to fetch orders from MySQL first
-    orders = ingester.fetch_orders_from_mysql()
+    # Try to stream orders from MySQL first
+    try:
+        ingested = ingester.process_and_ingest_orders(ingester.fetch_orders_from_mysql())
+    except mysql.connector.Error as e:
+        # Orders ingested before the error stay in the collection, and are overwritten
+        # by the same points if the fallback files hold them
+        logger.error(f"Error fetching orders from MySQL: {e}")
+        ingested = 0
     
     # If MySQL fetch fails, try local files as fallback
-    if not orders:
+    if not ingested:
         logger.warning("Failed to fetch orders from MySQL, trying local files as fallback")
         
         # Define data paths
@@ -375,12 +465,12 @@ def main():
         else:
             logger.error(f"No orders data found at {orders_json_path} or {orders_csv_path}")
             return
+        
+        if orders:
+            ingested = ingester.process_and_ingest_orders(batched(orders, FETCH_BATCH_SIZE))
     
-    # Process and ingest orders
-    if orders:
-        logger.info(f"Processing and ingesting {len(orders)} orders")
-        ingester.process_and_ingest_orders(orders)
-        logger.info("Orders ingestion completed successfully")
+    if ingested:
+        logger.info(f"Orders ingestion completed successfully, {ingested} orders ingested")
     else:
         logger.error("No orders data to ingest")
 
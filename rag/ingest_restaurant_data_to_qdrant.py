@@ -1,11 +1,14 @@
 import os
 import logging
 import json
+from collections import defaultdict
 import mysql.connector
 import numpy as np
 from dotenv import load_dotenv
 from src.embeddings_manager import EmbeddingsManager
+from src.embedding_cache import get_or_compute
 from src.qdrant_manager import QdrantManager
+from src.ingest_state import get_watermark, set_watermark
 from qdrant_client.http import models
 
 # Configure logging
@@ -26,6 +29,9 @@ DB_CONFIG = {
     'database': os.getenv('MYSQL_DB_NAME', 'boship')  # Default database name
 }
 
+# Only ingest restaurants updated, or with menu items updated, since the last successful run
+INCREMENTAL_INGEST = os.getenv('INCREMENTAL_INGEST', 'false').lower() == 'true'
+
 def get_db_connection():
     """
     Establish a connection to the MySQL database
@@ -38,41 +44,63 @@ def get_db_connection():
         logging.error(f"Database connection error: {err}")
         raise
 
-def fetch_restaurant_data():
+def fetch_restaurant_data(since=None):
     """
     Fetch restaurant data and related information from MySQL database
+    
+    Args:
+        since: Only fetch restaurants updated, or with menu items updated, at or after
+            this time, all restaurants if None
+            
+    Raises:
+        mysql.connector.Error: When a query fails
     """
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
     
+    if since is None:
+        restaurant_filter, params = "", ()
+    else:
+        logging.info(f"Fetching restaurants updated since {since}")
+        restaurant_filter = """
+            AND (r.updated_at >= %s
+                 OR r.id IN (SELECT restaurant_id FROM items WHERE updated_at >= %s))
+        """
+        params = (since, since)
+    
     try:
         # Fetch restaurants
         logging.info("Fetching restaurants from database...")
         cursor.execute("""
-            SELECT * FROM restaurants
-            WHERE is_active = 1
-        """)
+            SELECT * FROM restaurants r
+            WHERE r.is_active = 1
+        """ + restaurant_filter, params)
         restaurants = cursor.fetchall()
         logging.info(f"Fetched {len(restaurants)} restaurants")
         
-        # Process each restaurant to get menu items
+        # Fetch the menu items of all fetched restaurants in one query
+        cursor.execute("""
+            SELECT i.*, ic.name as category_name
+            FROM items i
+            JOIN restaurants r ON i.restaurant_id = r.id AND r.is_active = 1
+            LEFT JOIN item_category ic ON i.item_category_id = ic.id
+            WHERE i.is_active = 1
+        """ + restaurant_filter, params)
+        # Group items by restaurant as the rows arrive
+        items_by_restaurant = defaultdict(list)
+        for item in cursor:
+            items_by_restaurant[item['restaurant_id']].append(item)
+        
         for restaurant in restaurants:
-            restaurant_id = restaurant['id']
-            
-            # Fetch menu items for this restaurant
-            cursor.execute("""
-                SELECT i.*, ic.name as category_name
-                FROM items i
-                LEFT JOIN item_category ic ON i.item_category_id = ic.id
-                WHERE i.restaurant_id = %s AND i.is_active = 1
-            """, (restaurant_id,))
-            restaurant['items'] = cursor.fetchall()
+            restaurant['items'] = items_by_restaurant.get(restaurant['id'], [])
             
         return restaurants
         
     except mysql.connector.Error as err:
+        # Raise rather than return no restaurants, so a failed incremental fetch isn't
+        # reported as an empty delta
         logging.error(f"Error fetching restaurant data: {err}")
-        return []
+        raise
     finally:
         cursor.close()
         conn.close()
@@ -85,45 +113,45 @@ def create_text_representations(restaurants):
     
     for restaurant in restaurants:
         # Basic restaurant info
-        restaurant_text = f"Restaurant ID: {restaurant.get('id')}\n"
-        restaurant_text += f"Name: {restaurant.get('name', 'Unknown')}\n"
-        restaurant_text += f"Address: {restaurant.get('address', 'Unknown')}\n"
-        restaurant_text += f"Location: Latitude {restaurant.get('latitude', 'Unknown')}, Longitude {restaurant.get('longitude', 'Unknown')}\n"
-        restaurant_text += f"Rating: {restaurant.get('rating', 0)}\n"
+        parts = [f"Restaurant ID: {restaurant.get('id')}\n"]
+        parts.append(f"Name: {restaurant.get('name', 'Unknown')}\n")
+        parts.append(f"Address: {restaurant.get('address', 'Unknown')}\n")
+        parts.append(f"Location: Latitude {restaurant.get('latitude', 'Unknown')}, Longitude {restaurant.get('longitude', 'Unknown')}\n")
+        parts.append(f"Rating: {restaurant.get('rating', 0)}\n")
         
         if restaurant.get('address_description'):
-            restaurant_text += f"Address Description: {restaurant.get('address_description')}\n"
+            parts.append(f"Address Description: {restaurant.get('address_description')}\n")
         
         if restaurant.get('phone'):
-            restaurant_text += f"Phone: {restaurant.get('phone')}\n"
+            parts.append(f"Phone: {restaurant.get('phone')}\n")
         
         if restaurant.get('categories'):
-            restaurant_text += f"Categories: {restaurant.get('categories')}\n"
+            parts.append(f"Categories: {restaurant.get('categories')}\n")
         
         # Menu items
         if restaurant.get('items'):
-            restaurant_text += "Menu Items:\n"
+            parts.append("Menu Items:\n")
             for item in restaurant.get('items', []):
-                restaurant_text += f"- {item.get('name', 'Unknown')}\n"
-                restaurant_text += f"  Price: {item.get('price', 0)} VND"
+                parts.append(f"- {item.get('name', 'Unknown')}\n")
+                parts.append(f"  Price: {item.get('price', 0)} VND")
                 if item.get('old_price') and item.get('old_price') > item.get('price', 0):
-                    restaurant_text += f", Original Price: {item.get('old_price')} VND\n"
+                    parts.append(f", Original Price: {item.get('old_price')} VND\n")
                 else:
-                    restaurant_text += "\n"
+                    parts.append("\n")
                     
                 if item.get('category_name'):
-                    restaurant_text += f"  Category: {item.get('category_name')}\n"
+                    parts.append(f"  Category: {item.get('category_name')}\n")
                 
                 if item.get('description'):
-                    restaurant_text += f"  Description: {item.get('description')}\n"
+                    parts.append(f"  Description: {item.get('description')}\n")
                 
                 if item.get('is_recommended'):
-                    restaurant_text += f"  Recommended Item\n"
+                    parts.append(f"  Recommended Item\n")
                 
                 if item.get('is_popular'):
-                    restaurant_text += f"  Popular Item\n"
+                    parts.append(f"  Popular Item\n")
         
-        restaurant_texts.append(restaurant_text)
+        restaurant_texts.append("".join(parts))
     
     return restaurant_texts
 
@@ -152,9 +180,13 @@ def ingest_restaurant_data_to_qdrant():
         
         # Fetch restaurant data from MySQL
         logging.info("Fetching restaurant data from MySQL...")
-        restaurants_data = fetch_restaurant_data()
+        since = get_watermark(qdrant_manager.collection_name) if INCREMENTAL_INGEST else None
+        restaurants_data = fetch_restaurant_data(since)
         
         if not restaurants_data:
+            if since is not None:
+                logging.info(f"No restaurants updated since {since}")
+                return True
             logging.error("No restaurant data loaded! Check database connection and queries.")
             return False
         
@@ -164,7 +196,7 @@ def ingest_restaurant_data_to_qdrant():
         
         # Generate embeddings
         logging.info("Generating embeddings...")
-        restaurant_embeddings = embeddings_manager.create_embeddings(restaurant_texts)
+        restaurant_embeddings = get_or_compute(restaurant_texts, embeddings_manager.embed_in_batches)
         logging.info(f"Generated {len(restaurant_embeddings)} embeddings")
         
         # Ingest data into Qdrant
@@ -172,6 +204,15 @@ def ingest_restaurant_data_to_qdrant():
         success = qdrant_manager.ingest_data(restaurants_data, restaurant_embeddings)
         
         if success:
+            latest_update = max(
+                (record['updated_at']
+                 for restaurant in restaurants_data
+                 for record in [restaurant, *restaurant['items']]
+                 if record.get('updated_at')),
+                default=None
+            )
+            if latest_update is not None:
+                set_watermark(qdrant_manager.collection_name, str(latest_update))
             logging.info("Restaurant data ingestion completed successfully!")
             return True
         else:
@@ -8,17 +8,27 @@ Example cron entry (runs at 3 AM every day):
 """
 
 import os
+import json
+import hashlib
+import functools
 import logging
 import time
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import mysql.connector
+from mysql.connector.pooling import MySQLConnectionPool
 import numpy as np
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams
 
-from src.embeddings_manager import EmbeddingsManager
+from src.embeddings_manager import EMBEDDING_DIMENSIONS, EmbeddingsManager
+from src.embedding_cache import get_or_compute
+from src.ingest_pipeline import batched, run_pipeline
+from src.qdrant_connection import HNSW_CONFIG, QUANTIZATION_CONFIG, UPLOAD_BATCH_SIZE, compact_payload, deferred_indexing
 
 # Configure logging
 logging.basicConfig(
@@ -37,26 +47,63 @@ DB_CONFIG = {
     'password': os.getenv('MYSQL_DB_PASSWORD'),
     'database': os.getenv('MYSQL_DB_NAME', 'boship')  # Default database name
 }
+# Connections held at once: the streaming cursor and lookup connection of each collection
+# fetch, plus the concurrent hotel lookups
+DB_POOL_SIZE = int(os.getenv('MYSQL_REFRESH_POOL_SIZE', 8))
 
 # Qdrant configuration
 QDRANT_API_KEY = os.getenv('QDRANT_API_KEY')
 QDRANT_URL = "https://16f1329c-7600-4be6-8dc1-376daff8d555.us-west-1-0.aws.cloud.qdrant.io"
 QDRANT_PORT = 6333
-EMBEDDING_SIZE = 1536  # OpenAI Ada embedding size
+QDRANT_GRPC_PORT = 6334
+# Points go up over gRPC (protobuf vectors) unless QDRANT_PREFER_GRPC=false falls back to REST
+QDRANT_PREFER_GRPC = os.getenv('QDRANT_PREFER_GRPC', 'true').lower() == 'true'
+EMBEDDING_SIZE = EMBEDDING_DIMENSIONS
 
 # Collection names
 RESTAURANT_COLLECTION = "restaurant_collection"
 HOTEL_COLLECTION = "hotel_collection"
 ORDERS_COLLECTION = "orders_collection"
 
+# Payload fields filtered on by searches, indexed so filters don't scan every point
+PAYLOAD_INDEXES = {
+    RESTAURANT_COLLECTION: {
+        'name': models.PayloadSchemaType.KEYWORD,
+        'address': models.PayloadSchemaType.KEYWORD
+    },
+    HOTEL_COLLECTION: {
+        'name': models.PayloadSchemaType.KEYWORD,
+        'address': models.PayloadSchemaType.KEYWORD,
+        'latitude': models.PayloadSchemaType.FLOAT,
+        'longitude': models.PayloadSchemaType.FLOAT
+    }
+}
+
+# Ids per bulk lookup query
+ID_CHUNK_SIZE = 1000
+
+# Rows fetched per streamed batch, texts per embeddings request, and requests in flight at once
+FETCH_BATCH_SIZE = 256
+EMBED_BATCH_SIZE = 256
+EMBED_WORKERS = int(os.getenv('REFRESH_EMBED_WORKERS', 16))
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
 def get_db_connection():
     """
-    Establish a connection to the MySQL database
+    Get a connection to the MySQL database from the refresh connection pool
+    
+    Closing the connection returns it to the pool.
     """
+    global _db_pool
     try:
-        conn = mysql.connector.connect(**DB_CONFIG)
-        logging.info("Database connection established successfully")
-        return conn
+        if _db_pool is None:
+            with _db_pool_lock:
+                if _db_pool is None:
+                    _db_pool = MySQLConnectionPool(pool_name="qdrant_refresh", pool_size=DB_POOL_SIZE, **DB_CONFIG)
+                    logging.info("Database connection pool created successfully")
+        return _db_pool.get_connection()
     except mysql.connector.Error as err:
         logging.error(f"Database connection error: {err}")
         raise
@@ -79,6 +126,8 @@ def get_qdrant_client(max_retries=3, timeout=30.0):
                     api_key=QDRANT_API_KEY,
                     url=QDRANT_URL,
                     port=QDRANT_PORT,
+                    grpc_port=QDRANT_GRPC_PORT,
+                    prefer_grpc=QDRANT_PREFER_GRPC,
                     timeout=timeout
                 )
                 logging.info("Connected to Qdrant cloud service")
@@ -129,10 +178,8 @@ def create_collection(client, collection_name, max_retries=3):
                     size=EMBEDDING_SIZE,
                     distance=Distance.COSINE
                 ),
-                # Create payload indexes for faster filtering
-                optimizers_config=models.OptimizersConfigDiff(
-                    indexing_threshold=0  # Index all vectors
-                )
+                hnsw_config=HNSW_CONFIG,
+                quantization_config=QUANTIZATION_CONFIG
             )
             logging.info(f"Collection '{collection_name}' created successfully")
             return True
@@ -147,6 +194,46 @@ def create_collection(client, collection_name, max_retries=3):
     logging.error(f"Failed to create collection '{collection_name}' after {max_retries} attempts: {last_exception}")
     return False
 
+def ensure_collection(client, collection_name):
+    """
+    Create a collection in Qdrant unless it already exists
+    
+    Args:
+        client: Qdrant client instance
+        collection_name: Name of the collection
+    """
+    collection_names = [collection.name for collection in client.get_collections().collections]
+    if collection_name in collection_names:
+        logging.info(f"Collection '{collection_name}' already exists, updating it in place")
+    elif not create_collection(client, collection_name):
+        return False
+    
+    # Collections created before the payload indexes existed get them here as well
+    create_payload_indexes(client, collection_name)
+    return True
+
+def create_payload_indexes(client, collection_name):
+    """
+    Index the filtered payload fields of a collection
+    
+    Indexes are created before the points are uploaded, so Qdrant builds them along with
+    the vectors. Creating an index that already exists leaves it as it is.
+    
+    Args:
+        client: Qdrant client instance
+        collection_name: Name of the collection
+    """
+    for field_name, field_schema in PAYLOAD_INDEXES.get(collection_name, {}).items():
+        try:
+            client.create_payload_index(
+                collection_name=collection_name,
+                field_name=field_name,
+                field_schema=field_schema
+            )
+        except Exception as e:
+            logging.warning(f"Failed to create payload index on '{field_name}' in '{collection_name}': {e}")
+    logging.info(f"Payload indexes ready for '{collection_name}'")
+
 def delete_collection(client, collection_name, max_retries=3):
     """
     Delete a collection from Qdrant if it exists with retry logic
@@ -189,12 +276,62 @@ def delete_collection(client, collection_name, max_retries=3):
     logging.error(f"Failed to delete collection '{collection_name}' after {max_retries} attempts: {last_exception}")
     return False
 
-def fetch_restaurant_data():
+def fetch_rows_by_ids(cursor, query, column, ids):
+    """
+    Run a query for many ids at once and group the rows by id
+    
+    Args:
+        cursor: Dictionary cursor
+        query: Query with an IN ({placeholders}) condition on the ids
+        column: Column of the result holding the id
+        ids: Ids to look up
+        
+    Returns:
+        Dict mapping each id to the list of its rows
+    """
+    rows_by_id = defaultdict(list)
+    # Query in chunks so the statement stays well below max_allowed_packet
+    for i in range(0, len(ids), ID_CHUNK_SIZE):
+        chunk = ids[i:i + ID_CHUNK_SIZE]
+        cursor.execute(query.format(placeholders=", ".join(["%s"] * len(chunk))), chunk)
+        for row in cursor:
+            rows_by_id[row[column]].append(row)
+    return rows_by_id
+
+def fetch_hotel_rows(query, hotel_ids):
     """
-    Fetch restaurant data and related information from MySQL database
+    Run a bulk hotel lookup on its own database connection
+    
+    Args:
+        query: Query with an IN ({placeholders}) condition on hotel_id
+        hotel_ids: Ids of the hotels
+        
+    Returns:
+        Dict mapping each hotel id to the list of its rows
     """
     conn = get_db_connection()
     cursor = conn.cursor(dictionary=True)
+    try:
+        return fetch_rows_by_ids(cursor, query, 'hotel_id', hotel_ids)
+    finally:
+        cursor.close()
+        conn.close()
+
+def fetch_restaurant_data():
+    """
+    Stream active restaurants and their menu items from MySQL database
+    
+    Restaurants are read row by row from an unbuffered cursor and yielded in batches, with
+    the items of each batch looked up in one query on a second connection, so the tables are
+    never loaded into memory at once and embedding starts with the first batch.
+    
+    Yields:
+        Lists of restaurants, each with its 'items'
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor(dictionary=True, buffered=False)
+    lookup_conn = get_db_connection()
+    lookup_cursor = lookup_conn.cursor(dictionary=True)
     
     try:
         # Fetch restaurants
@@ -203,37 +340,44 @@ def fetch_restaurant_data():
             SELECT * FROM restaurants
             WHERE is_active = 1
         """)
-        restaurants = cursor.fetchall()
-        logging.info(f"Fetched {len(restaurants)} restaurants")
-        
-        # Process each restaurant to get menu items
-        for restaurant in restaurants:
-            restaurant_id = restaurant['id']
-            
-            # Fetch menu items for this restaurant
-            cursor.execute("""
+        count = 0
+        for restaurants in batched(cursor, FETCH_BATCH_SIZE):
+            # Fetch the menu items of the batch in one query
+            items = fetch_rows_by_ids(lookup_cursor, """
                 SELECT i.*, ic.name as category_name
                 FROM items i
                 LEFT JOIN item_category ic ON i.item_category_id = ic.id
-                WHERE i.restaurant_id = %s AND i.is_active = 1
-            """, (restaurant_id,))
-            restaurant['items'] = cursor.fetchall()
+                WHERE i.restaurant_id IN ({placeholders}) AND i.is_active = 1
+            """, 'restaurant_id', [restaurant['id'] for restaurant in restaurants])
             
-        return restaurants
+            for restaurant in restaurants:
+                restaurant['items'] = items.get(restaurant['id'], [])
+            
+            count += len(restaurants)
+            yield restaurants
+        logging.info(f"Fetched {count} restaurants")
         
     except mysql.connector.Error as err:
         logging.error(f"Error fetching restaurant data: {err}")
-        return []
+        raise
     finally:
+        lookup_cursor.close()
+        lookup_conn.close()
         cursor.close()
         conn.close()
 
 def fetch_hotel_data():
     """
-    Fetch hotel data and related information from MySQL database
+    Stream active hotels and their rooms, amenities and images from MySQL database
+    
+    Hotels are read row by row from an unbuffered cursor and yielded in batches, with the
+    related rows of each batch looked up in bulk.
+    
+    Yields:
+        Lists of hotels, each with its 'rooms', 'amenities' and 'images'
     """
     conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor(dictionary=True, buffered=False)
     
     try:
         # Fetch hotels
@@ -242,42 +386,44 @@ def fetch_hotel_data():
             SELECT * FROM hotels
             WHERE is_active = 1
         """)
-        hotels = cursor.fetchall()
-        logging.info(f"Fetched {len(hotels)} hotels")
-        
-        # Process each hotel to get rooms, amenities, and images
-        for hotel in hotels:
-            hotel_id = hotel['id']
-            
-            # Fetch rooms for this hotel
-            cursor.execute("""
-                SELECT * FROM hotel_rooms
-                WHERE hotel_id = %s AND is_active = 1
-            """, (hotel_id,))
-            hotel['rooms'] = cursor.fetchall()
-            
-            # Fetch amenities for this hotel
-            cursor.execute("""
-                SELECT ham.hotel_id, ham.amenities_id, ha.name, hag.name as group_name
-                FROM hotel_amenities_many ham
-                JOIN hotel_amenities ha ON ham.amenities_id = ha.id
-                LEFT JOIN hotel_amenities_group hag ON ha.group_id = hag.id
-                WHERE ham.hotel_id = %s
-            """, (hotel_id,))
-            hotel['amenities'] = cursor.fetchall()
-            
-            # Fetch images for this hotel
-            cursor.execute("""
-                SELECT * FROM hotel_images
-                WHERE hotel_id = %s
-            """, (hotel_id,))
-            hotel['images'] = cursor.fetchall()
-            
-        return hotels
+        count = 0
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            for hotels in batched(cursor, FETCH_BATCH_SIZE):
+                # Fetch the rooms, amenities and images of the batch in bulk, the three
+                # lookups at once on their own connections
+                hotel_ids = [hotel['id'] for hotel in hotels]
+                rooms_future = executor.submit(fetch_hotel_rows, """
+                    SELECT * FROM hotel_rooms
+                    WHERE hotel_id IN ({placeholders}) AND is_active = 1
+                """, hotel_ids)
+                # Amenities linked to a hotel more than once come back once
+                amenities_future = executor.submit(fetch_hotel_rows, """
+                    SELECT DISTINCT ham.hotel_id, ha.name, hag.name as group_name
+                    FROM hotel_amenities_many ham
+                    JOIN hotel_amenities ha ON ham.amenities_id = ha.id
+                    LEFT JOIN hotel_amenities_group hag ON ha.group_id = hag.id
+                    WHERE ham.hotel_id IN ({placeholders})
+                """, hotel_ids)
+                images_future = executor.submit(fetch_hotel_rows, """
+                    SELECT * FROM hotel_images
+                    WHERE hotel_id IN ({placeholders})
+                """, hotel_ids)
+                rooms = rooms_future.result()
+                amenities = amenities_future.result()
+                images = images_future.result()
+                
+                for hotel in hotels:
+                    hotel['rooms'] = rooms.get(hotel['id'], [])
+                    hotel['amenities'] = amenities.get(hotel['id'], [])
+                    hotel['images'] = images.get(hotel['id'], [])
+                
+                count += len(hotels)
+                yield hotels
+        logging.info(f"Fetched {count} hotels")
         
     except mysql.connector.Error as err:
         logging.error(f"Error fetching hotel data: {err}")
-        return []
+        raise
     finally:
         cursor.close()
         conn.close()
@@ -337,45 +483,45 @@ def create_restaurant_text_representations(restaurants):
     
     for restaurant in restaurants:
         # Basic restaurant info
-        restaurant_text = f"Restaurant ID: {restaurant.get('id')}\n"
-        restaurant_text += f"Name: {restaurant.get('name', 'Unknown')}\n"
-        restaurant_text += f"Address: {restaurant.get('address', 'Unknown')}\n"
-        restaurant_text += f"Location: Latitude {restaurant.get('latitude', 'Unknown')}, Longitude {restaurant.get('longitude', 'Unknown')}\n"
-        restaurant_text += f"Rating: {restaurant.get('rating', 0)}\n"
+        parts = [f"Restaurant ID: {restaurant.get('id')}\n"]
+        parts.append(f"Name: {restaurant.get('name', 'Unknown')}\n")
+        parts.append(f"Address: {restaurant.get('address', 'Unknown')}\n")
+        parts.append(f"Location: Latitude {restaurant.get('latitude', 'Unknown')}, Longitude {restaurant.get('longitude', 'Unknown')}\n")
+        parts.append(f"Rating: {restaurant.get('rating', 0)}\n")
         
         if restaurant.get('address_description'):
-            restaurant_text += f"Address Description: {restaurant.get('address_description')}\n"
+            parts.append(f"Address Description: {restaurant.get('address_description')}\n")
         
         if restaurant.get('phone'):
-            restaurant_text += f"Phone: {restaurant.get('phone')}\n"
+            parts.append(f"Phone: {restaurant.get('phone')}\n")
         
         if restaurant.get('categories'):
-            restaurant_text += f"Categories: {restaurant.get('categories')}\n"
+            parts.append(f"Categories: {restaurant.get('categories')}\n")
         
         # Menu items
         if restaurant.get('items'):
-            restaurant_text += "Menu Items:\n"
+            parts.append("Menu Items:\n")
             for item in restaurant.get('items', []):
-                restaurant_text += f"- {item.get('name', 'Unknown')}\n"
-                restaurant_text += f"  Price: {item.get('price', 0)} VND"
+                parts.append(f"- {item.get('name', 'Unknown')}\n")
+                parts.append(f"  Price: {item.get('price', 0)} VND")
                 if item.get('old_price') and item.get('old_price') > item.get('price', 0):
-                    restaurant_text += f", Original Price: {item.get('old_price')} VND\n"
+                    parts.append(f", Original Price: {item.get('old_price')} VND\n")
                 else:
-                    restaurant_text += "\n"
+                    parts.append("\n")
                     
                 if item.get('category_name'):
-                    restaurant_text += f"  Category: {item.get('category_name')}\n"
+                    parts.append(f"  Category: {item.get('category_name')}\n")
                 
                 if item.get('description'):
-                    restaurant_text += f"  Description: {item.get('description')}\n"
+                    parts.append(f"  Description: {item.get('description')}\n")
                 
                 if item.get('is_recommended'):
-                    restaurant_text += f"  Recommended Item\n"
+                    parts.append(f"  Recommended Item\n")
                 
                 if item.get('is_popular'):
-                    restaurant_text += f"  Popular Item\n"
+                    parts.append(f"  Popular Item\n")
         
-        restaurant_texts.append(restaurant_text)
+        restaurant_texts.append("".join(parts))
     
     return restaurant_texts
 
@@ -387,45 +533,43 @@ def create_hotel_text_representations(hotels):
     
     for hotel in hotels:
         # Basic hotel info
-        hotel_text = f"Hotel ID: {hotel.get('id')}\n"
-        hotel_text += f"Name: {hotel.get('name', 'Unknown')}\n"
-        hotel_text += f"Address: {hotel.get('address', 'Unknown')}\n"
-        hotel_text += f"Location: Latitude {hotel.get('latitude', 'Unknown')}, Longitude {hotel.get('longitude', 'Unknown')}\n"
-        hotel_text += f"Rating: {hotel.get('rating', 0)}\n"
+        parts = [f"Hotel ID: {hotel.get('id')}\n"]
+        parts.append(f"Name: {hotel.get('name', 'Unknown')}\n")
+        parts.append(f"Address: {hotel.get('address', 'Unknown')}\n")
+        parts.append(f"Location: Latitude {hotel.get('latitude', 'Unknown')}, Longitude {hotel.get('longitude', 'Unknown')}\n")
+        parts.append(f"Rating: {hotel.get('rating', 0)}\n")
         
         if hotel.get('description'):
-            hotel_text += f"Description: {hotel.get('description')}\n"
+            parts.append(f"Description: {hotel.get('description')}\n")
         
         if hotel.get('phone'):
-            hotel_text += f"Phone: {hotel.get('phone')}\n"
+            parts.append(f"Phone: {hotel.get('phone')}\n")
         
         # Amenities
         if hotel.get('amenities'):
-            hotel_text += "Amenities:\n"
-            amenities_seen = set()
+            parts.append("Amenities:\n")
             for amenity in hotel.get('amenities', []):
                 amenity_name = amenity.get('name', '')
-                if amenity_name and amenity_name not in amenities_seen:
-                    amenities_seen.add(amenity_name)
-                    hotel_text += f"- {amenity_name}\n"
+                if amenity_name:
+                    parts.append(f"- {amenity_name}\n")
         
         # Rooms
         if hotel.get('rooms'):
-            hotel_text += "Rooms:\n"
+            parts.append("Rooms:\n")
             for room in hotel.get('rooms', []):
-                hotel_text += f"- {room.get('name', 'Unknown')}\n"
-                hotel_text += f"  Price: {room.get('price', 0)} VND\n"
+                parts.append(f"- {room.get('name', 'Unknown')}\n")
+                parts.append(f"  Price: {room.get('price', 0)} VND\n")
                 
                 if room.get('description'):
-                    hotel_text += f"  Description: {room.get('description')}\n"
+                    parts.append(f"  Description: {room.get('description')}\n")
                 
                 if room.get('max_adults'):
-                    hotel_text += f"  Max Adults: {room.get('max_adults')}\n"
+                    parts.append(f"  Max Adults: {room.get('max_adults')}\n")
                 
                 if room.get('max_children'):
-                    hotel_text += f"  Max Children: {room.get('max_children')}\n"
+                    parts.append(f"  Max Children: {room.get('max_children')}\n")
         
-        hotel_texts.append(hotel_text)
+        hotel_texts.append("".join(parts))
     
     return hotel_texts
 
@@ -437,162 +581,264 @@ def create_orders_text_representations(orders):
     
     for order in orders:
         # Basic order info
-        order_text = f"Order ID: {order.get('id')}\n"
-        order_text += f"User ID: {order.get('user_id', 'Unknown')}\n"
+        parts = [f"Order ID: {order.get('id')}\n"]
+        parts.append(f"User ID: {order.get('user_id', 'Unknown')}\n")
         if order.get('user_name'):
-            order_text += f"User Name: {order.get('user_name')}\n"
+            parts.append(f"User Name: {order.get('user_name')}\n")
         if order.get('user_phone'):
-            order_text += f"User Phone: {order.get('user_phone')}\n"
+            parts.append(f"User Phone: {order.get('user_phone')}\n")
         if order.get('user_email'):
-            order_text += f"User Email: {order.get('user_email')}\n"
+            parts.append(f"User Email: {order.get('user_email')}\n")
             
-        order_text += f"Service Type: {order.get('service_type', 'Unknown')}\n"
-        order_text += f"Status: {order.get('status', 'Unknown')}\n"
-        order_text += f"Total Amount: {order.get('total_amount', 0)} VND\n"
-        order_text += f"Payment Method: {order.get('payment_method', 'Unknown')}\n"
+        parts.append(f"Service Type: {order.get('service_type', 'Unknown')}\n")
+        parts.append(f"Status: {order.get('status', 'Unknown')}\n")
+        parts.append(f"Total Amount: {order.get('total_amount', 0)} VND\n")
+        parts.append(f"Payment Method: {order.get('payment_method', 'Unknown')}\n")
         
         if order.get('created_at'):
-            order_text += f"Created At: {order.get('created_at')}\n"
+            parts.append(f"Created At: {order.get('created_at')}\n")
         
         if order.get('address'):
-            order_text += f"Address: {order.get('address')}\n"
+            parts.append(f"Address: {order.get('address')}\n")
         
         if order.get('note'):
-            order_text += f"Note: {order.get('note')}\n"
+            parts.append(f"Note: {order.get('note')}\n")
         
         # Order details
         if order.get('details'):
-            order_text += "Order Details:\n"
+            parts.append("Order Details:\n")
             for detail in order.get('details', []):
                 if detail.get('item_name'):
-                    order_text += f"- {detail.get('item_name')}\n"
-                    order_text += f"  Quantity: {detail.get('quantity', 1)}\n"
-                    order_text += f"  Price: {detail.get('price', 0)} VND\n"
+                    parts.append(f"- {detail.get('item_name')}\n")
+                    parts.append(f"  Quantity: {detail.get('quantity', 1)}\n")
+                    parts.append(f"  Price: {detail.get('price', 0)} VND\n")
                     
                 if detail.get('service_name'):
-                    order_text += f"  Service: {detail.get('service_name')}\n"
+                    parts.append(f"  Service: {detail.get('service_name')}\n")
                 
                 if detail.get('note'):
-                    order_text += f"  Note: {detail.get('note')}\n"
+                    parts.append(f"  Note: {detail.get('note')}\n")
         
-        order_texts.append(order_text)
+        order_texts.append("".join(parts))
     
     return order_texts
 
-def ingest_data_to_qdrant(client, collection_name, data, embeddings):
+def build_point(collection_name, item, index):
     """
-    Ingest data and embeddings into Qdrant
+    Build the point id and payload of an item
+    
+    Args:
+        collection_name: Collection the item belongs to, which decides the payload fields
+        item: Restaurant, hotel or order record
+        index: Position of the item, used as id when the item has no integer id
+        
+    Returns:
+        Tuple of (point id, payload)
     """
+    # Create a unique ID for each item
+    item_id = item.get('id', str(index))
+    
+    # Create point with valid ID (ensure it's an integer)
     try:
-        logging.info(f"Ingesting {len(data)} items into '{collection_name}'")
-        
-        # Prepare points for batch upload
-        points = []
-        for i, (item, embedding) in enumerate(zip(data, embeddings)):
-            # Create a unique ID for each item
-            item_id = item.get('id', str(i))
-            
-            # Create point with valid ID (ensure it's an integer)
-            try:
-                point_id = int(item_id)
-            except (ValueError, TypeError):
-                point_id = i
-            
-            # Create payload based on collection type
-            if collection_name == RESTAURANT_COLLECTION:
-                # Extract menu items for payload
-                menu_items = []
-                items = item.get('items', [])
-                if items is not None:
-                    for menu_item in items:
-                        if menu_item is not None:
-                            menu_items.append({
-                                'name': menu_item.get('name', ''),
-                                'price': menu_item.get('price', 0)
-                            })
-                
-                payload = {
-                    'id': item_id,
-                    'name': item.get('name', ''),
-                    'address': item.get('address', ''),
-                    'items': menu_items
-                }
-            elif collection_name == HOTEL_COLLECTION:
-                # Extract rooms for payload
-                rooms = []
-                for room in item.get('rooms', []):
-                    if room is not None:
-                        rooms.append({
-                            'name': room.get('name', ''),
-                            'price': room.get('price', 0),
-                            'description': room.get('description', '')
-                        })
-                
-                # Extract amenities for payload
-                amenities = []
-                for amenity in item.get('amenities', []):
-                    if amenity is not None:
-                        amenities.append({
-                            'name': amenity.get('name', ''),
-                            'group': amenity.get('group_name', '')
-                        })
-                
-                payload = {
-                    'id': item_id,
-                    'name': item.get('name', ''),
-                    'address': item.get('address', ''),
-                    'latitude': item.get('latitude'),
-                    'longitude': item.get('longitude'),
-                    'rooms': rooms,
-                    'amenities': amenities
-                }
-            else:  # ORDERS_COLLECTION
-                # Extract order details for payload
-                details = []
-                for detail in item.get('details', []):
-                    if detail is not None:
-                        details.append({
-                            'item_name': detail.get('item_name', ''),
-                            'service_name': detail.get('service_name', ''),
-                            'quantity': detail.get('quantity', 1),
-                            'price': detail.get('price', 0)
-                        })
-                
-                payload = {
-                    'id': item_id,
-                    'user_id': item.get('user_id', ''),
-                    'user_name': item.get('user_name', ''),
-                    'service_type': item.get('service_type', ''),
-                    'status': item.get('status', ''),
-                    'total_amount': item.get('total_amount', 0),
-                    'payment_method': item.get('payment_method', ''),
-                    'created_at': str(item.get('created_at', '')),
-                    'details': details
-                }
-            
-            # Create point structure
-            point = models.PointStruct(
-                id=point_id,
-                vector=embedding.tolist(),
-                payload=payload
-            )
-            points.append(point)
-            
-            # Upload in batches of 100 to avoid memory issues
-            if len(points) >= 100 or i == len(data) - 1:
-                client.upsert(
-                    collection_name=collection_name,
-                    points=points
-                )
-                logging.info(f"Uploaded batch of {len(points)} items to '{collection_name}'")
-                points = []
+        point_id = int(item_id)
+    except (ValueError, TypeError):
+        point_id = index
+    
+    # Create payload based on collection type
+    if collection_name == RESTAURANT_COLLECTION:
+        payload = {
+            'id': item_id,
+            'name': item.get('name', ''),
+            'address': item.get('address', ''),
+            # Menu items for payload
+            'items': [
+                {'name': menu_item.get('name', ''), 'price': menu_item.get('price', 0)}
+                for menu_item in item.get('items') or [] if menu_item is not None
+            ]
+        }
+    elif collection_name == HOTEL_COLLECTION:
+        payload = {
+            'id': item_id,
+            'name': item.get('name', ''),
+            'address': item.get('address', ''),
+            'latitude': item.get('latitude'),
+            'longitude': item.get('longitude'),
+            # Rooms and amenities for payload
+            'rooms': [
+                {'name': room.get('name', ''), 'price': room.get('price', 0), 'description': room.get('description', '')}
+                for room in item.get('rooms', []) if room is not None
+            ],
+            'amenities': [
+                {'name': amenity.get('name', ''), 'group': amenity.get('group_name', '')}
+                for amenity in item.get('amenities', []) if amenity is not None
+            ]
+        }
+    else:  # ORDERS_COLLECTION
+        # Order details for payload
+        details = [
+            {
+                'item_name': detail.get('item_name', ''),
+                'service_name': detail.get('service_name', ''),
+                'quantity': detail.get('quantity', 1),
+                'price': detail.get('price', 0)
+            }
+            for detail in item.get('details', []) if detail is not None
+        ]
+        
+        payload = {
+            'id': item_id,
+            'user_id': item.get('user_id', ''),
+            'user_name': item.get('user_name', ''),
+            'service_type': item.get('service_type', ''),
+            'status': item.get('status', ''),
+            'total_amount': item.get('total_amount', 0),
+            'payment_method': item.get('payment_method', ''),
+            'created_at': str(item.get('created_at', '')),
+            'details': details
+        }
+    
+    # Decimal prices and coordinates become floats, which the gRPC payload encoding supports
+    return point_id, compact_payload(payload)
+
+def content_hash(text, payload):
+    """
+    Hash the embedded text and payload of an item, so unchanged items can be skipped on refresh
+    """
+    content = text + json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+def fetch_content_hashes(client, collection_name):
+    """
+    Get the content hash stored with each point of a collection
+    
+    Args:
+        client: Qdrant client instance
+        collection_name: Name of the collection
         
-        logging.info(f"Data ingestion completed successfully for '{collection_name}'")
+    Returns:
+        Dict mapping each point id to its content hash (None for points stored without one)
+    """
+    hashes = {}
+    offset = None
+    while True:
+        points, offset = client.scroll(
+            collection_name=collection_name,
+            limit=1000,
+            offset=offset,
+            with_payload=['content_hash'],
+            with_vectors=False
+        )
+        for point in points:
+            hashes[point.id] = (point.payload or {}).get('content_hash')
+        if offset is None:
+            return hashes
+
+def ingest_data_to_qdrant(client, collection_name, ids, payloads, embeddings):
+    """
+    Ingest points and embeddings into Qdrant
+    
+    Indexing of the collection is expected to be deferred by the caller for the whole refresh.
+    """
+    try:
+        logging.info(f"Ingesting {len(ids)} items into '{collection_name}'")
+        
+        # A pipeline batch is a single upload request, sent from the calling thread: worker
+        # processes (parallel > 1) would be started again for every batch. Batches overlap
+        # with each other's embedding in the pipeline instead.
+        # The embeddings go up as one float32 matrix, without converting each to a list
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        client.upload_collection(
+            collection_name=collection_name,
+            vectors=vectors,
+            payload=payloads,
+            ids=ids,
+            batch_size=UPLOAD_BATCH_SIZE,
+            parallel=1
+        )
+        logging.info(f"Uploaded {len(ids)} items to '{collection_name}'")
         return True
     except Exception as e:
         logging.error(f"Error ingesting data into '{collection_name}': {e}")
         return False
 
+def sync_collection(client, collection_name, record_batches, create_texts, embeddings_manager):
+    """
+    Bring a collection up to date with freshly fetched data
+    
+    Only items whose text or payload changed since the last refresh are embedded and
+    uploaded, and points of items that no longer exist are deleted. The collection is
+    never dropped, so it stays searchable during the refresh.
+    
+    The batches are fetched, embedded and uploaded as a pipeline, so reading MySQL overlaps
+    with the embeddings requests and the uploads. Stale points are only deleted once every
+    batch was fetched and uploaded.
+    
+    Args:
+        client: Qdrant client instance
+        collection_name: Name of the collection
+        record_batches: Iterable of lists of fetched records
+        create_texts: Function creating the text representations of a list of records
+        embeddings_manager: Embeddings manager for the changed texts
+        
+    Returns:
+        True if the collection was updated successfully, False otherwise
+    """
+    existing_hashes = fetch_content_hashes(client, collection_name)
+    ids = set()
+    
+    def changed_batches():
+        index = 0
+        for records in record_batches:
+            texts = create_texts(records)
+            changed_texts = []
+            changed_ids = []
+            changed_payloads = []
+            for item, text in zip(records, texts):
+                point_id, payload = build_point(collection_name, item, index)
+                index += 1
+                payload['content_hash'] = content_hash(text, payload)
+                ids.add(point_id)
+                if existing_hashes.get(point_id) != payload['content_hash']:
+                    changed_texts.append(text)
+                    changed_ids.append(point_id)
+                    changed_payloads.append(payload)
+            yield changed_texts, (changed_ids, changed_payloads)
+    
+    # Texts go out in batches from concurrent requests, and texts embedded before
+    # (by a refresh or an ingest) come from the embedding cache
+    embedder = functools.partial(embeddings_manager.embed_in_batches, batch_size=EMBED_BATCH_SIZE, workers=1)
+    
+    def embed(texts):
+        return get_or_compute(texts, embedder)
+    
+    def upload(embeddings, batch):
+        changed_ids, changed_payloads = batch
+        if not ingest_data_to_qdrant(client, collection_name, changed_ids, changed_payloads, embeddings):
+            raise RuntimeError(f"Failed to upload items to '{collection_name}'")
+    
+    try:
+        # Indexing is switched off until all batches are uploaded, so the HNSW graph is built once
+        with deferred_indexing(client, collection_name):
+            changed = run_pipeline(
+                changed_batches(), embed, upload, workers=EMBED_WORKERS, max_pending=EMBED_WORKERS * 2
+            )
+    except Exception as e:
+        logging.error(f"Error refreshing '{collection_name}': {e}")
+        return False
+    
+    if not ids:
+        logging.error(f"No data fetched for '{collection_name}', aborting refresh")
+        return False
+    logging.info(f"{changed} of {len(ids)} items changed in '{collection_name}'")
+    
+    stale_ids = list(set(existing_hashes) - ids)
+    if stale_ids:
+        client.delete(collection_name=collection_name, points_selector=models.PointIdsList(points=stale_ids))
+        logging.info(f"Deleted {len(stale_ids)} stale items from '{collection_name}'")
+    
+    return True
+
+
 def refresh_restaurant_collection():
     """
     Refresh the restaurant collection in Qdrant
@@ -603,24 +849,11 @@ def refresh_restaurant_collection():
         # Initialize Qdrant client
         client = get_qdrant_client()
         
-        # Delete existing collection
-        if not delete_collection(client, RESTAURANT_COLLECTION):
-            logging.warning("Failed to delete restaurant collection, but will try to continue")
-        
-        # Create new collection
-        if not create_collection(client, RESTAURANT_COLLECTION):
+        # Create the collection if it doesn't exist yet, existing points are updated in place
+        if not ensure_collection(client, RESTAURANT_COLLECTION):
             logging.error("Failed to create restaurant collection, aborting refresh")
             return False
         
-        # Fetch restaurant data
-        restaurants = fetch_restaurant_data()
-        if not restaurants:
-            logging.error("No restaurant data fetched, aborting refresh")
-            return False
-        
-        # Create text representations
-        restaurant_texts = create_restaurant_text_representations(restaurants)
-        
         # Initialize embeddings manager
         openai_api_key = os.getenv('OPENAI_API_KEY')
         if not openai_api_key:
@@ -629,13 +862,11 @@ def refresh_restaurant_collection():
         
         embeddings_manager = EmbeddingsManager(openai_api_key)
         
-        # Generate embeddings
-        logging.info("Generating embeddings for restaurants...")
-        restaurant_embeddings = embeddings_manager.create_embeddings(restaurant_texts)
-        logging.info(f"Generated {len(restaurant_embeddings)} restaurant embeddings")
-        
-        # Ingest data into Qdrant
-        success = ingest_data_to_qdrant(client, RESTAURANT_COLLECTION, restaurants, restaurant_embeddings)
+        # Stream the restaurants from MySQL, and embed and ingest the changed ones into Qdrant
+        success = sync_collection(
+            client, RESTAURANT_COLLECTION, fetch_restaurant_data(),
+            create_restaurant_text_representations, embeddings_manager
+        )
         
         return success
     except Exception as e:
@@ -651,20 +882,8 @@ def refresh_hotel_collection():
     # Initialize Qdrant client
     client = get_qdrant_client()
     
-    # Delete existing collection
-    delete_collection(client, HOTEL_COLLECTION)
-    
-    # Create new collection
-    create_collection(client, HOTEL_COLLECTION)
-    
-    # Fetch hotel data
-    hotels = fetch_hotel_data()
-    if not hotels:
-        logging.error("No hotel data fetched, aborting refresh")
-        return False
-    
-    # Create text representations
-    hotel_texts = create_hotel_text_representations(hotels)
+    # Create the collection if it doesn't exist yet, existing points are updated in place
+    ensure_collection(client, HOTEL_COLLECTION)
     
     # Initialize embeddings manager
     openai_api_key = os.getenv('OPENAI_API_KEY')
@@ -674,13 +893,11 @@ def refresh_hotel_collection():
     
     embeddings_manager = EmbeddingsManager(openai_api_key)
     
-    # Generate embeddings
-    logging.info("Generating embeddings for hotels...")
-    hotel_embeddings = embeddings_manager.create_embeddings(hotel_texts)
-    logging.info(f"Generated {len(hotel_embeddings)} hotel embeddings")
-    
-    # Ingest data into Qdrant
-    success = ingest_data_to_qdrant(client, HOTEL_COLLECTION, hotels, hotel_embeddings)
+    # Stream the hotels from MySQL, and embed and ingest the changed ones into Qdrant
+    success = sync_collection(
+        client, HOTEL_COLLECTION, fetch_hotel_data(),
+        create_hotel_text_representations, embeddings_manager
+    )
     
     return success
 
@@ -693,11 +910,8 @@ def refresh_orders_collection():
     # Initialize Qdrant client
     client = get_qdrant_client()
     
-    # Delete existing collection
-    delete_collection(client, ORDERS_COLLECTION)
-    
-    # Create new collection
-    create_collection(client, ORDERS_COLLECTION)
+    # Create the collection if it doesn't exist yet, existing points are updated in place
+    ensure_collection(client, ORDERS_COLLECTION)
     
     # Fetch orders data
     orders = fetch_orders_data()
@@ -705,9 +919,6 @@ def refresh_orders_collection():
         logging.error("No orders data fetched, aborting refresh")
         return False
     
-    # Create text representations
-    order_texts = create_orders_text_representations(orders)
-    
     # Initialize embeddings manager
     openai_api_key = os.getenv('OPENAI_API_KEY')
     if not openai_api_key:
@@ -716,19 +927,12 @@ def refresh_orders_collection():
     
     embeddings_manager = EmbeddingsManager(openai_api_key)
     
-    # Generate embeddings
-    logging.info("Generating embeddings for orders...")
-    embeddings = []
-    batch_size = 10  # Process in smaller batches to avoid timeouts
-    
-    for i in range(0, len(order_texts), batch_size):
-        batch_texts = order_texts[i:i+batch_size]
-        batch_embeddings = embeddings_manager.create_embeddings(batch_texts)
-        embeddings.extend(batch_embeddings)
-        logging.info(f"Generated embeddings for batch {i//batch_size + 1}/{(len(order_texts) + batch_size - 1)//batch_size}")
-    
-    # Ingest data to Qdrant
-    success = ingest_data_to_qdrant(client, ORDERS_COLLECTION, orders, embeddings)
+    # Embed and ingest the changed orders into Qdrant. Orders no longer among the
+    # fetched ones are removed, as when the collection was rebuilt.
+    success = sync_collection(
+        client, ORDERS_COLLECTION, batched(orders, FETCH_BATCH_SIZE),
+        create_orders_text_representations, embeddings_manager
+    )
     
     if success:
         logging.info("Orders collection refreshed successfully")
@@ -744,22 +948,26 @@ def main():
     start_time = time.time()
     logging.info(f"Starting Qdrant collections refresh at {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
-    # Refresh restaurant collection
-    restaurant_success = refresh_restaurant_collection()
+    # Refresh the collections concurrently, they are independent and each one mostly
+    # waits on MySQL, OpenAI and Qdrant
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        restaurant_future = executor.submit(refresh_restaurant_collection)
+        hotel_future = executor.submit(refresh_hotel_collection)
+        orders_future = executor.submit(refresh_orders_collection)
+        restaurant_success = restaurant_future.result()
+        hotel_success = hotel_future.result()
+        orders_success = orders_future.result()
+    
     if restaurant_success:
         logging.info("Restaurant collection refresh completed successfully")
     else:
         logging.error("Restaurant collection refresh failed")
     
-    # Refresh hotel collection
-    hotel_success = refresh_hotel_collection()
     if hotel_success:
         logging.info("Hotel collection refresh completed successfully")
     else:
         logging.error("Hotel collection refresh failed")
     
-    # Refresh orders collection
-    orders_success = refresh_orders_collection()
     if orders_success:
         logging.info("Orders collection refresh completed successfully")
     else:
@@ -20,4 +20,4 @@ python -m src.scheduler &
 
 # Start the FastAPI server
 echo "Starting FastAPI server..."
-exec uvicorn api:app --host 0.0.0.0 --port $PORT
+exec gunicorn api:app -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:$PORT --workers ${WEB_CONCURRENCY:-$(nproc)} --timeout 120
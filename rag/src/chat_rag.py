@@ -11,6 +11,9 @@ from qdrant_client.http.models import Distance, VectorParams, PointStruct
 import openai
 from dotenv import load_dotenv
 
+from .qdrant_connection import HNSW_CONFIG, QUANTIZATION_CONFIG, SEARCH_PARAMS
+from .embeddings_manager import EMBEDDING_DIMENSIONS, EMBEDDING_PARAMS
+
 # Load environment variables
 load_dotenv()
 
@@ -55,7 +58,7 @@ class ChatRAG:
         Create the chat history collection in Qdrant if it doesn't exist
         """
         collection_name = "chat_history"
-        vector_size = 1536  # OpenAI embeddings dimension
+        vector_size = EMBEDDING_DIMENSIONS  # OpenAI embeddings dimension
         
         try:
             collections = self.qdrant_client.get_collections().collections
@@ -65,6 +68,8 @@ class ChatRAG:
                 self.qdrant_client.create_collection(
                     collection_name=collection_name,
                     vectors_config=VectorParams(size=vector_size, distance=Distance.COSINE),
+                    hnsw_config=HNSW_CONFIG,
+                    quantization_config=QUANTIZATION_CONFIG
                 )
                 logging.info(f"Created collection '{collection_name}' in Qdrant")
                 
@@ -107,21 +112,22 @@ class ChatRAG:
         try:
             response = openai.Embedding.create(
                 input=text,
-                model="text-embedding-ada-002"
+                **EMBEDDING_PARAMS
             )
             embedding = response['data'][0]['embedding']
             return embedding
         except Exception as e:
             logging.error(f"Error getting embedding: {str(e)}")
             # Return a zero vector as fallback
-            return [0.0] * 1536
+            return [0.0] * EMBEDDING_DIMENSIONS
     
     def store_chat_interaction(self, 
                               user_id: str, 
                               question: str, 
                               answer: str, 
                               context_type: str,
-                              session_id: Optional[str] = None) -> bool:
+                              session_id: Optional[str] = None,
+                              question_embedding: Optional[List[float]] = None) -> bool:
         """
         Store a chat interaction in Qdrant
         
@@ -131,6 +137,7 @@ class ChatRAG:
             answer: System's answer
             context_type: Type of context (restaurant, hotel, delivery, etc.)
             session_id: Optional session identifier
+            question_embedding: Precomputed embedding of the question, created if not given
             
         Returns:
             Boolean indicating success or failure
@@ -145,7 +152,8 @@ class ChatRAG:
                 session_id = str(uuid.uuid4())
             
             # Get embedding for the question
-            question_embedding = self._get_embedding(question)
+            if question_embedding is None:
+                question_embedding = self._get_embedding(question)
             
             # Create timestamp
             timestamp = datetime.datetime.now().isoformat()
@@ -172,7 +180,7 @@ class ChatRAG:
                 ]
             )
             
-            logging.info(f"Stored chat interaction for user {user_id} with ID {point_id}")
+            logging.debug("Stored chat interaction for user %s with ID %s", user_id, point_id)
             return True
             
         except Exception as e:
@@ -182,7 +190,8 @@ class ChatRAG:
     def search_similar_questions(self, 
                                 question: str, 
                                 limit: int = 5, 
-                                user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+                                user_id: Optional[str] = None,
+                                question_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
         """
         Search for similar questions in the chat history
         
@@ -190,6 +199,7 @@ class ChatRAG:
             question: The question to search for
             limit: Maximum number of results to return
             user_id: Optional user ID to filter by
+            question_embedding: Precomputed embedding of the question, created if not given
             
         Returns:
             List of dictionaries containing similar questions and their answers
@@ -200,13 +210,15 @@ class ChatRAG:
         
         try:
             # Get embedding for the question
-            question_embedding = self._get_embedding(question)
+            if question_embedding is None:
+                question_embedding = self._get_embedding(question)
             
             # Prepare search filters
             search_params = {
                 "collection_name": "chat_history",
                 "query_vector": question_embedding,
-                "limit": limit
+                "limit": limit,
+                "search_params": SEARCH_PARAMS
             }
             
             # Add user filter if provided
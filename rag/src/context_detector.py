@@ -1,8 +1,57 @@
 import os
+import re
+import json
 import logging
 import openai
 from typing import Dict, List, Any, Optional
 
+# Unambiguous keywords that identify a context without asking the LLM
+RESTAURANT_KEYWORDS = re.compile(
+    r"\b(nhà hàng|quán ăn|món ăn|đồ ăn|thực đơn|menu|restaurant|food|dish)\b", re.IGNORECASE
+)
+ACCOMMODATION_KEYWORDS = re.compile(
+    r"\b(khách sạn|nhà nghỉ|homestay|resort|đặt phòng|phòng nghỉ|hotel|accommodation)\b", re.IGNORECASE
+)
+# Order history, delivery and transport questions mention food or rooms too ("giao đồ ăn"),
+# leave them to the LLM
+AMBIGUOUS_KEYWORDS = re.compile(
+    r"\b(đơn hàng|lịch sử|đã đặt|order|giao|ship|shipper|vận chuyển|tài xế|delivery|driver)\b", re.IGNORECASE
+)
+
+# Pattern to match markdown code blocks around the LLM's JSON: ```json ... ```
+JSON_CODE_BLOCK = re.compile(r'```(?:json)?\s*(.+?)\s*```', re.DOTALL)
+
+# Prompt for context detection
+CONTEXT_DETECTION_PROMPT = """
+            Bạn là nhân viên tư vấn Bé Bơ, phụ trách phân loại câu hỏi của người dùng. Nhiệm vụ của bạn là xác định câu hỏi thuộc danh mục dịch vụ nào.
+            Phân tích câu hỏi và xác định nó thuộc vào một trong các ngữ cảnh sau:
+            
+            1. restaurant - Câu hỏi về đồ ăn, ăn uống, nhà hàng, thực đơn, món ăn, ẩm thực, v.v.
+            2. accommodation - Câu hỏi về khách sạn, phòng ở, lưu trú, tiện nghi, v.v.
+            3. delivery - Câu hỏi về dịch vụ giao hàng, vận chuyển hàng hóa, đơn hàng, theo dõi giao hàng, v.v.
+            4. transportation - Câu hỏi về di chuyển, đi lại, tài xế, phương tiện, v.v.
+            5. tourism - Câu hỏi về điểm tham quan, thắng cảnh, tour du lịch, v.v.
+            6. order - Câu hỏi về lịch sử đặt hàng, đơn hàng đã đặt, dịch vụ đã sử dụng, v.v.
+            7. general - Câu hỏi chung không thuộc các danh mục trên
+            
+            Trả lời của bạn phải là một đối tượng JSON với cấu trúc sau:
+            {
+                "primary_context": "[Danh mục chính - phải là một trong các giá trị: restaurant, accommodation, delivery, transportation, tourism, order, general]",
+                "confidence": [Một số từ 0 đến 1 chỉ mức độ tin cậy],
+                "all_contexts": {
+                    "restaurant": [Điểm từ 0 đến 1],
+                    "accommodation": [Điểm từ 0 đến 1],
+                    "delivery": [Điểm từ 0 đến 1],
+                    "transportation": [Điểm từ 0 đến 1],
+                    "tourism": [Điểm từ 0 đến 1],
+                    "order": [Điểm từ 0 đến 1],
+                    "general": [Điểm từ 0 đến 1]
+                }
+            }
+            
+            Tổng của tất cả điểm số nên xấp xỉ bằng 1.0.
+            """
+
 class ContextDetector:
     """
     A class to detect the context of user queries using OpenAI.
@@ -24,6 +73,41 @@ class ContextDetector:
             openai.api_key = self.api_key
             logging.info("OpenAI API key set successfully for context detection")
     
+    def detect_context_fast(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Detect the context from keywords when the query is unambiguous.
+        
+        Args:
+            query: The user's query text
+            
+        Returns:
+            The same dictionary as detect_context, or None when the LLM is needed
+        """
+        if AMBIGUOUS_KEYWORDS.search(query):
+            return None
+        
+        is_restaurant = RESTAURANT_KEYWORDS.search(query) is not None
+        is_accommodation = ACCOMMODATION_KEYWORDS.search(query) is not None
+        if is_restaurant == is_accommodation:
+            return None
+        
+        primary_context = "restaurant" if is_restaurant else "accommodation"
+        all_contexts = {
+            "restaurant": 0.0,
+            "accommodation": 0.0,
+            "delivery": 0.0,
+            "transportation": 0.0,
+            "tourism": 0.0,
+            "order": 0.0,
+            "general": 0.0
+        }
+        all_contexts[primary_context] = 0.95
+        return {
+            "primary_context": primary_context,
+            "confidence": 0.95,
+            "all_contexts": all_contexts
+        }
+    
     def detect_context(self, query: str) -> Dict[str, Any]:
         """
         Detect the context of a user query to identify which service they are referring to.
@@ -38,44 +122,13 @@ class ContextDetector:
                 - all_contexts: Dictionary of all possible contexts with their scores
         """
         try:
-            logging.debug(f"Detecting context for query: {query}")
-            
-            # Define the prompt for context detection
-            system_prompt = """
-            Bạn là nhân viên tư vấn Bé Bơ, phụ trách phân loại câu hỏi của người dùng. Nhiệm vụ của bạn là xác định câu hỏi thuộc danh mục dịch vụ nào.
-            Phân tích câu hỏi và xác định nó thuộc vào một trong các ngữ cảnh sau:
-            
-            1. restaurant - Câu hỏi về đồ ăn, ăn uống, nhà hàng, thực đơn, món ăn, ẩm thực, v.v.
-            2. accommodation - Câu hỏi về khách sạn, phòng ở, lưu trú, tiện nghi, v.v.
-            3. delivery - Câu hỏi về dịch vụ giao hàng, vận chuyển hàng hóa, đơn hàng, theo dõi giao hàng, v.v.
-            4. transportation - Câu hỏi về di chuyển, đi lại, tài xế, phương tiện, v.v.
-            5. tourism - Câu hỏi về điểm tham quan, thắng cảnh, tour du lịch, v.v.
-            6. order - Câu hỏi về lịch sử đặt hàng, đơn hàng đã đặt, dịch vụ đã sử dụng, v.v.
-            7. general - Câu hỏi chung không thuộc các danh mục trên
-            
-            Trả lời của bạn phải là một đối tượng JSON với cấu trúc sau:
-            {
-                "primary_context": "[Danh mục chính - phải là một trong các giá trị: restaurant, accommodation, delivery, transportation, tourism, order, general]",
-                "confidence": [Một số từ 0 đến 1 chỉ mức độ tin cậy],
-                "all_contexts": {
-                    "restaurant": [Điểm từ 0 đến 1],
-                    "accommodation": [Điểm từ 0 đến 1],
-                    "delivery": [Điểm từ 0 đến 1],
-                    "transportation": [Điểm từ 0 đến 1],
-                    "tourism": [Điểm từ 0 đến 1],
-                    "order": [Điểm từ 0 đến 1],
-                    "general": [Điểm từ 0 đến 1]
-                }
-            }
-            
-            Tổng của tất cả điểm số nên xấp xỉ bằng 1.0.
-            """
+            logging.debug("Detecting context for query: %s", query)
             
             # Using OpenAI 0.28.1 format
             response = openai.ChatCompletion.create(
                 model="gpt-4o",
                 messages=[
-                    {"role": "system", "content": system_prompt},
+                    {"role": "system", "content": CONTEXT_DETECTION_PROMPT},
                     {"role": "user", "content": query}
                 ],
                 temperature=0.1,  # Low temperature for more deterministic results
@@ -86,21 +139,15 @@ class ContextDetector:
             
             # Extract the response
             result = response.choices[0].message.content.strip()
-            logging.debug(f"Context detection result: {result}")
-            
-            # Parse the JSON response
-            import json
-            import re
+            logging.debug("Context detection result: %s", result)
             
-            # Clean up the response if it contains markdown code blocks
-            # Pattern to match markdown code blocks: ```json ... ```
-            json_pattern = re.compile(r'```(?:json)?\s*(.+?)\s*```', re.DOTALL)
-            match = json_pattern.search(result)
+            # Parse the JSON response, cleaning it up if it contains markdown code blocks
+            match = JSON_CODE_BLOCK.search(result)
             
             if match:
                 # Extract the JSON content from the code block
                 json_content = match.group(1).strip()
-                logging.debug(f"Extracted JSON from markdown: {json_content}")
+                logging.debug("Extracted JSON from markdown: %s", json_content)
                 context_data = json.loads(json_content)
             else:
                 # Try parsing the raw response if no code block is found
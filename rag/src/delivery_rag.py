@@ -1,22 +1,25 @@
 import os
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 import openai
 import json
 import logging
+import numpy as np
+from qdrant_client import QdrantClient
 
 from .document_loader import DocumentLoader
 from .text_processor import TextProcessor
 from .embeddings_manager import EmbeddingsManager
 from .qdrant_manager import QdrantManager
+from .qdrant_connection import SEARCH_PARAMS
 from .system_prompt import get_system_prompt_by_context
 
 class DeliveryQdrantManager(QdrantManager):
     """
     Specialized QdrantManager for delivery data that uses a different collection name.
     """
-    def __init__(self):
-        super().__init__()
+    def __init__(self, client: Optional[QdrantClient] = None):
+        super().__init__(client)
         self.collection_name = "delivery_collection"
         # Ensure collection exists with the new name
         self._create_collection_if_not_exists()
@@ -33,11 +36,12 @@ class DeliveryQdrantManager(QdrantManager):
             List of matching delivery data with their details
         """
         try:
-            logging.info(f"Searching for top {top_k} delivery records")
+            logging.debug("Searching for top %s delivery records", top_k)
             search_result = self.client.search(
                 collection_name=self.collection_name,
                 query_vector=query_embedding,
-                limit=top_k
+                limit=top_k,
+                search_params=SEARCH_PARAMS
             )
             
             # Extract delivery data from search results
@@ -47,7 +51,7 @@ class DeliveryQdrantManager(QdrantManager):
                 data['score'] = result.score
                 delivery_data.append(data)
                 
-            logging.info(f"Found {len(delivery_data)} matching delivery records")
+            logging.debug("Found %s matching delivery records", len(delivery_data))
             return delivery_data
         except Exception as e:
             logging.error(f"Error searching for delivery data: {e}")
@@ -81,7 +85,7 @@ class DeliveryQdrantManager(QdrantManager):
                     'details': record
                 })
             
-            logging.info(f"Found {len(details_results)} matching delivery details")
+            logging.debug("Found %s matching delivery details", len(details_results))
             return details_results[:top_k]  # Limit to top_k results
         except Exception as e:
             logging.error(f"Error searching for delivery details: {e}")
@@ -91,14 +95,14 @@ class DeliveryRAG:
     """
     Specialized RAG system for delivery data queries.
     """
-    def __init__(self):
+    def __init__(self, client: Optional[QdrantClient] = None):
         load_dotenv()
         self.api_key = os.getenv('OPENAI_API_KEY')
         logging.debug(f"OpenAI API key loaded: {'Present' if self.api_key else 'Missing'}")
         
         self.processor = TextProcessor()
         self.embeddings_manager = EmbeddingsManager(self.api_key)
-        self.qdrant_manager = DeliveryQdrantManager()
+        self.qdrant_manager = DeliveryQdrantManager(client)
         
         # Initialize system
         logging.info("Initializing DeliveryRAG system")
@@ -112,41 +116,45 @@ class DeliveryRAG:
         logging.info("DeliveryRAG system initialized with Qdrant vector database")
         logging.info("If you haven't ingested data yet, please run the ingest_delivery_data_to_qdrant.py script")
     
-    def search_delivery_data(self, query: str, top_k: int = 3) -> List[Dict]:
+    def search_delivery_data(self, query: str, top_k: int = 3, query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
         """
         Search for delivery data based on a query
         
         Args:
             query: The search query
             top_k: Number of top results to return
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             List of matching delivery data with their details
         """
         # Get query embedding
-        query_embedding = self.embeddings_manager.create_embeddings([query])[0]
+        if query_embedding is None:
+            query_embedding = self.embeddings_manager.embed_query(query)
         
         # Use Qdrant to find similar delivery data
         results = self.qdrant_manager.search_delivery_data(query_embedding.tolist(), top_k)
         
         return results
     
-    def search_delivery_details(self, query: str, top_k: int = 5) -> List[Dict]:
+    def search_delivery_details(self, query: str, top_k: int = 5, query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
         """
         Search for specific delivery details
         
         Args:
             query: The search query
             top_k: Number of top results to return
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             List of matching delivery details
         """
-        logging.info(f"Searching delivery details for query: {query}")
+        logging.debug("Searching delivery details for query: %s", query)
         
         # Get query embedding
-        logging.debug("Creating embedding for query")
-        query_embedding = self.embeddings_manager.create_embeddings([query])[0]
+        if query_embedding is None:
+            logging.debug("Creating embedding for query")
+            query_embedding = self.embeddings_manager.embed_query(query)
         
         # Use Qdrant to find similar delivery details
         results = self.qdrant_manager.search_delivery_details(query_embedding.tolist(), top_k)
@@ -201,12 +209,13 @@ class DeliveryRAG:
             logging.error(f"Error extracting location info: {e}")
             return None
     
-    def answer_delivery_query(self, query: str) -> Dict:
+    def answer_delivery_query(self, query: str, query_embedding: Optional[np.ndarray] = None) -> Dict:
         """
         Answer a query about delivery services
         
         Args:
             query: The user's question about delivery services
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             A dictionary with the answer and relevant delivery data
@@ -214,10 +223,90 @@ class DeliveryRAG:
         # Extract location information if present in the query
         location = self.extract_location_info(query)
         
-        # Search for relevant delivery data from Qdrant
-        relevant_delivery_data = self.search_delivery_data(query, top_k=3)
-        relevant_delivery_details = self.search_delivery_details(query, top_k=5)
+        # Search for relevant delivery data from Qdrant, embedding the query only once
+        if query_embedding is None:
+            query_embedding = self.embeddings_manager.embed_query(query)
+        relevant_delivery_data = self.search_delivery_data(query, top_k=3, query_embedding=query_embedding)
+        relevant_delivery_details = self.search_delivery_details(query, top_k=5, query_embedding=query_embedding)
         
+        return self.generate_delivery_answer(query, location, relevant_delivery_data, relevant_delivery_details)
+    
+    def generate_delivery_answer(self, query: str, location: Optional[Dict[str, str]], relevant_delivery_data: List[Dict], relevant_delivery_details: List[Dict]) -> Dict:
+        """
+        Generate the answer for a delivery query from already retrieved data
+        
+        Args:
+            query: The user's question about delivery services
+            location: Location extracted from the query, if any
+            relevant_delivery_data: Delivery services retrieved for the query
+            relevant_delivery_details: Delivery details retrieved for the query
+            
+        Returns:
+            A dictionary with the answer and relevant delivery data, with an "error" key
+            when OpenAI failed and the answer is an apology
+        """
+        try:
+            # Query OpenAI chat completion
+            response = openai.ChatCompletion.create(
+                model="gpt-4o",
+                messages=self._build_delivery_messages(query, location, relevant_delivery_data, relevant_delivery_details)
+            )
+            
+            answer = response['choices'][0]['message']['content']
+            
+            return {
+                "answer": answer,
+                "top_delivery_data": relevant_delivery_data,
+                "top_delivery_details": relevant_delivery_details
+            }
+        except Exception as e:
+            logging.error(f"Error querying OpenAI: {e}")
+            return {
+                "answer": "Xin lỗi, Bé Bơ không thể trả lời câu hỏi của bạn lúc này. Vui lòng thử lại sau hoặc truy cập https://shipperrachgia.vn/ để biết thêm thông tin.",
+                "top_delivery_data": [],
+                "top_delivery_details": [],
+                "error": str(e)
+            }
+    
+    def stream_delivery_answer(self, query: str, location: Optional[Dict[str, str]], relevant_delivery_data: List[Dict], relevant_delivery_details: List[Dict]) -> Iterator[str]:
+        """
+        Stream the answer for a delivery query from already retrieved data
+        
+        Args:
+            query: The user's question about delivery services
+            location: Location extracted from the query, if any
+            relevant_delivery_data: Delivery services retrieved for the query
+            relevant_delivery_details: Delivery details retrieved for the query
+            
+        Returns:
+            Iterator over pieces of the answer as OpenAI generates them
+            
+        Raises:
+            Exception: The OpenAI error when the request fails, possibly after some pieces
+        """
+        response = openai.ChatCompletion.create(
+            model="gpt-4o",
+            messages=self._build_delivery_messages(query, location, relevant_delivery_data, relevant_delivery_details),
+            stream=True
+        )
+        for chunk in response:
+            delta = chunk['choices'][0]['delta'].get('content')
+            if delta:
+                yield delta
+    
+    def _build_delivery_messages(self, query: str, location: Optional[Dict[str, str]], relevant_delivery_data: List[Dict], relevant_delivery_details: List[Dict]) -> List[Dict]:
+        """
+        Build the chat messages for answering a delivery query from retrieved data
+        
+        Args:
+            query: The user's question about delivery services
+            location: Location extracted from the query, if any
+            relevant_delivery_data: Delivery services retrieved for the query
+            relevant_delivery_details: Delivery details retrieved for the query
+            
+        Returns:
+            List of chat messages for the OpenAI API
+        """
         # Prepare context
         context = "Thông tin về dịch vụ giao hàng:\n"
         
@@ -259,27 +348,7 @@ class DeliveryRAG:
         # Create user prompt with context and question
         prompt = f"Context: {context}\n\nQuestion: {query}\n\nAnswer:"
         
-        try:
-            # Query OpenAI chat completion
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            answer = response['choices'][0]['message']['content']
-            
-            return {
-                "answer": answer,
-                "top_delivery_data": relevant_delivery_data,
-                "top_delivery_details": relevant_delivery_details
-            }
-        except Exception as e:
-            logging.error(f"Error querying OpenAI: {e}")
-            return {
-                "answer": "Xin lỗi, Bé Bơ không thể trả lời câu hỏi của bạn lúc này. Vui lòng thử lại sau hoặc truy cập https://shipperrachgia.vn/ để biết thêm thông tin.",
-                "top_delivery_data": [],
-                "top_delivery_details": []
-            }
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
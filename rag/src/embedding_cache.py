@@ -0,0 +1,76 @@
+import os
+import hashlib
+import logging
+import sqlite3
+from typing import Callable, List
+
+import numpy as np
+
+from .embeddings_manager import EMBEDDING_MODEL, EMBEDDING_PARAMS
+
+# SQLite file mapping SHA-256 of (model, text) to the float32 embedding bytes
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', 'embedding_cache.sqlite')
+
+# Shortened text-embedding-3 vectors are cached apart from full-size ones of the same model
+_MODEL_KEY = f"{EMBEDDING_MODEL}/{EMBEDDING_PARAMS['dimensions']}" if 'dimensions' in EMBEDDING_PARAMS else EMBEDDING_MODEL
+
+# Stay below SQLite's limit on the number of variables in one statement
+_KEY_CHUNK_SIZE = 900
+
+def _cache_key(text: str) -> str:
+    # The model is part of the key so switching models doesn't return stale vectors
+    return hashlib.sha256(f"{_MODEL_KEY}:{text}".encode()).hexdigest()
+
+def get_or_compute(texts: List[str], embedder: Callable[[List[str]], List[np.ndarray]], path: str = EMBEDDING_CACHE_PATH) -> np.ndarray:
+    """
+    Get embeddings for texts, only calling the embedder for texts not embedded on an earlier run.
+    
+    Args:
+        texts: The texts to embed
+        embedder: Function creating embeddings for a list of texts
+        path: Path of the SQLite cache file
+        
+    Returns:
+        Contiguous (N, D) float32 matrix with the embeddings in the order of the texts
+    """
+    if not texts:
+        return np.empty((0, 0), dtype=np.float32)
+    
+    keys = [_cache_key(text) for text in texts]
+    
+    conn = sqlite3.connect(path)
+    try:
+        # WAL lets concurrent ingest batches read while another one writes
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, vec BLOB)")
+        
+        cached = {}
+        unique_keys = list(set(keys))
+        for i in range(0, len(unique_keys), _KEY_CHUNK_SIZE):
+            chunk = unique_keys[i:i + _KEY_CHUNK_SIZE]
+            placeholders = ", ".join(["?"] * len(chunk))
+            for key, vec in conn.execute(f"SELECT key, vec FROM cache WHERE key IN ({placeholders})", chunk):
+                cached[key] = np.frombuffer(vec, dtype=np.float32)
+        
+        # Embed each uncached text once, even if it occurs several times
+        uncached = {}
+        for key, text in zip(keys, texts):
+            if key not in cached:
+                uncached.setdefault(key, text)
+        logging.info(f"Embedding cache: {len(texts) - len(uncached)} of {len(texts)} texts already embedded")
+        
+        if uncached:
+            new_embeddings = embedder(list(uncached.values()))
+            rows = []
+            for key, embedding in zip(uncached, new_embeddings):
+                embedding = np.asarray(embedding, dtype=np.float32)
+                cached[key] = embedding
+                # Don't persist the zero vector returned when the API call failed
+                if embedding.any():
+                    rows.append((key, embedding.tobytes()))
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO cache (key, vec) VALUES (?, ?)", rows)
+        
+        return np.stack([cached[key] for key in keys])
+    finally:
+        conn.close()
@@ -1,7 +1,47 @@
+import os
 from typing import List
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import threading
+import time
 import openai
 import numpy as np
 import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Embedding model and vector size. The text-embedding-3 models can return shorter vectors
+# (e.g. EMBEDDING_MODEL=text-embedding-3-small EMBEDDING_DIMENSIONS=512); every collection
+# has to be re-ingested after a change, since queries and stored vectors must match.
+EMBEDDING_MODEL = os.getenv('EMBEDDING_MODEL', 'text-embedding-ada-002')
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', 1536))
+EMBEDDING_PARAMS = {"model": EMBEDDING_MODEL}
+if EMBEDDING_MODEL != "text-embedding-ada-002":
+    # ada-002 has a fixed size and rejects the dimensions parameter
+    EMBEDDING_PARAMS["dimensions"] = EMBEDDING_DIMENSIONS
+
+# Query embeddings shared by every EmbeddingsManager in the process, keyed by SHA-256 of the text
+QUERY_CACHE_SIZE = 4096
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+# OpenAI caps the total tokens of one embeddings request at 300K. Batches are split well below
+# that using a rough estimate of two UTF-8 bytes per token, which overestimates typical text.
+MAX_BATCH_TOKENS = 250000
+
+# Attempts for one batch request before falling back to embedding its texts one by one.
+# Rate limits (429) and server side or connection errors (5xx, timeouts) are retried with
+# exponential backoff, other errors fall back right away.
+BATCH_MAX_ATTEMPTS = 5
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError
+)
 
 class EmbeddingsManager:
     def __init__(self, api_key: str):
@@ -17,24 +57,104 @@ class EmbeddingsManager:
     def create_embeddings(self, texts: List[str]) -> List[np.ndarray]:
         embeddings = []
         try:
-            logging.debug(f"Creating embeddings for {len(texts)} texts")
+            logging.debug("Creating embeddings for %s texts", len(texts))
             for i, text in enumerate(texts):
                 try:
                     # For OpenAI 0.28.1, the response format is different
                     response = openai.Embedding.create(
-                        model="text-embedding-ada-002",
-                        input=text
+                        input=text,
+                        **EMBEDDING_PARAMS
                     )
                     # Extract embedding from the response (different format in 0.28.1)
-                    embeddings.append(np.array(response['data'][0]['embedding']))
+                    embeddings.append(np.array(response['data'][0]['embedding'], dtype=np.float32))
                     if i % 10 == 0 and i > 0:
-                        logging.debug(f"Processed {i} embeddings so far")
+                        logging.debug("Processed %s embeddings so far", i)
                 except Exception as e:
                     logging.error(f"Error creating embedding for text {i}: {e}")
                     # Create a zero embedding as fallback
-                    embeddings.append(np.zeros(1536))  # Ada embeddings are 1536 dimensions
-            logging.info(f"Successfully created {len(embeddings)} embeddings")
+                    embeddings.append(np.zeros(EMBEDDING_DIMENSIONS, dtype=np.float32))
+            logging.debug("Successfully created %s embeddings", len(embeddings))
             return embeddings
         except Exception as e:
             logging.error(f"Error in create_embeddings: {e}")
-            raise
\ No newline at end of file
+            raise
+
+    def _create_embeddings_batch(self, texts: List[str]) -> List[np.ndarray]:
+        for attempt in range(BATCH_MAX_ATTEMPTS):
+            try:
+                response = openai.Embedding.create(
+                    input=texts,
+                    **EMBEDDING_PARAMS
+                )
+                data = sorted(response['data'], key=lambda item: item['index'])
+                return [np.array(item['embedding'], dtype=np.float32) for item in data]
+            except RETRYABLE_ERRORS as e:
+                delay = 2 ** attempt
+                logging.warning(f"Rate limited or transient error while creating embeddings, retrying in {delay}s: {e}")
+                time.sleep(delay)
+            except Exception as e:
+                logging.error(f"Error creating embeddings for a batch of {len(texts)} texts: {e}")
+                break
+        # Embed the texts one by one so only the failing ones get a zero embedding
+        return self.create_embeddings(texts)
+
+    def embed_in_batches(self, texts: List[str], batch_size: int = 128, workers: int = 8) -> List[np.ndarray]:
+        """
+        Create embeddings for many texts, sending them in batches from concurrent requests.
+        Each distinct text is only embedded once.
+        
+        Args:
+            texts: The texts to embed
+            batch_size: Maximum number of texts per embeddings request (OpenAI accepts up to 2048)
+            workers: Number of requests in flight at once
+            
+        Returns:
+            List of embeddings in the order of the texts
+        """
+        unique_texts = list(dict.fromkeys(texts))
+        batches = []
+        batch, batch_tokens = [], 0
+        for text in unique_texts:
+            tokens = len(text.encode()) // 2 + 1
+            if batch and (len(batch) >= batch_size or batch_tokens + tokens > MAX_BATCH_TOKENS):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            batches.append(batch)
+        logging.info(f"Creating embeddings for {len(unique_texts)} distinct of {len(texts)} texts in {len(batches)} batches")
+        unique_embeddings = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch_embeddings in executor.map(self._create_embeddings_batch, batches):
+                unique_embeddings.extend(batch_embeddings)
+        
+        embeddings_by_text = dict(zip(unique_texts, unique_embeddings))
+        return [embeddings_by_text[text] for text in texts]
+
+    def embed_query(self, text: str) -> np.ndarray:
+        """
+        Create the embedding for a query, reusing it when the same text was embedded recently.
+        
+        Args:
+            text: The query text
+            
+        Returns:
+            Embedding as a read-only numpy array
+        """
+        key = hashlib.sha256(text.encode()).hexdigest()
+        with _query_cache_lock:
+            embedding = _query_cache.get(key)
+            if embedding is not None:
+                _query_cache.move_to_end(key)
+                return embedding
+        
+        embedding = self.create_embeddings([text])[0]
+        # Don't cache the zero vector returned when the API call failed
+        if embedding.any():
+            embedding.flags.writeable = False
+            with _query_cache_lock:
+                _query_cache[key] = embedding
+                while len(_query_cache) > QUERY_CACHE_SIZE:
+                    _query_cache.popitem(last=False)
+        return embedding
@@ -1,21 +1,25 @@
 import os
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 import openai
 import json
 import logging
+import numpy as np
+from qdrant_client import QdrantClient
 
 from .document_loader import DocumentLoader
 from .text_processor import TextProcessor
 from .embeddings_manager import EmbeddingsManager
 from .qdrant_manager import QdrantManager
+from .qdrant_connection import SEARCH_PARAMS
+from .llm_cache import cached_chat_completion
 
 class HotelQdrantManager(QdrantManager):
     """
     Specialized QdrantManager for hotel data that uses a different collection name.
     """
-    def __init__(self):
-        super().__init__()
+    def __init__(self, client: Optional[QdrantClient] = None):
+        super().__init__(client)
         self.collection_name = "hotel_collection"
         # Ensure collection exists with the new name
         self._create_collection_if_not_exists()
@@ -32,11 +36,12 @@ class HotelQdrantManager(QdrantManager):
             List of matching hotels with their details
         """
         try:
-            logging.info(f"Searching for top {top_k} hotels")
+            logging.debug("Searching for top %s hotels", top_k)
             search_result = self.client.search(
                 collection_name=self.collection_name,
                 query_vector=query_embedding,
-                limit=top_k
+                limit=top_k,
+                search_params=SEARCH_PARAMS
             )
             
             # Extract hotel data from search results
@@ -46,12 +51,55 @@ class HotelQdrantManager(QdrantManager):
                 hotel_data['score'] = result.score
                 hotels.append(hotel_data)
                 
-            logging.info(f"Found {len(hotels)} matching hotels")
+            logging.debug("Found %s matching hotels", len(hotels))
             return hotels
         except Exception as e:
             logging.error(f"Error searching for hotels: {e}")
             return []
     
+    def _flatten_hotel_rooms(self, hotels: List[Dict], top_k: int) -> List[Dict]:
+        """
+        Flatten the rooms of matching hotels into room results.
+        
+        Args:
+            hotels: Matching hotels with their details
+            top_k: Number of top results to return
+            
+        Returns:
+            List of hotel rooms with hotel info
+        """
+        rooms_results = []
+        for hotel in hotels:
+            hotel_name = hotel.get('name', 'Unknown')
+            hotel_id = hotel.get('id')
+            
+            for room in hotel.get('rooms', []):
+                if room is not None:
+                    rooms_results.append({
+                        'room': room,
+                        'hotel_name': hotel_name,
+                        'hotel_id': hotel_id
+                    })
+        
+        return rooms_results[:top_k]  # Limit to top_k results
+    
+    def search_hotels_and_rooms(self, query_embedding: List[float], hotel_top_k: int = 3, room_top_k: int = 5):
+        """
+        Search for hotels and hotel rooms with a single Qdrant request.
+        
+        Args:
+            query_embedding: Embedding vector for the query
+            hotel_top_k: Number of top hotels to return
+            room_top_k: Number of top rooms to return
+            
+        Returns:
+            Tuple of (matching hotels, matching rooms)
+        """
+        hotels = self.search_hotels(query_embedding, max(hotel_top_k, room_top_k))
+        rooms_results = self._flatten_hotel_rooms(hotels[:room_top_k], room_top_k)
+        logging.debug("Found %s matching rooms", len(rooms_results))
+        return hotels[:hotel_top_k], rooms_results
+    
     def search_hotel_rooms(self, query_embedding: List[float], top_k: int = 5) -> List[Dict]:
         """
         Search for specific hotel rooms across all hotels.
@@ -68,21 +116,10 @@ class HotelQdrantManager(QdrantManager):
             hotels = self.search_hotels(query_embedding, top_k)
             
             # Extract room information
-            rooms_results = []
-            for hotel in hotels:
-                hotel_name = hotel.get('name', 'Unknown')
-                hotel_id = hotel.get('id')
-                
-                for room in hotel.get('rooms', []):
-                    if room is not None:
-                        rooms_results.append({
-                            'room': room,
-                            'hotel_name': hotel_name,
-                            'hotel_id': hotel_id
-                        })
+            rooms_results = self._flatten_hotel_rooms(hotels, top_k)
             
-            logging.info(f"Found {len(rooms_results)} matching rooms")
-            return rooms_results[:top_k]  # Limit to top_k results
+            logging.debug("Found %s matching rooms", len(rooms_results))
+            return rooms_results
         except Exception as e:
             logging.error(f"Error searching for hotel rooms: {e}")
             return []
@@ -91,14 +128,14 @@ class HotelRAG:
     """
     Specialized RAG system for hotel data queries.
     """
-    def __init__(self):
+    def __init__(self, client: Optional[QdrantClient] = None):
         load_dotenv()
         self.api_key = os.getenv('OPENAI_API_KEY')
         logging.debug(f"OpenAI API key loaded: {'Present' if self.api_key else 'Missing'}")
         
         self.processor = TextProcessor()
         self.embeddings_manager = EmbeddingsManager(self.api_key)
-        self.qdrant_manager = HotelQdrantManager()
+        self.qdrant_manager = HotelQdrantManager(client)
         
         # Initialize system
         logging.info("Initializing HotelRAG system")
@@ -112,48 +149,69 @@ class HotelRAG:
         logging.info("HotelRAG system initialized with Qdrant vector database")
         logging.info("If you haven't ingested data yet, please run the ingest_hotel_data_to_qdrant.py script")
     
-    def search_hotels(self, query: str, top_k: int = 3) -> List[Dict]:
+    def search_hotels(self, query: str, top_k: int = 3, query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
         """
         Search for hotels based on a query
         
         Args:
             query: The search query
             top_k: Number of top results to return
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             List of matching hotels with their details
         """
         # Get query embedding
-        query_embedding = self.embeddings_manager.create_embeddings([query])[0]
+        if query_embedding is None:
+            query_embedding = self.embeddings_manager.embed_query(query)
         
         # Use Qdrant to find similar hotels
         results = self.qdrant_manager.search_hotels(query_embedding.tolist(), top_k)
         
         return results
     
-    def search_hotel_rooms(self, query: str, top_k: int = 5) -> List[Dict]:
+    def search_hotel_rooms(self, query: str, top_k: int = 5, query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
         """
         Search for specific hotel rooms across all hotels
         
         Args:
             query: The search query
             top_k: Number of top results to return
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             List of matching hotel rooms with hotel info
         """
-        logging.info(f"Searching hotel rooms for query: {query}")
+        logging.debug("Searching hotel rooms for query: %s", query)
         
         # Get query embedding
-        logging.debug("Creating embedding for query")
-        query_embedding = self.embeddings_manager.create_embeddings([query])[0]
+        if query_embedding is None:
+            logging.debug("Creating embedding for query")
+            query_embedding = self.embeddings_manager.embed_query(query)
         
         # Use Qdrant to find similar hotel rooms
         rooms_results = self.qdrant_manager.search_hotel_rooms(query_embedding.tolist(), top_k)
         
-        logging.info(f"Returning {len(rooms_results)} hotel room results")
+        logging.debug("Returning %s hotel room results", len(rooms_results))
         return rooms_results
     
+    def batch_search(self, query: str, hotel_top_k: int = 3, room_top_k: int = 5, query_embedding: Optional[np.ndarray] = None):
+        """
+        Search for hotels and hotel rooms with one embedding and one Qdrant request
+        
+        Args:
+            query: The search query
+            hotel_top_k: Number of top hotels to return
+            room_top_k: Number of top rooms to return
+            query_embedding: Precomputed embedding of the query, created if not given
+            
+        Returns:
+            Tuple of (matching hotels, matching rooms)
+        """
+        if query_embedding is None:
+            query_embedding = self.embeddings_manager.embed_query(query)
+        return self.qdrant_manager.search_hotels_and_rooms(query_embedding.tolist(), hotel_top_k, room_top_k)
+    
     def extract_location_info(self, query: str) -> Dict:
         """
         Extract location information from a query using OpenAI
@@ -178,18 +236,19 @@ class HotelRAG:
             if location.lower() == 'none':
                 return None
                 
-            logging.debug(f"Extracted location: {location}")
+            logging.debug("Extracted location: %s", location)
             return location
         except Exception as e:
             logging.error(f"Error extracting location: {e}")
             return None
     
-    def answer_hotel_query(self, query: str) -> Dict:
+    def answer_hotel_query(self, query: str, query_embedding: Optional[np.ndarray] = None) -> Dict:
         """
         Answer a query about hotels using Qdrant vector database
         
         Args:
             query: The user's question about hotels
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             A dictionary containing the answer and relevant hotels/rooms
@@ -198,9 +257,87 @@ class HotelRAG:
         location = self.extract_location_info(query)
         
         # Search for relevant hotels and rooms from Qdrant
-        relevant_hotels = self.search_hotels(query, top_k=3)
-        relevant_rooms = self.search_hotel_rooms(query, top_k=5)
+        relevant_hotels, relevant_rooms = self.batch_search(
+            query, hotel_top_k=3, room_top_k=5, query_embedding=query_embedding
+        )
         
+        return self.generate_hotel_answer(query, location, relevant_hotels, relevant_rooms)
+    
+    def generate_hotel_answer(self, query: str, location: Optional[str], relevant_hotels: List[Dict], relevant_rooms: List[Dict]) -> Dict:
+        """
+        Generate the answer for a hotel query from already retrieved data.
+        The inputs are independent of each other, so callers can fetch them concurrently.
+        
+        Args:
+            query: The user's question about hotels
+            location: Location extracted from the query, if any
+            relevant_hotels: Hotels retrieved for the query
+            relevant_rooms: Rooms retrieved for the query
+            
+        Returns:
+            A dictionary containing the answer and relevant hotels/rooms, with an
+            "error" key when OpenAI failed and the answer is an apology
+        """
+        # Get response from OpenAI (using v0.28.1 format)
+        try:
+            logging.debug("Sending request to OpenAI for hotel query")
+            answer = cached_chat_completion(self._build_hotel_messages(query, location, relevant_hotels, relevant_rooms))
+            logging.debug("Received answer from OpenAI: %s...", answer[:50])
+            
+            return {
+                "answer": answer,
+                "top_hotels": relevant_hotels,
+                "top_rooms": relevant_rooms
+            }
+        except Exception as e:
+            logging.error(f"Error getting response from OpenAI: {e}")
+            return {
+                "answer": "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này.",
+                "top_hotels": [],
+                "top_rooms": [],
+                "error": str(e)
+            }
+    
+    def stream_hotel_answer(self, query: str, location: Optional[str], relevant_hotels: List[Dict], relevant_rooms: List[Dict]) -> Iterator[str]:
+        """
+        Stream the answer for a hotel query from already retrieved data
+        
+        Args:
+            query: The user's question about hotels
+            location: Location extracted from the query, if any
+            relevant_hotels: Hotels retrieved for the query
+            relevant_rooms: Rooms retrieved for the query
+            
+        Returns:
+            Iterator over pieces of the answer as OpenAI generates them
+            
+        Raises:
+            Exception: The OpenAI error when the request fails, possibly after some pieces
+        """
+        logging.debug("Streaming request to OpenAI for hotel query")
+        response = openai.ChatCompletion.create(
+            model="gpt-4o",
+            messages=self._build_hotel_messages(query, location, relevant_hotels, relevant_rooms),
+            stream=True
+        )
+        for chunk in response:
+            delta = chunk['choices'][0]['delta'].get('content')
+            if delta:
+                yield delta
+    
+    def _build_hotel_messages(self, query: str, location: Optional[str], relevant_hotels: List[Dict], relevant_rooms: List[Dict]) -> List[Dict]:
+        """
+        Build the chat messages for answering a hotel query from retrieved data
+        
+        Args:
+            query: The user's question about hotels
+            location: Location extracted from the query, if any
+            relevant_hotels: Hotels retrieved for the query
+            relevant_rooms: Rooms retrieved for the query
+            
+        Returns:
+            List of chat messages for the OpenAI API
+        """
         # Prepare context
         context = "Hotel information:\n"
         
@@ -242,40 +379,19 @@ class HotelRAG:
         from src.system_prompt import get_system_prompt_by_context
         system_prompt = get_system_prompt_by_context("hotel")
         
-        # Add location awareness to the system prompt if location is detected
+        # Add location awareness if location is detected. It goes after the context rather than
+        # into the system prompt so the prompt prefix stays identical across queries and can be
+        # served from OpenAI's prompt cache.
+        location_info = ""
         if location:
-            location_info = f"\n\nNgười dùng đang hỏi về khách sạn gần '{location}'. "
+            location_info = f"Người dùng đang hỏi về khách sạn gần '{location}'. "
             location_info += "Hãy chú ý đặc biệt đến vị trí khách sạn và khoảng cách đến địa điểm này. "
-            location_info += "Nếu có tọa độ, hãy sử dụng chúng để xác định khách sạn nào gần địa điểm được đề cập nhất."
-            system_prompt += location_info
+            location_info += "Nếu có tọa độ, hãy sử dụng chúng để xác định khách sạn nào gần địa điểm được đề cập nhất.\n\n"
         
         # Create prompt
-        prompt = f"""Context: {context}\n\nQuestion: {query}\n\nAnswer:"""
+        prompt = f"""Context: {context}\n\n{location_info}Question: {query}\n\nAnswer:"""
         
-        # Get response from OpenAI (using v0.28.1 format)
-        try:
-            logging.debug("Sending request to OpenAI for hotel query")
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            # Extract content from response (different format in v0.28.1)
-            answer = response['choices'][0]['message']['content']
-            logging.debug(f"Received answer from OpenAI: {answer[:50]}...")
-            
-            return {
-                "answer": answer,
-                "top_hotels": relevant_hotels,
-                "top_rooms": relevant_rooms
-            }
-        except Exception as e:
-            logging.error(f"Error getting response from OpenAI: {e}")
-            return {
-                "answer": "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này.",
-                "top_hotels": [],
-                "top_rooms": []
-            }
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
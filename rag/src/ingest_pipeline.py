@@ -0,0 +1,115 @@
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, List, Tuple
+
+import numpy as np
+
+# Rows per pipeline batch, and how many batches may be embedded or uploaded at once
+PIPELINE_BATCH_SIZE = 256
+EMBED_WORKERS = 4
+MAX_PENDING_BATCHES = 8
+
+# Worker processes building the embedding texts, 1 builds them on the calling thread
+TEXT_PROCESSES = int(os.getenv('INGEST_TEXT_PROCESSES', 1))
+
+def batched(items: Iterable[Any], batch_size: int = PIPELINE_BATCH_SIZE) -> Iterable[List[Any]]:
+    """
+    Split an iterable into lists of at most batch_size items.
+    
+    Args:
+        items: The items to split
+        batch_size: Maximum number of items per list
+        
+    Yields:
+        Lists of consecutive items
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def map_batches(fn: Callable[[List[Any]], Any], batches: Iterable[List[Any]], processes: int = TEXT_PROCESSES) -> Iterable[Tuple[List[Any], Any]]:
+    """
+    Apply a CPU-bound function to batches, in worker processes when more than one is configured.
+    
+    Results come back in the order of the batches, and at most two batches per process are
+    submitted ahead, so the batches are still consumed as a stream. The function must be
+    defined at module level so it can be pickled.
+    
+    Args:
+        fn: Function applied to each batch
+        batches: The batches
+        processes: Number of worker processes
+        
+    Yields:
+        (batch, result) pairs
+    """
+    if processes <= 1:
+        for batch in batches:
+            yield batch, fn(batch)
+        return
+    
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append((batch, executor.submit(fn, batch)))
+            if len(pending) >= processes * 2:
+                batch, future = pending.popleft()
+                yield batch, future.result()
+        while pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+def run_pipeline(
+    batches: Iterable[Tuple[List[str], Any]],
+    embed: Callable[[List[str]], List[np.ndarray]],
+    upload: Callable[[List[np.ndarray], Any], None],
+    workers: int = EMBED_WORKERS,
+    max_pending: int = MAX_PENDING_BATCHES
+) -> int:
+    """
+    Run the fetch, embed and upload stages of an ingest concurrently.
+    
+    Batches are produced (fetched from MySQL and turned into texts) on the calling thread,
+    embedded on a pool of worker threads and uploaded on a single upload thread, so the
+    three stages overlap. At most max_pending batches are in flight, which bounds memory.
+    The first error from any stage is raised.
+    
+    Args:
+        batches: Iterable of (texts, batch data) pairs, the batch data is passed on to upload
+        embed: Function creating embeddings for a list of texts
+        upload: Function uploading the embeddings of a batch along with its batch data
+        workers: Number of batches embedded at once
+        max_pending: Maximum number of batches produced but not yet uploaded
+        
+    Returns:
+        Number of texts ingested
+    """
+    count = 0
+    in_flight = deque()
+    with ThreadPoolExecutor(max_workers=workers) as embed_pool, ThreadPoolExecutor(max_workers=1) as upload_pool:
+        def embed_batch(texts, data):
+            return upload_pool.submit(upload, embed(texts), data)
+        
+        def wait_oldest():
+            nonlocal count
+            texts_count, future = in_flight.popleft()
+            future.result().result()
+            count += texts_count
+            logging.info(f"Ingested {count} records")
+        
+        for texts, data in batches:
+            if not texts:
+                continue
+            in_flight.append((len(texts), embed_pool.submit(embed_batch, texts, data)))
+            while len(in_flight) >= max_pending:
+                wait_oldest()
+        while in_flight:
+            wait_oldest()
+    return count
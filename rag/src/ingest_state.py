@@ -0,0 +1,45 @@
+import os
+import sqlite3
+from typing import Optional
+
+# SQLite file keeping the updated_at watermark of each incremental ingest
+INGEST_STATE_PATH = os.getenv('INGEST_STATE_PATH', 'ingest_state.sqlite')
+
+def _connect(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS watermark (name TEXT PRIMARY KEY, value TEXT)")
+    return conn
+
+def get_watermark(name: str, path: str = INGEST_STATE_PATH) -> Optional[str]:
+    """
+    Get the updated_at watermark stored by the last successful ingest.
+    
+    Args:
+        name: Name of the ingest
+        path: Path of the SQLite state file
+        
+    Returns:
+        The watermark, or None if the ingest never completed
+    """
+    conn = _connect(path)
+    try:
+        row = conn.execute("SELECT value FROM watermark WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+    finally:
+        conn.close()
+
+def set_watermark(name: str, value: str, path: str = INGEST_STATE_PATH):
+    """
+    Store the updated_at watermark of a successful ingest.
+    
+    Args:
+        name: Name of the ingest
+        value: Latest updated_at of the ingested rows
+        path: Path of the SQLite state file
+    """
+    conn = _connect(path)
+    try:
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO watermark (name, value) VALUES (?, ?)", (name, value))
+    finally:
+        conn.close()
@@ -0,0 +1,28 @@
+import json
+import logging
+import functools
+from typing import List, Dict
+import openai
+
+@functools.lru_cache(maxsize=1024)
+def _cached_completion(model: str, messages_json: str) -> str:
+    logging.debug("Answer cache miss, sending request to OpenAI")
+    response = openai.ChatCompletion.create(model=model, messages=json.loads(messages_json))
+    return response['choices'][0]['message']['content']
+
+def cached_chat_completion(messages: List[Dict], model: str = "gpt-4o") -> str:
+    """
+    Get a chat completion, reusing the answer for a byte-identical prompt.
+
+    Retrieval returns the same context for repeated questions, so the whole prompt
+    (system prompt, context and question) is often identical. Failed requests raise
+    and are not cached.
+
+    Args:
+        messages: Chat messages for the OpenAI API
+        model: Model name
+
+    Returns:
+        The content of the completion
+    """
+    return _cached_completion(model, json.dumps(messages, ensure_ascii=False))
@@ -4,19 +4,21 @@ from typing import List, Dict, Any, Optional
 import openai
 import json
 import logging
+from qdrant_client import QdrantClient
 
 from .document_loader import DocumentLoader
 from .text_processor import TextProcessor
 from .embeddings_manager import EmbeddingsManager
 from .qdrant_manager import QdrantManager
+from .qdrant_connection import SEARCH_PARAMS
 from .system_prompt import get_system_prompt_by_context
 
 class OrdersQdrantManager(QdrantManager):
     """
     Specialized QdrantManager for orders data that uses a different collection name.
     """
-    def __init__(self):
-        super().__init__()
+    def __init__(self, client: Optional[QdrantClient] = None):
+        super().__init__(client)
         self.collection_name = "orders_collection"
         # Ensure collection exists with the new name
         self._create_collection_if_not_exists()
@@ -33,11 +35,12 @@ class OrdersQdrantManager(QdrantManager):
             List of matching orders with their details
         """
         try:
-            logging.info(f"Searching for top {top_k} orders")
+            logging.debug("Searching for top %s orders", top_k)
             search_result = self.client.search(
                 collection_name=self.collection_name,
                 query_vector=query_embedding,
-                limit=top_k
+                limit=top_k,
+                search_params=SEARCH_PARAMS
             )
             
             # Extract order data from search results
@@ -47,7 +50,7 @@ class OrdersQdrantManager(QdrantManager):
                 order_data['score'] = result.score
                 orders.append(order_data)
                 
-            logging.info(f"Found {len(orders)} matching orders")
+            logging.debug("Found %s matching orders", len(orders))
             return orders
         except Exception as e:
             logging.error(f"Error searching for orders: {e}")
@@ -65,7 +68,7 @@ class OrdersQdrantManager(QdrantManager):
             List of matching orders for the user
         """
         try:
-            logging.info(f"Searching for orders by user ID: {user_id}")
+            logging.debug("Searching for orders by user ID: %s", user_id)
             search_result = self.client.search(
                 collection_name=self.collection_name,
                 query_filter={
@@ -78,7 +81,8 @@ class OrdersQdrantManager(QdrantManager):
                         }
                     ]
                 },
-                limit=top_k
+                limit=top_k,
+                search_params=SEARCH_PARAMS
             )
             
             # Extract order data from search results
@@ -87,7 +91,7 @@ class OrdersQdrantManager(QdrantManager):
                 order_data = result.payload
                 orders.append(order_data)
                 
-            logging.info(f"Found {len(orders)} orders for user {user_id}")
+            logging.debug("Found %s orders for user %s", len(orders), user_id)
             return orders
         except Exception as e:
             logging.error(f"Error searching for orders by user ID: {e}")
@@ -106,7 +110,7 @@ class OrdersQdrantManager(QdrantManager):
             List of matching orders for the user and service type
         """
         try:
-            logging.info(f"Searching for {service_type} orders by user ID: {user_id}")
+            logging.debug("Searching for %s orders by user ID: %s", service_type, user_id)
             search_result = self.client.search(
                 collection_name=self.collection_name,
                 query_filter={
@@ -125,7 +129,8 @@ class OrdersQdrantManager(QdrantManager):
                         }
                     ]
                 },
-                limit=top_k
+                limit=top_k,
+                search_params=SEARCH_PARAMS
             )
             
             # Extract order data from search results
@@ -134,7 +139,7 @@ class OrdersQdrantManager(QdrantManager):
                 order_data = result.payload
                 orders.append(order_data)
                 
-            logging.info(f"Found {len(orders)} {service_type} orders for user {user_id}")
+            logging.debug("Found %s %s orders for user %s", len(orders), service_type, user_id)
             return orders
         except Exception as e:
             logging.error(f"Error searching for {service_type} orders by user ID: {e}")
@@ -144,14 +149,14 @@ class OrdersRAG:
     """
     Specialized RAG system for orders data queries.
     """
-    def __init__(self):
+    def __init__(self, client: Optional[QdrantClient] = None):
         load_dotenv()
         self.api_key = os.getenv('OPENAI_API_KEY')
         logging.debug(f"OpenAI API key loaded: {'Present' if self.api_key else 'Missing'}")
         
         self.processor = TextProcessor()
         self.embeddings_manager = EmbeddingsManager(self.api_key)
-        self.qdrant_manager = OrdersQdrantManager()
+        self.qdrant_manager = OrdersQdrantManager(client)
         
         # Initialize system
         logging.info("Initializing OrdersRAG system")
@@ -177,7 +182,7 @@ class OrdersRAG:
             List of matching orders with their details
         """
         # Get query embedding
-        query_embedding = self.embeddings_manager.create_embeddings([query])[0]
+        query_embedding = self.embeddings_manager.embed_query(query)
         
         # Use Qdrant to find similar orders
         results = self.qdrant_manager.search_orders(query_embedding.tolist(), top_k)
@@ -195,7 +200,7 @@ class OrdersRAG:
         Returns:
             Dictionary with service usage information
         """
-        logging.info(f"Checking service history for user: {user_id}, service_type: {service_type}")
+        logging.debug("Checking service history for user: %s, service_type: %s", user_id, service_type)
         
         if service_type:
             # Check for specific service type
@@ -299,7 +304,7 @@ class OrdersRAG:
             if service_type.lower() == 'none':
                 return None
                 
-            logging.debug(f"Extracted service type: {service_type}")
+            logging.debug("Extracted service type: %s", service_type)
             return service_type
         except Exception as e:
             logging.error(f"Error extracting service type: {e}")
@@ -313,7 +318,8 @@ class OrdersRAG:
             query: The user's question about orders
             
         Returns:
-            A dictionary containing the answer and relevant order information
+            A dictionary containing the answer and relevant order information, with an
+            "error" key when OpenAI failed and the answer is an apology
         """
         # Extract user information and service type from the query
         user_info = self.extract_user_info(query)
@@ -386,7 +392,7 @@ class OrdersRAG:
             
             # Extract content from response
             answer = response['choices'][0]['message']['content']
-            logging.debug(f"Received answer from OpenAI: {answer[:50]}...")
+            logging.debug("Received answer from OpenAI: %s...", answer[:50])
             
             return {
                 "answer": answer,
@@ -400,7 +406,8 @@ class OrdersRAG:
                 "answer": "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này.",
                 "user_info": user_info,
                 "service_type": service_type,
-                "orders": []
+                "orders": [],
+                "error": str(e)
             }
     
     def refresh_orders_data(self):
@@ -0,0 +1,153 @@
+import os
+import logging
+import threading
+import uuid
+from contextlib import contextmanager
+from decimal import Decimal
+from typing import Union
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from dotenv import load_dotenv
+
+QDRANT_URL = "https://16f1329c-7600-4be6-8dc1-376daff8d555.us-west-1-0.aws.cloud.qdrant.io"
+
+# Index settings for the OpenAI embedding collections. Binary quantization keeps one bit
+# per dimension in RAM for the HNSW traversal, and candidates are rescored with the original
+# vectors, oversampled so recall stays close to an exact search.
+HNSW_CONFIG = models.HnswConfigDiff(m=16, ef_construct=100)
+QUANTIZATION_CONFIG = models.BinaryQuantization(
+    binary=models.BinaryQuantizationConfig(always_ram=True)
+)
+SEARCH_PARAMS = models.SearchParams(
+    hnsw_ef=64,
+    quantization=models.QuantizationSearchParams(rescore=True, oversampling=2.0)
+)
+
+# Bulk upload settings. Indexing is switched off while a collection is bulk loaded and the
+# HNSW graph is built once afterwards, at the default threshold restored below.
+UPLOAD_BATCH_SIZE = 256
+UPLOAD_PARALLEL = int(os.getenv('QDRANT_UPLOAD_PARALLEL', 8))
+DEFAULT_INDEXING_THRESHOLD = 20000
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_qdrant_client() -> QdrantClient:
+    """
+    Get the Qdrant client shared by all RAG systems in this process.
+
+    One client means one connection (and one gRPC channel) to Qdrant instead of
+    one per QdrantManager, and concurrent searches are multiplexed over it.
+
+    Returns:
+        The shared QdrantClient
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                load_dotenv()
+                api_key = os.getenv('QDRANT_API_KEY')
+                if api_key:
+                    # Use cloud Qdrant with API key
+                    _client = QdrantClient(
+                        api_key=api_key,
+                        url=QDRANT_URL,
+                        port=6333,
+                        prefer_grpc=os.getenv('QDRANT_PREFER_GRPC', 'true').lower() == 'true',
+                        grpc_options={'grpc.keepalive_time_ms': 10000}
+                    )
+                    logging.info("Connected to Qdrant cloud service")
+                else:
+                    # Use local Qdrant
+                    _client = QdrantClient(":memory:")  # In-memory storage for testing
+                    logging.info("Using in-memory Qdrant instance")
+    return _client
+
+def point_id(kind: str, key) -> Union[int, str]:
+    """
+    Get a stable Qdrant point id for a database row, so re-ingesting the row overwrites its point.
+
+    Args:
+        kind: Kind of record, e.g. "delivery", keeping keys of different tables apart
+        key: Primary key of the row
+
+    Returns:
+        The key itself when it is an integer, otherwise a UUID derived from kind and key
+    """
+    try:
+        return int(key)
+    except (ValueError, TypeError):
+        return str(uuid.uuid5(uuid.NAMESPACE_OID, f"{kind}:{key}"))
+
+def compact_payload(value):
+    """
+    Drop None fields from a payload, including in nested records, so they aren't sent or stored.
+
+    Readers of the payloads use .get with a default, so a missing field reads as before.
+    MySQL DECIMAL values are converted to float, which the gRPC payload encoding supports.
+
+    Args:
+        value: Payload, or a value nested in one
+
+    Returns:
+        The value without None fields
+    """
+    if isinstance(value, dict):
+        return {key: compact_payload(item) for key, item in value.items() if item is not None}
+    if isinstance(value, list):
+        return [compact_payload(item) for item in value]
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+@contextmanager
+def deferred_indexing(client: QdrantClient, collection_name: str):
+    """
+    Switch off indexing of a collection while it is bulk loaded inside the block.
+
+    The collection's HNSW and quantization settings are brought up to date first, and the
+    default indexing threshold is restored on exit, even if the load fails. An indexing
+    threshold of 0 disables indexing in Qdrant, it does not mean "index every vector".
+
+    Args:
+        client: Qdrant client
+        collection_name: Collection being loaded
+    """
+    # Collections created before the index settings above existed get them here, so they
+    # are quantized once the deferred index is built
+    client.update_collection(
+        collection_name=collection_name,
+        optimizers_config=models.OptimizersConfigDiff(indexing_threshold=0),
+        hnsw_config=HNSW_CONFIG,
+        quantization_config=QUANTIZATION_CONFIG
+    )
+    try:
+        yield
+    finally:
+        client.update_collection(
+            collection_name=collection_name,
+            optimizers_config=models.OptimizersConfigDiff(indexing_threshold=DEFAULT_INDEXING_THRESHOLD)
+        )
+
+def bulk_upload(client: QdrantClient, collection_name: str, vectors, payloads, ids, parallel: int = UPLOAD_PARALLEL):
+    """
+    Upload many points to a collection with indexing deferred until the upload finishes.
+
+    Args:
+        client: Qdrant client
+        collection_name: Collection to upload to
+        vectors: Vectors of the points, one per row
+        payloads: Payloads of the points
+        ids: Ids of the points
+        parallel: Number of parallel upload workers
+    """
+    with deferred_indexing(client, collection_name):
+        client.upload_collection(
+            collection_name=collection_name,
+            vectors=vectors,
+            payload=payloads,
+            ids=ids,
+            batch_size=UPLOAD_BATCH_SIZE,
+            parallel=parallel
+        )
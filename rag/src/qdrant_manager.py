@@ -3,35 +3,26 @@ import logging
 from typing import List, Dict, Any, Optional
 import numpy as np
 from qdrant_client import QdrantClient
-from qdrant_client.http import models
 from qdrant_client.http.models import Distance, VectorParams, PointStruct
 from dotenv import load_dotenv
 
+from .qdrant_connection import get_qdrant_client, HNSW_CONFIG, QUANTIZATION_CONFIG, SEARCH_PARAMS
+from .embeddings_manager import EMBEDDING_DIMENSIONS
+
 class QdrantManager:
     """
     Manager for Qdrant vector database operations.
     """
-    def __init__(self):
+    def __init__(self, client: Optional[QdrantClient] = None):
         load_dotenv()
         self.api_key = os.getenv('QDRANT_API_KEY')
         self.collection_name = "restaurant_collection"
-        self.embedding_size = 1536  # OpenAI Ada embedding size
+        self.embedding_size = EMBEDDING_DIMENSIONS
         
-        # Initialize Qdrant client
+        # Use the process-wide Qdrant client unless one is injected
         logging.info("Initializing Qdrant client")
         try:
-            if self.api_key:
-                # Use cloud Qdrant with API key
-                self.client = QdrantClient(
-                    api_key=self.api_key,
-                    url="https://16f1329c-7600-4be6-8dc1-376daff8d555.us-west-1-0.aws.cloud.qdrant.io",
-                    port=6333
-                )
-                logging.info("Connected to Qdrant cloud service")
-            else:
-                # Use local Qdrant
-                self.client = QdrantClient(":memory:")  # In-memory storage for testing
-                logging.info("Using in-memory Qdrant instance")
+            self.client = client or get_qdrant_client()
                 
             # Ensure collection exists
             self._create_collection_if_not_exists()
@@ -54,10 +45,8 @@ class QdrantManager:
                         size=self.embedding_size,
                         distance=Distance.COSINE
                     ),
-                    # Create payload indexes for faster filtering
-                    optimizers_config=models.OptimizersConfigDiff(
-                        indexing_threshold=0  # Index all vectors
-                    )
+                    hnsw_config=HNSW_CONFIG,
+                    quantization_config=QUANTIZATION_CONFIG
                 )
                 logging.info(f"Collection '{self.collection_name}' created successfully")
             else:
@@ -143,11 +132,12 @@ class QdrantManager:
             List of matching restaurants with their details
         """
         try:
-            logging.info(f"Searching for top {top_k} restaurants")
+            logging.debug("Searching for top %s restaurants", top_k)
             search_result = self.client.search(
                 collection_name=self.collection_name,
                 query_vector=query_embedding,
-                limit=top_k
+                limit=top_k,
+                search_params=SEARCH_PARAMS
             )
             
             # Extract restaurant data from search results
@@ -157,12 +147,41 @@ class QdrantManager:
                 restaurant['score'] = scored_point.score  # Add similarity score
                 restaurants.append(restaurant)
             
-            logging.info(f"Found {len(restaurants)} matching restaurants")
+            logging.debug("Found %s matching restaurants", len(restaurants))
             return restaurants
         except Exception as e:
             logging.error(f"Error searching restaurants: {e}")
             return []
     
+    def _flatten_menu_items(self, search_result, top_k: int) -> List[Dict]:
+        """
+        Flatten the menu items of scored restaurant points into ranked menu item results.
+        
+        Args:
+            search_result: Scored points from a restaurant search
+            top_k: Number of top results to return
+            
+        Returns:
+            List of matching menu items with restaurant info
+        """
+        menu_items_info = []
+        for scored_point in search_result:
+            restaurant = scored_point.payload
+            restaurant_id = restaurant.get('id')
+            restaurant_name = restaurant.get('name')
+            
+            for item in restaurant.get('items', []):
+                menu_items_info.append({
+                    'restaurant_id': restaurant_id,
+                    'restaurant_name': restaurant_name,
+                    'item': item,
+                    'score': scored_point.score  # Use restaurant score as initial ranking
+                })
+        
+        # Sort by score and take top_k
+        menu_items_info.sort(key=lambda x: x['score'], reverse=True)
+        return menu_items_info[:top_k]
+    
     def search_menu_items(self, query_embedding: List[float], top_k: int = 5) -> List[Dict]:
         """
         Search for specific menu items across all restaurants.
@@ -175,36 +194,57 @@ class QdrantManager:
             List of matching menu items with restaurant info
         """
         try:
-            logging.info(f"Searching for top {top_k} menu items")
+            logging.debug("Searching for top %s menu items", top_k)
             
             # First, get a larger set of restaurants that might have matching items
             search_result = self.client.search(
                 collection_name=self.collection_name,
                 query_vector=query_embedding,
-                limit=top_k * 3  # Get more restaurants to find the best menu items
+                limit=top_k * 3,  # Get more restaurants to find the best menu items
+                search_params=SEARCH_PARAMS
             )
             
-            # Extract and flatten menu items from search results
-            menu_items_info = []
-            for scored_point in search_result:
-                restaurant = scored_point.payload
-                restaurant_id = restaurant.get('id')
-                restaurant_name = restaurant.get('name')
-                
-                for item in restaurant.get('items', []):
-                    menu_items_info.append({
-                        'restaurant_id': restaurant_id,
-                        'restaurant_name': restaurant_name,
-                        'item': item,
-                        'score': scored_point.score  # Use restaurant score as initial ranking
-                    })
-            
-            # Sort by score and take top_k
-            menu_items_info.sort(key=lambda x: x['score'], reverse=True)
-            top_items = menu_items_info[:top_k]
-            
-            logging.info(f"Found {len(top_items)} matching menu items")
+            top_items = self._flatten_menu_items(search_result, top_k)
+            
+            logging.debug("Found %s matching menu items", len(top_items))
             return top_items
         except Exception as e:
             logging.error(f"Error searching menu items: {e}")
             return []
+    
+    def search_restaurants_and_menu_items(self, query_embedding: List[float], restaurant_top_k: int = 3, item_top_k: int = 5):
+        """
+        Search for restaurants and menu items with a single Qdrant request.
+        Both result sets come from the same collection and query vector, so one
+        search with the larger limit covers them.
+        
+        Args:
+            query_embedding: Embedding vector for the query
+            restaurant_top_k: Number of top restaurants to return
+            item_top_k: Number of top menu items to return
+            
+        Returns:
+            Tuple of (matching restaurants, matching menu items)
+        """
+        try:
+            logging.debug("Searching for top %s restaurants and top %s menu items", restaurant_top_k, item_top_k)
+            search_result = self.client.search(
+                collection_name=self.collection_name,
+                query_vector=query_embedding,
+                limit=max(restaurant_top_k, item_top_k * 3),
+                search_params=SEARCH_PARAMS
+            )
+            
+            restaurants = []
+            for scored_point in search_result[:restaurant_top_k]:
+                restaurant = scored_point.payload
+                restaurant['score'] = scored_point.score  # Add similarity score
+                restaurants.append(restaurant)
+            
+            top_items = self._flatten_menu_items(search_result[:item_top_k * 3], item_top_k)
+            
+            logging.debug("Found %s matching restaurants and %s matching menu items", len(restaurants), len(top_items))
+            return restaurants, top_items
+        except Exception as e:
+            logging.error(f"Error searching restaurants and menu items: {e}")
+            return [], []
@@ -1,20 +1,23 @@
 import os
 from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator
 import openai
 import json
 import logging
+import numpy as np
+from qdrant_client import QdrantClient
 
 from .document_loader import DocumentLoader
 from .text_processor import TextProcessor
 from .embeddings_manager import EmbeddingsManager
 from .qdrant_manager import QdrantManager
+from .llm_cache import cached_chat_completion
 
 class RestaurantRAG:
     """
     Specialized RAG system for restaurant and food data queries.
     """
-    def __init__(self):
+    def __init__(self, client: Optional[QdrantClient] = None):
         load_dotenv()
         self.api_key = os.getenv('OPENAI_API_KEY')
         logging.debug(f"OpenAI API key loaded: {'Present' if self.api_key else 'Missing'}")
@@ -22,7 +25,7 @@ class RestaurantRAG:
         self.loader = DocumentLoader('data/documents')
         self.processor = TextProcessor()
         self.embeddings_manager = EmbeddingsManager(self.api_key)
-        self.qdrant_manager = QdrantManager()
+        self.qdrant_manager = QdrantManager(client)
         self.restaurants_data = []
         
         # Initialize system
@@ -51,7 +54,7 @@ class RestaurantRAG:
         for i, restaurant in enumerate(restaurants):
             try:
                 # Basic restaurant info
-                logging.debug(f"Processing restaurant {i}: {restaurant.get('name', 'Unknown')}")
+                logging.debug("Processing restaurant %s: %s", i, restaurant.get('name', 'Unknown'))
                 restaurant_text = f"Restaurant ID: {restaurant.get('id')}\n"
                 restaurant_text += f"Name: {restaurant.get('name')}\n"
                 restaurant_text += f"Address: {restaurant.get('address')}\n"
@@ -59,7 +62,7 @@ class RestaurantRAG:
                 # Menu items
                 restaurant_text += "Menu items:\n"
                 items = restaurant.get('items', [])
-                logging.debug(f"Restaurant has {len(items)} menu items")
+                logging.debug("Restaurant has %s menu items", len(items))
                 for item in items:
                     restaurant_text += f"- {item.get('name')} - Price: {item.get('price')} VND\n"
                 
@@ -71,64 +74,115 @@ class RestaurantRAG:
         logging.info(f"Created {len(texts)} restaurant text representations")
         return texts
 
-    def search_restaurants(self, query: str, top_k: int = 3) -> List[Dict]:
+    def embed(self, text: str) -> np.ndarray:
+        """
+        Create the embedding vector for a piece of text
+        
+        Args:
+            text: The text to embed
+            
+        Returns:
+            Embedding as a numpy array
+        """
+        return self.embeddings_manager.embed_query(text)
+
+    def search_restaurants(self, query: str, top_k: int = 3, query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
         """
         Search for restaurants based on a query
         
         Args:
             query: The search query
             top_k: Number of top results to return
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             List of matching restaurants with their details
         """
         # Get query embedding
-        query_embedding = self.embeddings_manager.create_embeddings([query])[0]
+        if query_embedding is None:
+            query_embedding = self.embed(query)
         
         # Use Qdrant to find similar restaurants
         results = self.qdrant_manager.search_restaurants(query_embedding.tolist(), top_k)
         
         return results
     
-    def search_menu_items(self, query: str, top_k: int = 5) -> List[Dict]:
+    def search_menu_items(self, query: str, top_k: int = 5, query_embedding: Optional[np.ndarray] = None) -> List[Dict]:
         """
         Search for specific menu items across all restaurants
         
         Args:
             query: The search query
             top_k: Number of top results to return
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             List of matching menu items with restaurant info
         """
-        logging.info(f"Searching menu items for query: {query}")
+        logging.debug("Searching menu items for query: %s", query)
         
         # Get query embedding
-        logging.debug("Creating embedding for query")
-        query_embedding = self.embeddings_manager.create_embeddings([query])[0]
+        if query_embedding is None:
+            logging.debug("Creating embedding for query")
+            query_embedding = self.embed(query)
         
         # Use Qdrant to find similar menu items
         results = self.qdrant_manager.search_menu_items(query_embedding.tolist(), top_k)
         
-        logging.info(f"Returning {len(results)} menu item results")
+        logging.debug("Returning %s menu item results", len(results))
         return results
     
+    def batch_search(self, query: str, restaurant_top_k: int = 3, item_top_k: int = 5, query_embedding: Optional[np.ndarray] = None):
+        """
+        Search for restaurants and menu items with one embedding and one Qdrant request
+        
+        Args:
+            query: The search query
+            restaurant_top_k: Number of top restaurants to return
+            item_top_k: Number of top menu items to return
+            query_embedding: Precomputed embedding of the query, created if not given
+            
+        Returns:
+            Tuple of (matching restaurants, matching menu items)
+        """
+        if query_embedding is None:
+            query_embedding = self.embed(query)
+        return self.qdrant_manager.search_restaurants_and_menu_items(
+            query_embedding.tolist(), restaurant_top_k, item_top_k
+        )
+    
     # Similarity calculation is now handled by Qdrant
     
-    def answer_restaurant_query(self, query: str) -> str:
+    def answer_restaurant_query(self, query: str, query_embedding: Optional[np.ndarray] = None) -> str:
         """
         Answer a query about restaurants or food items using Qdrant vector database
         
         Args:
             query: The user's question about restaurants or food
+            query_embedding: Precomputed embedding of the query, created if not given
             
         Returns:
             A natural language response to the query
         """
         # Search for relevant restaurants and menu items from Qdrant
-        relevant_restaurants = self.search_restaurants(query, top_k=3)
-        relevant_menu_items = self.search_menu_items(query, top_k=5)
+        relevant_restaurants, relevant_menu_items = self.batch_search(
+            query, restaurant_top_k=3, item_top_k=5, query_embedding=query_embedding
+        )
         
+        return self.generate_restaurant_answer(query, relevant_restaurants, relevant_menu_items)["answer"]
+    
+    def _build_restaurant_messages(self, query: str, relevant_restaurants: List[Dict], relevant_menu_items: List[Dict]) -> List[Dict]:
+        """
+        Build the chat messages for answering a restaurant query from search results
+        
+        Args:
+            query: The user's question about restaurants or food
+            relevant_restaurants: Restaurants returned by the search
+            relevant_menu_items: Menu items returned by the search
+            
+        Returns:
+            List of chat messages for the OpenAI API
+        """
         # Prepare context
         context = "Restaurant information:\n"
         
@@ -155,25 +209,69 @@ class RestaurantRAG:
         # Create prompt
         prompt = f"""Context: {context}\n\nQuestion: {query}\n\nAnswer:"""
         
+        # Get the system prompt for restaurant context
+        from src.system_prompt import get_system_prompt_by_context
+        system_prompt = get_system_prompt_by_context("restaurant")
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+    
+    def generate_restaurant_answer(self, query: str, relevant_restaurants: List[Dict], relevant_menu_items: List[Dict]) -> Dict:
+        """
+        Generate an answer to a restaurant query from already retrieved search results
+        
+        Args:
+            query: The user's question about restaurants or food
+            relevant_restaurants: Restaurants returned by the search
+            relevant_menu_items: Menu items returned by the search
+            
+        Returns:
+            A dictionary containing the answer and relevant restaurants/menu items, with an
+            "error" key when OpenAI failed and the answer is an apology
+        """
         # Get response from OpenAI (using v0.28.1 format)
         try:
             logging.debug("Sending request to OpenAI for restaurant query")
-            # Get the system prompt for restaurant context
-            from src.system_prompt import get_system_prompt_by_context
-            system_prompt = get_system_prompt_by_context("restaurant")
-            
-            response = openai.ChatCompletion.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": prompt}
-                ]
-            )
-            
-            # Extract content from response (different format in v0.28.1)
-            answer = response['choices'][0]['message']['content']
-            logging.debug(f"Received answer from OpenAI: {answer[:50]}...")
-            return answer
+            answer = cached_chat_completion(self._build_restaurant_messages(query, relevant_restaurants, relevant_menu_items))
+            logging.debug("Received answer from OpenAI: %s...", answer[:50])
+            return {
+                "answer": answer,
+                "top_restaurants": relevant_restaurants,
+                "top_menu_items": relevant_menu_items
+            }
         except Exception as e:
             logging.error(f"Error getting response from OpenAI: {e}")
-            return "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này."
+            return {
+                "answer": "Xin lỗi, tôi không thể trả lời câu hỏi của bạn lúc này.",
+                "top_restaurants": [],
+                "top_menu_items": [],
+                "error": str(e)
+            }
+    
+    def stream_restaurant_answer(self, query: str, relevant_restaurants: List[Dict], relevant_menu_items: List[Dict]) -> Iterator[str]:
+        """
+        Stream an answer to a restaurant query from already retrieved search results
+        
+        Args:
+            query: The user's question about restaurants or food
+            relevant_restaurants: Restaurants returned by the search
+            relevant_menu_items: Menu items returned by the search
+            
+        Returns:
+            Iterator over pieces of the answer as OpenAI generates them
+            
+        Raises:
+            Exception: The OpenAI error when the request fails, possibly after some pieces
+        """
+        logging.debug("Streaming request to OpenAI for restaurant query")
+        response = openai.ChatCompletion.create(
+            model="gpt-4o",
+            messages=self._build_restaurant_messages(query, relevant_restaurants, relevant_menu_items),
+            stream=True
+        )
+        for chunk in response:
+            delta = chunk['choices'][0]['delta'].get('content')
+            if delta:
+                yield delta
@@ -0,0 +1,204 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+except ImportError:  # Fall back to a NumPy matrix-vector product
+    njit = None
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _cosine_scores(matrix, inv_norms, query_vector, query_inv_norm):
+        rows, dims = matrix.shape
+        scores = np.empty(rows, dtype=np.float32)
+        for i in prange(rows):
+            dot = 0
+            for j in range(dims):
+                dot += np.int32(matrix[i, j]) * np.int32(query_vector[j])
+            scores[i] = dot * inv_norms[i] * query_inv_norm
+        return scores
+else:
+    def _cosine_scores(matrix, inv_norms, query_vector, query_inv_norm):
+        return np.dot(matrix, query_vector.astype(np.int32)) * inv_norms * query_inv_norm
+
+def quantize(vector: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Quantize a vector to int8 with a symmetric per-vector scale.
+
+    Args:
+        vector: Float vector
+
+    Returns:
+        Tuple of (int8 vector, inverse L2 norm of the int8 vector), or (None, 0.0) for a zero vector
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    peak = np.abs(vector).max() if vector.size else 0.0
+    if not peak:
+        return None, 0.0
+    quantized = np.round(vector * (127.0 / peak)).astype(np.int8)
+    # The scale cancels out of the cosine, only the int8 norm is needed
+    return quantized, float(1.0 / np.linalg.norm(quantized.astype(np.float32)))
+
+def argmax_cosine(matrix: np.ndarray, inv_norms: np.ndarray, query_vector: np.ndarray, query_inv_norm: float) -> Tuple[int, float]:
+    """
+    Find the row of an int8 matrix most similar to an int8 query vector.
+
+    Args:
+        matrix: (N, D) int8 matrix of quantized vectors
+        inv_norms: (N,) float32 inverse norms of the rows (0 for unused rows)
+        query_vector: (D,) int8 quantized query vector
+        query_inv_norm: Inverse norm of the query vector
+
+    Returns:
+        Tuple of (row index, cosine similarity)
+    """
+    scores = _cosine_scores(matrix, inv_norms, query_vector, np.float32(query_inv_norm))
+    best = int(np.argmax(scores))
+    return best, float(scores[best])
+
+def warmup(dimensions: int = 1536):
+    """Compile the similarity kernel ahead of the first lookup."""
+    argmax_cosine(
+        np.ones((1, dimensions), dtype=np.int8),
+        np.ones(1, dtype=np.float32),
+        np.ones(dimensions, dtype=np.int8),
+        1.0
+    )
+
+class SemanticCache:
+    """
+    Bounded in-process cache of query responses keyed by question embedding.
+
+    A lookup returns the response stored for the most similar cached question
+    when its cosine similarity reaches the threshold, so near-duplicate
+    questions skip the RAG pipeline entirely.
+    """
+    def __init__(self, max_size: int = 2000, ttl: float = 600, threshold: float = 0.95):
+        """
+        Initialize the semantic cache.
+
+        Args:
+            max_size: Maximum number of cached responses (least recently used are evicted first)
+            ttl: Time in seconds a cached response stays valid
+            threshold: Minimum cosine similarity for a lookup to count as a hit
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+
+        # key -> (matrix row, response, expiry time)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Contiguous (capacity, D) int8 matrix of quantized vectors plus their inverse
+        # norms, grown by doubling. Rows of evicted entries are zeroed and reused.
+        self._matrix: Optional[np.ndarray] = None
+        self._inv_norms: Optional[np.ndarray] = None
+        self._size = 0
+        self._row_keys: List[Optional[str]] = []
+        self._free_rows: List[int] = []
+
+    def _remove(self, key: str):
+        row = self._entries.pop(key)[0]
+        self._matrix[row] = 0
+        self._inv_norms[row] = 0.0
+        self._row_keys[row] = None
+        self._free_rows.append(row)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        expired = [key for key, (_, _, expires_at) in self._entries.items() if expires_at <= now]
+        for key in expired:
+            self._remove(key)
+
+    def _allocate_row(self, dimensions: int) -> int:
+        if self._free_rows:
+            return self._free_rows.pop()
+
+        if self._matrix is None:
+            capacity = min(64, self.max_size)
+            self._matrix = np.zeros((capacity, dimensions), dtype=np.int8)
+            self._inv_norms = np.zeros(capacity, dtype=np.float32)
+        elif self._size == self._matrix.shape[0]:
+            capacity = min(self._size * 2, self.max_size)
+            grown = np.zeros((capacity, dimensions), dtype=np.int8)
+            grown[:self._size] = self._matrix
+            self._matrix = grown
+            grown_norms = np.zeros(capacity, dtype=np.float32)
+            grown_norms[:self._size] = self._inv_norms
+            self._inv_norms = grown_norms
+
+        row = self._size
+        self._size += 1
+        self._row_keys.append(None)
+        return row
+
+    def get(self, vector) -> Optional[Any]:
+        """
+        Look up the cached response for the most similar question.
+
+        Args:
+            vector: Embedding of the incoming question
+
+        Returns:
+            The cached response, or None on a miss
+        """
+        query_vector, query_inv_norm = quantize(vector)
+        if query_vector is None:
+            return None
+
+        with self._lock:
+            self._evict_expired()
+            if not self._entries:
+                return None
+
+            row, similarity = argmax_cosine(
+                self._matrix[:self._size], self._inv_norms[:self._size], query_vector, query_inv_norm
+            )
+            if similarity < self.threshold:
+                return None
+
+            key = self._row_keys[row]
+            self._entries.move_to_end(key)
+            logging.debug("Semantic cache hit with similarity %.3f", similarity)
+            return self._entries[key][1]
+
+    def put(self, key: str, vector, response: Any):
+        """
+        Store a response for a question.
+
+        Args:
+            key: The question text
+            vector: Embedding of the question
+            response: Response object to return on later hits
+        """
+        vector, inv_norm = quantize(vector)
+        if vector is None:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while len(self._entries) >= self.max_size:
+                self._remove(next(iter(self._entries)))
+
+            row = self._allocate_row(vector.shape[0])
+            self._matrix[row] = vector
+            self._inv_norms[row] = inv_norm
+            self._row_keys[row] = key
+            self._entries[key] = (row, response, time.monotonic() + self.ttl)
+
+    def clear(self):
+        """Drop all cached responses."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+            self._inv_norms = None
+            self._size = 0
+            self._row_keys = []
+            self._free_rows = []
@@ -48,7 +48,7 @@ class WebSearch:
                     "search_results": []
                 }
             
-            logging.info(f"Performing web search for: {query}")
+            logging.debug("Performing web search for: %s", query)
             
             # Use OpenAI's API to perform a web search
             response = openai.ChatCompletion.create(
@@ -0,0 +1,81 @@
+import io
+from decimal import Decimal
+
+import pandas as pd
+
+from ingest_orders_data_to_qdrant import create_order_texts
+
+# Orders as they come from MySQL, with NULLs in integer columns. The expected texts are the
+# ones the per-order text builder produced, and the keys of their cached embeddings.
+ORDERS = [
+    {
+        'id': 1, 'user_id': None, 'user_name': 'A', 'type_order_id': 1, 'orderstatus_id': 2,
+        'payment_method_code': 'cash', 'latitude': 10.5, 'longitude': 106.1,
+        'total': Decimal('50000.00'), 'created_at': '2024-01-01T10:00:00',
+        'distance': None, 'point_delivery_id': 5, 'note': ''
+    },
+    {
+        'id': 2, 'user_id': 7, 'user_name': None, 'type_order_id': 2, 'orderstatus_id': None,
+        'payment_method_code': None, 'latitude': None, 'longitude': None,
+        'total': 0, 'created_at': None,
+        'distance': 3, 'point_delivery_id': None, 'note': 'x'
+    }
+]
+
+EXPECTED_TEXTS = [
+    "Order ID: 1\nUser ID: None\nUser Name: A\nOrder Type ID: 1\nStatus ID: 2\n"
+    "Payment Method: cash\nLocation: 10.5, 106.1\nTotal: 50000.00\n"
+    "Created At: 2024-01-01T10:00:00\nPoint Delivery Id: 5\n",
+    "Order ID: 2\nUser ID: 7\nOrder Type ID: 2\nStatus ID: None\n"
+    "Payment Method: None\nDistance: 3\nNote: x\n"
+]
+
+# Orders loaded from the CSV fallback, as load_orders_from_csv reads them: empty cells are NaN,
+# which the per-order builder printed as "nan" since NaN is truthy
+ORDERS_CSV = """id,user_id,user_name,type_order_id,orderstatus_id,payment_method_code,latitude,longitude,total,distance,point_delivery_id,note
+3,,B,1,2,cash,10.5,106.1,50000,,5,
+4,9,,2,,momo,,,0,2.5,,hi
+"""
+
+EXPECTED_CSV_TEXTS = [
+    "Order ID: 3\nUser ID: nan\nUser Name: B\nOrder Type ID: 1\nStatus ID: 2.0\n"
+    "Payment Method: cash\nLocation: 10.5, 106.1\nTotal: 50000\nDistance: nan\nNote: nan\n"
+    "Point Delivery Id: 5.0\n",
+    "Order ID: 4\nUser ID: 9.0\nUser Name: nan\nOrder Type ID: 2\nStatus ID: nan\n"
+    "Payment Method: momo\nLocation: nan, nan\nDistance: 2.5\nNote: hi\nPoint Delivery Id: nan\n"
+]
+
+# Orders loaded from the JSON fallback, whose records don't all have the same fields.
+# A missing field reads as "Unknown", or is left out, as in the per-order builder.
+ORDERS_JSON = [
+    {'id': 5, 'user_name': 'C', 'service_type': 'Hotel', 'total': 100},
+    {'user_id': 8, 'status': 'Pending', 'latitude': 1.0, 'longitude': 2.0},
+    {'id': 'x7', 'type_order_id': 3}
+]
+
+EXPECTED_JSON_TEXTS = [
+    "Order ID: 5\nUser ID: Unknown\nUser Name: C\nService Type: Hotel\nStatus ID: Unknown\n"
+    "Payment Method: Unknown\nTotal: 100\n",
+    "Order ID: Unknown\nUser ID: 8\nOrder Type ID: Unknown\nStatus: Pending\n"
+    "Payment Method: Unknown\nLocation: 1.0, 2.0\n",
+    "Order ID: x7\nUser ID: Unknown\nOrder Type ID: 3\nStatus ID: Unknown\nPayment Method: Unknown\n"
+]
+
+def test_order_texts_with_null_ints():
+    assert create_order_texts(ORDERS) == EXPECTED_TEXTS
+
+def test_order_texts_from_csv():
+    orders = pd.read_csv(io.StringIO(ORDERS_CSV)).to_dict(orient='records')
+    assert create_order_texts(orders) == EXPECTED_CSV_TEXTS
+
+def test_order_texts_from_ragged_json():
+    assert create_order_texts(ORDERS_JSON) == EXPECTED_JSON_TEXTS
+
+def main():
+    test_order_texts_with_null_ints()
+    test_order_texts_from_csv()
+    test_order_texts_from_ragged_json()
+    print("Order texts match")
+
+if __name__ == "__main__":
+    main()